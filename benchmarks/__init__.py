@@ -0,0 +1,32 @@
+"""
+benchmarks - timing harness for decocare's hot paths.
+
+Each module here exposes run( ), returning a list of results, and can be
+run on its own, eg::
+
+  python -m benchmarks.bench_crc
+
+or all together, against a stored baseline, with ``python -m benchmarks``.
+"""
+import timeit
+
+def timed (name, func, number=1000, repeat=3, **extra):
+  """
+  Time func, best of repeat runs of number calls each.
+  Returns a result dict with seconds per call.
+  """
+  best = min(timeit.repeat(func, number=number, repeat=repeat))
+  result = dict(name=name, seconds=best / number, number=number)
+  result.update(extra)
+  return result
+
+def speedup (results, name, reference):
+  """
+  How many times faster name ran than reference.
+  """
+  times = dict([ (r['name'], r['seconds']) for r in results ])
+  return times[reference] / times[name]
+
+def report (results):
+  for result in results:
+    print '{name:<40} {usec:>12.2f} usec/call'.format(usec=result['seconds'] * 1e6, **result)
@@ -0,0 +1,121 @@
+"""
+Run every benchmark, write the results as JSON and compare them to a
+stored baseline::
+
+  python -m benchmarks                    # run all, compare to baseline
+  python -m benchmarks crc history        # just bench_crc, bench_history
+  python -m benchmarks --out results.json
+  python -m benchmarks --save             # make these the new baseline
+
+A result is a regression when it takes more than --threshold longer
+per call than its baseline, 25% by default; any regression makes the
+exit status 1.  Timings only compare on the machine and python the
+baseline was recorded with, so re-record it with --save after moving.
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+import platform
+import importlib
+
+from benchmarks import report
+
+HERE = os.path.dirname(__file__)
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+SUITES = [ 'crc', '4b6b', 'times', 'history', 'records', 'cgm',
+           'cgm_vectorized', 'columns', 'download', 'replay', 'pipeline' ]
+
+def run (names):
+  results = [ ]
+  for name in names:
+    module = importlib.import_module('benchmarks.bench_%s' % name)
+    if not getattr(module, 'available', True):
+      print >>sys.stderr, "skipping %s, not available here" % name
+      continue
+    for result in module.run( ):
+      result.update(suite=name)
+      results.append(result)
+  return results
+
+def environment ( ):
+  return dict(python=platform.python_version( ), machine=platform.machine( ),
+              platform=platform.platform( ))
+
+def load (path):
+  with open(path) as f:
+    return json.load(f)
+
+def save (results, path):
+  with open(path, 'w') as out:
+    json.dump(dict(environment=environment( ), results=results), out,
+              indent=2, sort_keys=True)
+    out.write("\n")
+
+def compare (results, baseline, threshold):
+  """
+  Compare results to a baseline, returning a list of (name, ratio,
+  regressed) for each result named in both.
+
+  >>> base = [ dict(name='a', seconds=1.0), dict(name='b', seconds=1.0) ]
+  >>> compare([ dict(name='a', seconds=1.5), dict(name='c', seconds=1.0) ], base, .25)
+  [('a', 1.5, True)]
+  """
+  known = dict([ (r['name'], r['seconds']) for r in baseline ])
+  compared = [ ]
+  for result in results:
+    before = known.get(result['name'], None)
+    if not before:
+      continue
+    ratio = result['seconds'] / before
+    compared.append((result['name'], ratio, ratio > 1 + threshold))
+  return compared
+
+def get_parser ( ):
+  parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                   description=__doc__.split("\n")[1],
+                                   formatter_class=argparse.RawDescriptionHelpFormatter,
+                                   epilog=__doc__)
+  parser.add_argument('suites', nargs='*', metavar='suite',
+                      help="Which benchmarks to run, of %s [default: all]" % ', '.join(SUITES))
+  parser.add_argument('--baseline', default=BASELINE,
+                      help="[default: %(default)s]")
+  parser.add_argument('--threshold', type=float, default=.25,
+                      help="Slowdown that counts as a regression [default: %(default)s]")
+  parser.add_argument('--out', default=None,
+                      help="Write results here as JSON")
+  parser.add_argument('--save', action='store_true',
+                      help="Store these results as the baseline")
+  return parser
+
+def main (args):
+  logging.basicConfig(stream=sys.stderr, level=logging.CRITICAL)
+  results = run(args.suites or SUITES)
+  report(results)
+  if args.out:
+    save(results, args.out)
+  if args.save:
+    save(results, args.baseline)
+    print "saved baseline to %s" % args.baseline
+    return 0
+  if not os.path.exists(args.baseline):
+    print "no baseline at %s, record one with --save" % args.baseline
+    return 0
+  regressions = 0
+  for name, ratio, regressed in compare(results, load(args.baseline)['results'], args.threshold):
+    regressions += regressed
+    print '{name:<40} {ratio:>8.2f}x baseline{flag}'.format(name=name, ratio=ratio,
+                                                            flag=regressed and '  REGRESSION' or '')
+  if regressions:
+    print "%s regressions beyond %d%%" % (regressions, args.threshold * 100)
+  return regressions and 1 or 0
+
+if __name__ == '__main__':
+  parser = get_parser( )
+  args = parser.parse_args( )
+  unknown = set(args.suites) - set(SUITES)
+  if unknown:
+    parser.error("unknown benchmarks: %s" % ', '.join(sorted(unknown)))
+  sys.exit(main(args))
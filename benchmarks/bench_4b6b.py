@@ -0,0 +1,92 @@
+"""
+bench_4b6b - table driven encodeDC/decodeDC against the bitwise loops
+they replaced.
+
+The reference implementations are kept here, verbatim apart from
+names, both to time against and to check that the table driven
+versions produce identical output.
+"""
+import random
+from decocare import lib
+from benchmarks import timed, speedup, report
+
+def reference_encodeDC (msg):
+  msg = bytearray(msg)
+  nibbles = [ ]
+  result = [ ]
+  for b in msg:
+    highNibble = b >> 4 & 0xF
+    lowNibble  = b & 0xF
+    dcValue1   = lib.ENCODE_TABLE[highNibble]
+    dcValue2   = lib.ENCODE_TABLE[lowNibble]
+    nibbles.append(dcValue1 >> 2)
+    high2Bits = dcValue1 & 0x3
+    low2Bits  = dcValue2 >> 4 & 0x3
+    nibbles.append( high2Bits << 2 | low2Bits )
+    nibbles.append( dcValue2 & 0xF )
+  for i in xrange(0, len(nibbles), 2):
+    high, low = nibbles[i], 5
+    if i < len(nibbles) - 1:
+      low = nibbles[i+1]
+    result.append(lib.makeByte(high, low))
+  return bytearray(result)
+
+def reference_decodeDC (msg):
+  msg = bytearray(msg)
+  result      = [ ]
+  nibbleCount =  0
+  bitCount    =  0
+  sixBitValue =  0
+  highNibble  =  0
+  for B in msg:
+    bP = 7
+    while bP >= 0:
+      bitValue = B >> bP & 0x1
+      sixBitValue = sixBitValue << 1 | bitValue
+      bitCount += 1
+      if bitCount != 6:
+        bP -= 1
+        continue
+      nibbleCount += 1
+      if nibbleCount == 1:
+        highNibble = lib.ENCODE_TABLE.index(sixBitValue)
+      else:
+        lowNibble = lib.ENCODE_TABLE.index(sixBitValue)
+        result.append(lib.makeByte(highNibble, lowNibble))
+        nibbleCount = 0
+      sixBitValue = 0
+      bitCount    = 0
+      bP -= 1
+  return bytearray(result)
+
+def corpus (count=100, seed=4):
+  """
+  Random frames of the sizes seen on air, 1 to 71 bytes.
+  """
+  rand = random.Random(seed)
+  return [ bytearray([ rand.randint(0, 255) for i in xrange(rand.randint(1, 71)) ])
+           for n in xrange(count) ]
+
+def check (frames):
+  encoded = map(reference_encodeDC, frames)
+  assert lib.encodeDCFrames(frames) == encoded
+  assert lib.decodeDCFrames(encoded) == map(reference_decodeDC, encoded)
+
+def run (number=20):
+  frames = corpus( )
+  check(frames)
+  encoded = map(reference_encodeDC, frames)
+  count = len(frames)
+  results = [
+    timed('4b6b.encode.python', lambda: map(reference_encodeDC, frames), number=number, frames=count),
+    timed('4b6b.encode', lambda: lib.encodeDCFrames(frames), number=number, frames=count),
+    timed('4b6b.decode.python', lambda: map(reference_decodeDC, encoded), number=number, frames=count),
+    timed('4b6b.decode', lambda: lib.decodeDCFrames(encoded), number=number, frames=count),
+  ]
+  return results
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  print 'encode speedup: %.1fx' % speedup(results, '4b6b.encode', '4b6b.encode.python')
+  print 'decode speedup: %.1fx' % speedup(results, '4b6b.decode', '4b6b.decode.python')
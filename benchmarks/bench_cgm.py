@@ -0,0 +1,34 @@
+"""
+bench_cgm - glucose page decoding throughput.
+
+Decodes every page in page_10-18_glucose.data, reporting time per page
+and records per second.
+"""
+import os
+from decocare import cgm
+from benchmarks import timed, report
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'page_10-18_glucose.data')
+
+def corpus ( ):
+  with open(FIXTURE, 'rb') as f:
+    blob = f.read( )
+  return [ blob[i:i+1024] for i in xrange(0, len(blob), 1024) ]
+
+def decode_all (pages):
+  return [ cgm.PagedData.Data(page).decode( ) for page in pages ]
+
+def run (number=10):
+  pages = corpus( )
+  count = sum(map(len, decode_all(pages)))
+  result = timed('cgm.decode', lambda: decode_all(pages), number=number,
+                 pages=len(pages), records=count)
+  result['seconds'] = result['seconds'] / len(pages)
+  result['records_per_second'] = count / (result['seconds'] * len(pages))
+  return [ result ]
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  for result in results:
+    print '{name}: {records_per_second:.0f} records/second'.format(**result)
@@ -0,0 +1,43 @@
+"""
+bench_cgm_vectorized - scalar and numpy decoding of the glucose pages
+into time, sgv and opcode for every record.
+
+The fixture's 9 pages are repeated to make about 30 days of pages.
+"""
+import os
+from decocare import cgm
+from decocare.cgm import vectorized
+from benchmarks import timed, speedup, report
+
+available = vectorized.numpy is not None
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'page_10-18_glucose.data')
+
+def corpus (copies=10):
+  with open(FIXTURE, 'rb') as f:
+    blob = f.read( )
+  return [ blob[i:i+1024] for i in xrange(0, len(blob), 1024) ] * copies
+
+def scalar (pages):
+  rows = [ ]
+  for page in pages:
+    for record in cgm.PagedData.Data(bytearray(page)).decode( ):
+      rows.append((record.get('date'), record.get('sgv', 0), record['op']))
+  return rows
+
+def run (number=5):
+  pages = corpus( )
+  count = len(scalar(pages))
+  return [
+    timed('cgm.decode.scalar', lambda: scalar(pages), number=number,
+          pages=len(pages), records=count),
+    timed('cgm.decode.vectorized', lambda: vectorized.decode_pages(pages),
+          number=number, pages=len(pages), records=count),
+  ]
+
+if __name__ == '__main__':
+  if not available:
+    raise SystemExit("numpy is not installed")
+  results = run( )
+  report(results)
+  print 'speedup: %.1fx' % speedup(results, 'cgm.decode.vectorized', 'cgm.decode.scalar')
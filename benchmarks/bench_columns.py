@@ -0,0 +1,64 @@
+"""
+bench_columns - loading 90 days of sensor data, as JSON and as an
+mmapped column file.
+
+The fixture's 9 glucose pages are repeated to cover about 90 days of
+5 minute readings, then stored both ways; loading reads the sgv and
+time of every record back.
+"""
+import os
+import json
+import shutil
+import tempfile
+from decocare import cgm
+from decocare.cgm import columns
+from benchmarks import timed, speedup, report
+
+FIXTURE = 'page_10-18_glucose.data'
+
+def corpus (days=90):
+  with open(FIXTURE, 'rb') as f:
+    blob = f.read( )
+  records = [ ]
+  for i in xrange(0, len(blob), 1024):
+    records.extend(cgm.PagedData.Data(bytearray(blob[i:i+1024])).decode( ))
+  needed = days * 24 * 12
+  return (records * (needed / len(records) + 1))[:needed]
+
+def load_json (path):
+  with open(path) as f:
+    records = json.load(f)
+  return [ (r.get('date'), r.get('sgv')) for r in records ]
+
+def load_columns (path):
+  stored = columns.Columns(path)
+  values = stored.time( ), stored.sgv( )
+  stored.close( )
+  return values
+
+def run (number=5):
+  records = corpus( )
+  tmp = tempfile.mkdtemp( )
+  try:
+    as_json = os.path.join(tmp, 'glucose.json')
+    as_columns = os.path.join(tmp, 'glucose.columns')
+    with open(as_json, 'w') as out:
+      json.dump(records, out)
+    with open(as_columns, 'wb') as out:
+      columns.write(records, out)
+    results = [
+      timed('columns.load.json', lambda: load_json(as_json), number=number,
+            records=len(records), bytes=os.path.getsize(as_json)),
+      timed('columns.load.mmap', lambda: load_columns(as_columns), number=number,
+            records=len(records), bytes=os.path.getsize(as_columns)),
+    ]
+  finally:
+    shutil.rmtree(tmp)
+  return results
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  for result in results:
+    print '%s: %s bytes' % (result['name'], result['bytes'])
+  print 'load speedup: %.1fx' % speedup(results, 'columns.load.mmap', 'columns.load.json')
@@ -0,0 +1,42 @@
+"""
+bench_crc - CRC16CCITT and CRC8 backends against the pure python loops.
+
+Pages are the 1024 byte glucose pages in page_10-18_glucose.data,
+frames are 64 byte slices of the same.
+"""
+import os
+from decocare import lib
+from benchmarks import timed, speedup, report
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'page_10-18_glucose.data')
+
+def corpus ( ):
+  with open(FIXTURE, 'rb') as f:
+    return bytearray(f.read( ))
+
+def run (number=200):
+  blob = corpus( )
+  page = blob[:1022]
+  frame = blob[:64]
+  pages = len(blob) / 1024
+  results = [
+    timed('crc16.page.python', lambda: lib.CRC16CCITT.compute_python(page), number=number),
+    timed('crc16.page', lambda: lib.CRC16CCITT.compute(page), number=number),
+    timed('crc16.verify_pages.python',
+          lambda: [ lib.CRC16CCITT.compute_python(blob[i:i+1022]) == lib.BangInt(blob[i+1022:i+1024])
+                    for i in xrange(0, len(blob), 1024) ],
+          number=number / 10, pages=pages),
+    timed('crc16.verify_pages', lambda: lib.CRC16CCITT.verify_pages(blob),
+          number=number / 10, pages=pages),
+    timed('crc8.frame.python', lambda: lib.CRC8.compute_python(frame), number=number * 10),
+    timed('crc8.frame', lambda: lib.CRC8.compute(frame), number=number * 10,
+          backend=lib._crc8 and 'extension' or 'python'),
+  ]
+  return results
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  print 'crc16 page speedup: %.1fx' % speedup(results, 'crc16.page', 'crc16.page.python')
+  print 'crc16 bulk speedup: %.1fx' % speedup(results, 'crc16.verify_pages', 'crc16.verify_pages.python')
+  print 'crc8 frame speedup: %.1fx' % speedup(results, 'crc8.frame', 'crc8.frame.python')
@@ -0,0 +1,42 @@
+"""
+bench_download - Stick.download of whole 16 frame pages from the
+simulator, with instant radio timing, so what is timed is the stick's
+own work: polling, framing, CRCs and reassembly.
+
+The pump serves the 1024 byte pages in page_10-18_glucose.data as its
+history.
+"""
+import os
+from decocare import commands
+from decocare import simulator
+from benchmarks import timed, report
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', 'page_10-18_glucose.data')
+
+def open_session (adaptive=True):
+  with open(FIXTURE, 'rb') as f:
+    pages = simulator.split_pages(f.read( ))
+  pump = simulator.SimulatedPump(history=pages)
+  return simulator.open_pump(pump, adaptive=adaptive), pages
+
+def download (session, page):
+  command = commands.ReadHistoryData(serial=session.serial, page=page)
+  session.stick.transmit_packet(command)
+  return session.stick.download( )
+
+def run (number=5):
+  session, pages = open_session( )
+  assert download(session, 1) == pages[1]
+  frames = len(session.stick.latencies)
+  results = [
+    timed('download.page', lambda: [ download(session, n) for n in xrange(len(pages)) ],
+          number=number, pages=len(pages), frames=frames),
+  ]
+  results[0]['seconds'] = results[0]['seconds'] / len(pages)
+  return results
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  for result in results:
+    print '{name}: {frames} frames/page, {rate:.0f} pages/second'.format(rate=1 / result['seconds'], **result)
@@ -0,0 +1,80 @@
+"""
+bench_history - history page decoding throughput.
+
+Decodes a few hundred synthetic pages from simulator.make_history_page,
+with HistoryPage.decode and with the stream based decoder it replaced,
+kept here for reference.
+"""
+import io
+from datetime import datetime
+from decocare import lib
+from decocare import history
+from decocare import models
+from decocare import simulator
+from benchmarks import timed, speedup, report
+
+def reference_decode (page, model):
+  stream = io.BufferedReader(io.BytesIO(bytearray(page[:1022])))
+  records = [ ]
+  skipped = [ ]
+  for B in iter(lambda: bytearray(stream.read(2)), bytearray("")):
+    if B == bytearray( [ 0x00, 0x00 ] ):
+      if skipped:
+        if len(records) > 0:
+          last = records[-1]
+          last.update(appended=last.get('appended', [ ]) + skipped)
+        skipped = [ ]
+      break
+    record = history.parse_record(stream, B, model=model)
+    data = record.decode( )
+    if record.datetime:
+      rec = dict(timestamp=record.datetime.isoformat( ),
+                 _type=str(record.__class__.__name__),
+                 _body=lib.hexlify(record.body),
+                 _head=lib.hexlify(record.head),
+                 _date=lib.hexlify(record.date),
+                 _description=str(record))
+      if data is not None:
+        rec.update(data)
+        if skipped:
+          rec.update(appended=skipped)
+          skipped = [ ]
+      records.append(rec)
+    else:
+      rec = dict(_type=str(record.__class__.__name__),
+                 _body=lib.hexlify(record.body),
+                 _head=lib.hexlify(record.head),
+                 _date=lib.hexlify(record.date),
+                 _description=str(record))
+      data = record.decode( )
+      if data is not None:
+        rec.update(data=data)
+      skipped.append(rec)
+  records.reverse( )
+  return records
+
+def corpus (count=200, model='522'):
+  model = models.lookup(model, None)
+  pages = [ simulator.make_history_page(model, seed=seed, start=datetime(2015, 6, 1))
+            for seed in xrange(count) ]
+  return model, pages
+
+def run (number=1, count=200):
+  model, pages = corpus(count)
+  records = sum([ len(history.HistoryPage(page, model).decode( )) for page in pages ])
+  results = [
+    timed('history.decode.stream',
+          lambda: [ reference_decode(page, model) for page in pages ],
+          number=number, pages=count, records=records),
+    timed('history.decode',
+          lambda: [ history.HistoryPage(page, model).decode( ) for page in pages ],
+          number=number, pages=count, records=records),
+  ]
+  return results
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  for result in results:
+    print '{name}: {rate:.0f} pages/second'.format(rate=result['pages'] / result['seconds'], **result)
+  print 'decode speedup: %.1fx' % speedup(results, 'history.decode', 'history.decode.stream')
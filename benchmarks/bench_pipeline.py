@@ -0,0 +1,35 @@
+"""
+bench_pipeline - glucose page downloads, fetching and decoding in
+turn, against fetching ahead on a thread while decoding.
+
+Pages come from the simulator, with radio timing roughly that of a
+real stick, so most of the time is spent waiting on the radio; the
+pipeline hides the decoding behind it.
+"""
+from decocare import simulator
+from benchmarks import timed, speedup, report
+
+FIXTURE = 'page_10-18_glucose.data'
+
+def open_model ( ):
+  with open(FIXTURE, 'rb') as f:
+    pages = simulator.split_pages(f.read( ))
+  pump = simulator.SimulatedPump(glucose=dict(zip(range(10, 19), pages)))
+  session = simulator.open_pump(pump, latency=.050, frame_time=.010)
+  return session.model
+
+def run (number=1):
+  model = open_model( )
+  assert list(model.iter_glucose_pages(pipeline=2)) == list(model.iter_glucose_pages( ))
+  results = [
+    timed('pipeline.sequential', lambda: list(model.iter_glucose_pages( )),
+          number=number, repeat=1, pages=9),
+    timed('pipeline.threaded', lambda: list(model.iter_glucose_pages(pipeline=2)),
+          number=number, repeat=1, pages=9),
+  ]
+  return results
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  print 'speedup: %.2fx' % speedup(results, 'pipeline.threaded', 'pipeline.sequential')
@@ -0,0 +1,69 @@
+"""
+bench_records - memory held by decoded history, as dicts and as
+compact HistoryRecords.
+
+Sizes are measured by walking the decoded objects with sys.getsizeof,
+counting every object once, so they don't depend on the allocator.
+"""
+import sys
+from datetime import datetime
+from decocare import history
+from decocare import models
+from decocare import simulator
+from benchmarks import timed, report
+
+def deep_size (obj, seen=None):
+  """
+  Bytes held by obj and everything it refers to, counted once.
+  Classes, functions and model objects are shared, and left out.
+  """
+  seen = seen if seen is not None else set( )
+  if id(obj) in seen or isinstance(obj, (type, models.PumpModel)):
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    size += sum([ deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items( ) ])
+  elif isinstance(obj, (list, tuple, set)):
+    size += sum([ deep_size(item, seen) for item in obj ])
+  elif hasattr(obj, '__slots__'):
+    size += sum([ deep_size(getattr(obj, name), seen) for name in obj.__slots__ ])
+  return size
+
+# the everyday therapy records that fill most pages
+TYPICAL = [ history.Bolus.opcode, history.BolusWizard.opcode,
+            history.TempBasal.opcode, history.TempBasalDuration.opcode,
+            history.BasalProfileStart.opcode, history.BGReceived.opcode,
+            history.CalBGForPH.opcode, history.Prime.opcode,
+            history.Rewind.opcode, history.PumpSuspend.opcode,
+            history.PumpResume.opcode, history.LowReservoir.opcode,
+            history.JournalEntryMealMarker.opcode, history.AlarmSensor.opcode,
+            history.ResultDailyTotal.opcode, ]
+
+def corpus (count=500, model='522', opcodes=TYPICAL):
+  model = models.lookup(model, None)
+  pages = [ simulator.make_history_page(model, seed=seed, start=datetime(2015, 6, 1),
+                                        opcodes=opcodes)
+            for seed in xrange(count) ]
+  return model, pages
+
+def run (number=1, count=500):
+  model, pages = corpus(count)
+  decoders = [ history.HistoryPage(page, model) for page in pages ]
+  dicts = [ rec for decoder in decoders for rec in decoder.decode( ) ]
+  compact = [ rec for decoder in decoders for rec in decoder.records( ) ]
+  results = [
+    timed('records.dicts', lambda: [ decoder.decode( ) for decoder in decoders ],
+          number=number, pages=count, records=len(dicts), bytes=deep_size(dicts)),
+    timed('records.compact', lambda: [ decoder.records( ) for decoder in decoders ],
+          number=number, pages=count, records=len(compact), bytes=deep_size(compact)),
+  ]
+  return results
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  for result in results:
+    print '{name}: {bytes} bytes, {per:.0f} bytes/record'.format(per=result['bytes'] / float(result['records']), **result)
+  sizes = dict([ (r['name'], r['bytes']) for r in results ])
+  print 'memory saved: %.1fx' % (sizes['records.dicts'] / float(sizes['records.compact']))
@@ -0,0 +1,70 @@
+"""
+bench_replay - a whole session, stick open, model and every history
+page, played back at full speed from a wire capture.
+
+The capture is recorded from the simulator serving the pages in
+page_10-18_glucose.data, unless $DECOCARE_REPLAY names a capture of a
+real session, made with --capture, to replay instead.  A real capture
+replays the pages it asked for, and only while the stick being timed
+makes the same exchanges, give or take polls.
+"""
+import os
+import tempfile
+from decocare import stick
+from decocare import session
+from decocare import capture
+from decocare import commands
+from decocare import simulator
+from benchmarks import timed, report
+from benchmarks.bench_download import FIXTURE
+
+def record (path, pages):
+  recorded = simulator.SimulatedLink(simulator.SimulatedPump(history=pages), latency=0)
+  recorded.capture_to(capture.Capture(path))
+  replay(recorded, len(pages))
+  recorded.capture.close( )
+
+def replay (device, count):
+  uart = stick.Stick(device, adaptive=True)
+  uart.open( )
+  pump = session.Pump(uart, '208850')
+  pump.read_model( )
+  return [ pump.query(commands.ReadHistoryData, page=n).data for n in xrange(count) ]
+
+# a TransmitPacket carries the pump command's opcode after its head,
+# the serial and six bytes of framing
+OPCODE = len(stick.TransmitPacket.code) + 3 + 6
+
+def pages_in (path):
+  head = bytearray(stick.TransmitPacket.code)
+  return len([ data for when, direction, data in capture.frames(path)
+               if direction == capture.WRITE and data[:len(head)] == head
+               and data[OPCODE] == commands.ReadHistoryData.code ])
+
+def run (number=3):
+  path = os.environ.get('DECOCARE_REPLAY', None)
+  if path:
+    count = pages_in(path)
+  else:
+    with open(FIXTURE, 'rb') as f:
+      pages = simulator.split_pages(f.read( ))
+    fd, path = tempfile.mkstemp(suffix='.capture')
+    os.close(fd)
+    record(path, pages)
+    count = len(pages)
+    assert replay(capture.ReplayLink(path), count) == pages
+  try:
+    frames = len(list(capture.frames(path)))
+    return [
+      timed('replay.session', lambda: replay(capture.ReplayLink(path), count),
+            number=number, pages=count, frames=frames),
+    ]
+  finally:
+    if 'DECOCARE_REPLAY' not in os.environ:
+      os.remove(path)
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  for result in results:
+    print '{name}: {frames} frames, {pages} pages, {rate:.1f} sessions/second'.format(rate=1 / result['seconds'], **result)
@@ -0,0 +1,43 @@
+"""
+bench_times - records.times.parse_date over the 5 byte dates of history
+records.
+
+Dates are taken from a couple of hundred synthetic pages from
+simulator.make_history_page, along with as many random 5 byte strings,
+most of which are not valid dates.
+"""
+import random
+from datetime import datetime
+from decocare import history
+from decocare import models
+from decocare import simulator
+from decocare.records import times
+from benchmarks import timed, report
+
+def corpus (count=200, seed=5):
+  model = models.lookup('522', None)
+  dates = [ ]
+  for n in xrange(count):
+    page = simulator.make_history_page(model, seed=n, start=datetime(2015, 6, 1))
+    for record in history.HistoryPage(page, model).decode( ):
+      if len(record['_date']) == 10:
+        dates.append(bytearray(record['_date'].decode('hex')))
+  rand = random.Random(seed)
+  noise = [ bytearray([ rand.randint(0, 255) for i in xrange(5) ]) for date in dates ]
+  return dates, noise
+
+def run (number=20):
+  dates, noise = corpus( )
+  results = [
+    timed('times.parse_date', lambda: map(times.parse_date, dates),
+          number=number, dates=len(dates)),
+    timed('times.parse_date.noise', lambda: map(times.parse_date, noise),
+          number=number, dates=len(noise)),
+  ]
+  return results
+
+if __name__ == '__main__':
+  results = run( )
+  report(results)
+  for result in results:
+    print '{name}: {rate:.0f} dates/second'.format(rate=result['dates'] / result['seconds'], **result)
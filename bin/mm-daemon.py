@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# PYTHON_ARGCOMPLETE_OK
+
+from decocare.helpers import cli
+from decocare import daemon
+from decocare import rfsession
+
+class DaemonApp (cli.CommandApp):
+  """ %(prog)s - keep the stick open, and share the pump over a socket
+
+  Open the stick and the pump once, then answer queries on a Unix
+  socket until interrupted.  Point other tools at it with
+  --daemon SOCKET, or $DECOCARE_DAEMON, so they skip the prelude.
+  The pump is woken again for --rf-minutes whenever its RF session
+  lapses.
+  """
+  def customize_parser (self, parser):
+    parser.add_argument('socket',
+                        help="Listen on this Unix socket"
+                        )
+    return parser
+
+  def prelude (self, args):
+    # this is the daemon, it opens the stick itself
+    args.daemon = None
+    super(DaemonApp, self).prelude(args)
+    if getattr(self.pump, 'model', None) is None:
+      self.sniff_model( )
+
+  def main (self, args):
+    if args.dryrun:
+      print "#### dry run, not listening on", args.socket
+      return
+    sessions = getattr(self, 'sessions', None) or rfsession.RFSessions(args.rf_sessions)
+    server = daemon.Daemon(self.pump, args.socket, sessions=sessions, minutes=args.session_life)
+    print "### listening on", args.socket
+    try:
+      server.serve_forever( )
+    except KeyboardInterrupt:
+      print "### interrupted"
+    finally:
+      server.server_close( )
+
+if __name__ == '__main__':
+  app = DaemonApp( )
+  app.run(None)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# PYTHON_ARGCOMPLETE_OK
+
+"""%(prog)s - decode archived pump history or glucose pages in bulk
+
+Reads every page out of the files given, skips pages already seen,
+decodes the rest across a pool of processes and writes their records,
+oldest first, as one JSON object per line.  Glucose records can be
+written as a binary column file instead, see decocare.cgm.columns.
+Reports pages per second on stderr.
+"""
+
+import sys
+import json
+import logging
+import argparse, argcomplete
+
+from decocare import archive, models
+from decocare.cgm import columns
+
+def get_parser ( ):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0],
+                                   epilog='\n'.join(__doc__.split("\n")[1:]))
+  parser.add_argument('infile', nargs='+',
+                      help="Files of pages, eg ReadHistoryData-page-0.data")
+  parser.add_argument('--data', choices=archive.DECODERS.keys( ), default='pump',
+                      help="[default: %(default)s]")
+  parser.add_argument('--model', choices=models.known.keys( ), default='522',
+                      help="[default: %(default)s]")
+  parser.add_argument('--larger', dest='larger', action='store_true')
+  parser.add_argument('--no-larger', dest='larger', action='store_false')
+  parser.add_argument('--format', choices=[ 'ndjson', 'binary' ], default='ndjson',
+                      help="binary is only for glucose [default: %(default)s]")
+  parser.add_argument('--processes', type=int, default=None,
+                      help="Worker processes [default: one per cpu]")
+  parser.add_argument('--out', default=sys.stdout,
+                      type=argparse.FileType('wb'),
+                      help="Write records here.")
+  parser.add_argument('-v', '--verbose', dest='verbose',
+                      action='append_const', const=1, help="Verbosity")
+  parser.set_defaults(larger=False)
+  argcomplete.autocomplete(parser)
+  return parser
+
+def main (args):
+  level = None
+  if args.verbose > 0:
+    level = args.verbose > 1 and logging.DEBUG or logging.INFO
+  logging.basicConfig(stream=sys.stderr, level=level)
+  decoder = archive.Archive(args.data, model=args.model, larger=args.larger,
+                            processes=args.processes)
+  records = decoder.run(args.infile)
+  if args.format == 'binary':
+    columns.write(records, args.out)
+  else:
+    for record in records:
+      args.out.write(json.dumps(record, default=str))
+      args.out.write("\n")
+  args.out.flush( )
+  stats = decoder.stats
+  print >>sys.stderr, ("%(pages)s pages, %(duplicates)s duplicates, %(errors)s errors, "
+                       "%(records)s records, %(repeated)s repeated, in %(seconds).2fs" % stats),
+  print >>sys.stderr, "(%.1f pages/sec)" % decoder.pages_per_second( )
+  return stats['errors'] and 1 or 0
+
+if __name__ == '__main__':
+  parser = get_parser( )
+  args = parser.parse_args( )
+  if args.format == 'binary' and args.data != 'glucose':
+    parser.error("--format binary is only for --data glucose")
+  sys.exit(main(args))
@@ -5,6 +5,7 @@ from decocare import commands, models
 import json, argparse, sys
 
 from decocare.history import HistoryPage
+from decocare.sync import HistorySync
 from decocare.helpers import cli
 
 from dateutil.parser import parse
@@ -28,6 +29,10 @@ class DownloadHistory (cli.CommandApp):
                             default='-',
                             type=argparse.FileType('w'),
                             help="Put history json in this file")
+        parser.add_argument('--sync-state',
+                            dest="sync_state",
+                            default=None,
+                            help="Only download history newer than recorded in this file, and update it")
         return parser
 
 
@@ -58,6 +63,15 @@ class DownloadHistory (cli.CommandApp):
             except:
                 print "Unexpected error when downloading cgm-page ", i, " from pump:", sys.exc_info()[0]
 
+        self.write_records(args, records)
+
+    def sync_history (self, args):
+        syncer = HistorySync(self.pump.model, args.sync_state)
+        records = syncer.sync( )
+        print "Found ", len(records), " new records in ", syncer.pages_read, " pages."
+        self.write_records(args, records)
+
+    def write_records (self, args, records):
         recordsJson = json.dumps(records);
         args.parsed_data.write(recordsJson)
 
@@ -73,6 +87,10 @@ class DownloadHistory (cli.CommandApp):
         # Set Global variables..
         self.timezone = args.timezone
 
+        if args.sync_state:
+            self.sync_history(args)
+            return
+
         nrPages = self.getNumberOfPages()
         self.download_history(args, nrPages)
 
@@ -2,7 +2,6 @@
 # PYTHON_ARGCOMPLETE_OK
 
 from decocare import commands
-import io
 import json
 import argparse
 
@@ -12,7 +11,6 @@ from dateutil.parser import parse
 from dateutil.tz import gettz
 
 from decocare import lib
-from decocare.history import parse_record, HistoryPage
 from decocare.helpers import cli
 
 class LatestActivity (cli.CommandApp):
@@ -154,37 +152,14 @@ class LatestActivity (cli.CommandApp):
     self.basals = basals.getData( )
     args.basals.write(json.dumps(self.basals, indent=2))
 
-  def download_page (self, number):
-    kwds = dict(page=number)
-    page = self.exec_request(self.pump, commands.ReadHistoryData, args=kwds)
-    return page
-
-  def find_records (self, page, larger=None):
-    decoder = HistoryPage(page, self.pump.model)
-    records = decoder.decode( )
-    print "SINCE", self.since.isoformat( )
-    for record in records:
-      print "  * found record", record['_type'], record.get('timestamp')
-      print "  * should quit", record.get('timestamp') < self.since.isoformat( ), self.enough_history
-      if record.get('timestamp'):
-        dt = parse(record['timestamp'])
-        dt = dt.replace(tzinfo=self.timezone)
-        record.update(timestamp=dt.isoformat( ))
-        if record['timestamp'] < self.since.isoformat( ):
-          self.enough_history = True
-        if record['timestamp'] >= self.since.isoformat( ):
-          self.records.append(record)
-    return records
-
   def download_history (self, args):
-    i = 0
     print "find records since", self.since.isoformat( )
-    self.enough_history = False
     self.records = [ ]
-    while not self.enough_history:
-      history = self.download_page(i)
-      remainder = self.find_records(history.data)
-      i = i + 1
+    for record in self.pump.model.iter_history_since(self.since):
+      dt = parse(record['timestamp'])
+      dt = dt.replace(tzinfo=self.timezone)
+      record.update(timestamp=dt.isoformat( ))
+      self.records.append(record)
     results = self.records
     print "```json"
     args.parsed_data.write(json.dumps(results, indent=2))
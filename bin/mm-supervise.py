@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# PYTHON_ARGCOMPLETE_OK
+
+"""%(prog)s - query several pumps at once, one carelink stick each
+
+Bind pumps to sticks explicitly with --bind PORT=SERIAL, or list pump
+serials with --serial to bind them, in order, to every stick found.
+Prints one JSON outcome per pump as each finishes.
+"""
+
+import sys
+import json
+import logging
+import argparse
+
+from decocare import supervisor
+
+TASKS = [ 'read_model', 'read_status', 'read_clock', 'read_battery_status',
+          'read_reservoir', 'read_settings', 'read_temp_basal' ]
+
+def get_parser ( ):
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0],
+                                   epilog='\n'.join(__doc__.split("\n")[1:]))
+  parser.add_argument('--bind', action='append', default=[ ],
+                      type=supervisor.Binding.parse,
+                      help="PORT=SERIAL, a stick and the pump it talks to")
+  parser.add_argument('--serial', action='append', default=[ ],
+                      help="serial number of a pump, bound to scanned sticks")
+  parser.add_argument('--backlog', type=int, default=None,
+                      help="How many outcomes may wait to be printed [default: %s]"
+                           % supervisor.Supervisor.backlog)
+  parser.add_argument('--init', action='store_true', default=False,
+                      help="Send power ctrl to initialize RF session of each pump.")
+  parser.add_argument('--rf-minutes', dest='session_life', type=int, default=10,
+                      help="How long RF sessions should last")
+  parser.add_argument('-v', '--verbose', dest='verbose',
+                      action='append_const', const=1, help="Verbosity")
+  parser.add_argument('task', choices=TASKS, nargs='?', default='read_status',
+                      help="[default: %(default)s]")
+  return parser
+
+def main (args):
+  level = None
+  if args.verbose > 0:
+    level = args.verbose > 1 and logging.DEBUG or logging.INFO
+  logging.basicConfig(stream=sys.stderr, level=level)
+  bindings = args.bind + supervisor.bind(args.serial, taken=args.bind)
+  if not bindings:
+    print >>sys.stderr, "nothing to do, use --bind or --serial"
+    return 1
+  def job (pump):
+    return getattr(pump.model, args.task)( )
+  supervise = supervisor.Supervisor(bindings, maxsize=args.backlog,
+                                    init=args.init, minutes=args.session_life)
+  supervise.start(job)
+  failed = 0
+  for outcome in supervise.results( ):
+    failed += outcome['error'] is not None
+    print json.dumps(outcome, default=str)
+    sys.stdout.flush( )
+  return failed and 1 or 0
+
+if __name__ == '__main__':
+  sys.exit(main(get_parser( ).parse_args( )))
@@ -0,0 +1,518 @@
+"""
+aio - an event driven transport for the carelink stick.
+
+:py:`link.Link`, :py:`stick.Stick` and :py:`session.Pump` block the
+calling thread in serial reads and ``time.sleep`` for every step of
+every exchange.  The classes here do the same work as coroutines run
+by a :py:`Loop`, which waits on serial readiness with ``select``
+instead, so that one thread can drive several sticks at once.
+
+There is no asyncio in python 2, so coroutines are plain generators,
+in the same shape: they ``yield`` :py:`sleep`, :py:`readable`, another
+coroutine to call it, or a :py:`Task` to wait on it, and
+``raise Return(value)`` to return a value to their caller.
+
+>>> def double (x):
+...   yield sleep(.001)
+...   raise Return(x * 2)
+>>> def add (x, y):
+...   a = yield double(x)
+...   b = yield double(y)
+...   raise Return(a + b)
+>>> Loop( ).run(add(1, 2), add(3, 4))
+[6, 14]
+
+The stick and pump commands are still the message definitions from
+:py:`stick` and :py:`commands`:
+
+>>> from decocare import simulator, commands
+>>> def model (serial):
+...   link = AsyncLink(simulator.SimulatedSerial(simulator.SimulatedPump(serial=serial), latency=0))
+...   pump = AsyncPump(AsyncStick(link), serial)
+...   yield pump.stick.open( )
+...   response = yield pump.query(commands.ReadPumpModel)
+...   raise Return(response.getData( ))
+>>> Loop( ).run(model('208850'), model('665455'))
+['522', '522']
+
+"""
+
+import sys
+import time
+import heapq
+import types
+import select
+import logging
+import itertools
+from collections import deque
+
+import fuser
+import commands
+from stick import PollSchedule, ProductInfo, UsbStats, RadioStats, SignalStrength
+from stick import LinkStatus, ReadRadio, TransmitPacket
+from link import AlreadyInUseException, Hexdump
+from errors import AckError, BadDeviceCommError
+
+io  = logging.getLogger( )
+log = io.getChild(__name__)
+
+class Return (Exception):
+  """
+  Raised by a coroutine to return a value to whoever is waiting on it.
+  """
+  def __init__ (self, value=None):
+    super(Return, self).__init__(value)
+    self.value = value
+
+class Sleep (object):
+  def __init__ (self, delay):
+    self.delay = delay
+
+class Readable (object):
+  def __init__ (self, fd, timeout):
+    self.fd = fd
+    self.timeout = timeout
+
+def sleep (delay):
+  """
+  Resume after delay seconds; ``yield sleep(.5)``.
+  """
+  return Sleep(delay)
+
+def readable (fd, timeout):
+  """
+  Resume when fd is ready to read, with True, or after timeout seconds
+  with False.
+  """
+  return Readable(fd, timeout)
+
+class Task (object):
+  """
+  A coroutine being run by a :py:`Loop`, along with the coroutines it
+  is calling.
+  """
+  def __init__ (self, loop, coro):
+    self.loop = loop
+    self.stack = [ coro ]
+    self.done = False
+    self.value = None
+    self.error = None
+    self.waiters = [ ]
+
+  def step (self, value=None, error=None):
+    """
+    Run until the coroutine asks the loop to wait for something.
+    """
+    while self.stack:
+      coro = self.stack[-1]
+      try:
+        if error is not None:
+          request = coro.throw(*error)
+        else:
+          request = coro.send(value)
+      except Return, e:
+        self.stack.pop( )
+        value, error = e.value, None
+        continue
+      except StopIteration:
+        self.stack.pop( )
+        value, error = None, None
+        continue
+      except Exception:
+        self.stack.pop( )
+        value, error = None, sys.exc_info( )
+        continue
+      value, error = None, None
+      if isinstance(request, types.GeneratorType):
+        self.stack.append(request)
+        continue
+      if isinstance(request, Task):
+        if not request.done:
+          request.waiters.append(self)
+          return
+        value, error = request.value, request.error
+        continue
+      self.loop.wait(self, request)
+      return
+    self.finish(value, error)
+
+  def finish (self, value, error):
+    self.done = True
+    self.value = value
+    self.error = error
+    for waiter in self.waiters:
+      self.loop.schedule(waiter, value, error)
+    self.waiters = [ ]
+
+  def result (self):
+    if self.error is not None:
+      raise self.error[0], self.error[1], self.error[2]
+    return self.value
+
+class Loop (object):
+  """
+  Run coroutines until they finish, sleeping in ``select`` until a
+  serial port is readable or a timer is due.
+  """
+  def __init__ (self):
+    self.ready = deque( )
+    self.timers = [ ]
+    self.readers = { }
+    self.sequence = itertools.count( )
+
+  def spawn (self, coro):
+    task = Task(self, coro)
+    self.schedule(task)
+    return task
+
+  def schedule (self, task, value=None, error=None):
+    self.ready.append((task, value, error))
+
+  def wait (self, task, request):
+    if request is None:
+      self.schedule(task)
+    elif isinstance(request, Sleep):
+      when = time.time( ) + request.delay
+      heapq.heappush(self.timers, (when, next(self.sequence), task))
+    elif isinstance(request, Readable):
+      if request.fd in self.readers:
+        error = RuntimeError("fd %s already has a reader" % request.fd)
+        self.schedule(task, error=(RuntimeError, error, None))
+        return
+      self.readers[request.fd] = (task, time.time( ) + request.timeout)
+    else:
+      error = TypeError("coroutine yielded %r" % (request, ))
+      self.schedule(task, error=(TypeError, error, None))
+
+  def pending (self):
+    return bool(self.ready or self.timers or self.readers)
+
+  def timeout (self):
+    if self.ready:
+      return 0
+    deadlines = [ deadline for task, deadline in self.readers.values( ) ]
+    if self.timers:
+      deadlines.append(self.timers[0][0])
+    if not deadlines:
+      return None
+    return max(0, min(deadlines) - time.time( ))
+
+  def run_once (self):
+    timeout = self.timeout( )
+    if self.readers:
+      found, w, x = select.select(list(self.readers), [ ], [ ], timeout)
+      for fd in found:
+        task, deadline = self.readers.pop(fd)
+        self.schedule(task, True)
+    elif timeout:
+      time.sleep(timeout)
+    now = time.time( )
+    for fd, (task, deadline) in self.readers.items( ):
+      if deadline <= now:
+        del self.readers[fd]
+        self.schedule(task, False)
+    while self.timers and self.timers[0][0] <= now:
+      when, seq, task = heapq.heappop(self.timers)
+      self.schedule(task)
+    for i in xrange(len(self.ready)):
+      task, value, error = self.ready.popleft( )
+      task.step(value, error)
+
+  def run (self, *coros):
+    """
+    Run coroutines concurrently, and return a list of their results.
+    The first to have failed raises its exception.
+    """
+    tasks = map(self.spawn, coros)
+    while not all([ task.done for task in tasks ]):
+      if not self.pending( ):
+        raise RuntimeError("tasks are waiting on each other")
+      self.run_once( )
+    return [ task.result( ) for task in tasks ]
+
+
+class AsyncLink (object):
+  """
+  Non blocking reads and writes over a serial port, or anything
+  providing its api.
+
+  read waits up to timeout for a response to start, then keeps
+  reading until size bytes arrived or the port goes quiet for gap
+  seconds.  Ports without a fileno, like the simulator's, are polled
+  every interval seconds for waiting bytes instead.
+  """
+  __timeout__ = .500
+  gap = .010
+  interval = .002
+  capture = None
+  def __init__ (self, serial, timeout=None):
+    if timeout is not None:
+      self.__timeout__ = timeout
+    self.serial = serial
+    if hasattr(serial, 'timeout'):
+      serial.timeout = 0
+
+  @classmethod
+  def open (klass, port, timeout=None):
+    if fuser.in_use(port):
+      raise AlreadyInUseException("{port} already in use".format(port=port))
+    import serial
+    link = klass(serial.Serial(port, timeout=0, dsrdtr=True, rtscts=True), timeout=timeout)
+    log.info('{agent} opened serial port: {serial}'.format(serial=repr(link.serial),
+                                                         agent=klass.__name__))
+    return link
+
+  def fileno (self):
+    try:
+      return self.serial.fileno( )
+    except AttributeError:
+      return None
+
+  def close (self):
+    io.info('closing serial port')
+    return self.serial.close( )
+
+  def capture_to (self, sink):
+    """
+    Record every frame written and read to sink, a
+    :py:`capture.Capture`, or stop recording with None.
+    """
+    self.capture = sink
+
+  def write (self, string):
+    r = self.serial.write(string)
+    if self.capture is not None:
+      self.capture.write(string)
+    if io.isEnabledFor(logging.INFO):
+      io.info('usb.write.len: %s\n%s', len(string), Hexdump(string))
+    return r
+
+  def readable (self, timeout):
+    """
+    Coroutine, wait up to timeout for bytes to read.
+    """
+    fd = self.fileno( )
+    if fd is not None:
+      ready = yield readable(fd, timeout)
+      raise Return(ready)
+    deadline = time.time( ) + timeout
+    while not self.serial.inWaiting( ):
+      remaining = deadline - time.time( )
+      if remaining <= 0:
+        raise Return(False)
+      yield sleep(min(self.interval, remaining))
+    raise Return(True)
+
+  def read (self, size, timeout=None):
+    """
+    Coroutine, read a response of up to size bytes.
+    """
+    if timeout is None:
+      timeout = self.__timeout__
+    deadline = time.time( ) + timeout
+    data = bytearray( )
+    while len(data) < size:
+      chunk = self.serial.read(size - len(data))
+      if chunk:
+        data.extend(chunk)
+        continue
+      if data:
+        wait = self.gap
+      else:
+        wait = deadline - time.time( )
+      if wait <= 0:
+        break
+      ready = yield self.readable(wait)
+      if not ready:
+        break
+    if self.capture is not None:
+      self.capture.read(data)
+    if io.isEnabledFor(logging.INFO):
+      io.info('usb.read.len: %s\n%s', len(data), Hexdump(data))
+    raise Return(data)
+
+
+class AsyncStick (object):
+  """
+  The stick operations of :py:`stick.Stick`, as coroutines over an
+  :py:`AsyncLink`.
+
+  Downloads poll LinkStatus on a :py:`stick.PollSchedule`, like
+  Stick.adaptive_download, recording the same latencies.
+  """
+  def __init__ (self, link, schedule=None):
+    self.link = link
+    self.schedule = schedule or PollSchedule( )
+    self.command = None
+    self.last_status = None
+    self.latencies = [ ]
+
+  def __repr__ (self):
+    return '<{0} command[{1!r}]>'.format(self.__class__.__name__, self.command)
+
+  def exchange (self, command):
+    """
+    Send a stick command, and return what it parsed from the reply.
+    """
+    self.command = command
+    log.info('%r exchanging %s' % (self, command))
+    self.link.write(command.format( ))
+    raw = yield self.link.read(command.size)
+    if not raw:
+      raise AckError("no reply to %s" % command)
+    ack, response = command.respond(raw)
+    raise Return(command.parse(response))
+
+  def query (self, Command):
+    result = yield self.exchange(Command( ))
+    raise Return(result)
+
+  def product_info (self):
+    result = yield self.query(ProductInfo)
+    raise Return(result)
+
+  def usb_stats (self):
+    result = yield self.query(UsbStats)
+    raise Return(result)
+
+  def radio_stats (self):
+    result = yield self.query(RadioStats)
+    raise Return(result)
+
+  def interface_stats (self):
+    usb = yield self.usb_stats( )
+    radio = yield self.radio_stats( )
+    raise Return(dict(usb=usb, radio=radio))
+
+  def signal_strength (self):
+    result = yield self.query(SignalStrength)
+    raise Return(result)
+
+  def open (self):
+    """
+    Read product info and wait for a usable signal strength.
+    """
+    info = yield self.product_info( )
+    log.info('%s' % info)
+    signal = 0
+    while signal < 50:
+      signal = yield self.signal_strength( )
+    log.info('we seem to have found a nice signal strength of: %s' % signal)
+    raise Return(True)
+
+  def read_status (self):
+    size = yield self.query(LinkStatus)
+    self.last_status = self.command
+    raise Return(size)
+
+  def poll_size (self, timeout=1):
+    """
+    Poll until the radio buffer holds a frame, backing off on the
+    schedule while it is idle.
+    """
+    size = 0
+    start = time.time( )
+    self.schedule.reset( )
+    while size == 0 and time.time( ) - start < timeout:
+      size = yield self.read_status( )
+      if size == 0:
+        delay = self.schedule.next(busy=self.last_status.receiving( ))
+        yield sleep(delay)
+    raise Return(size)
+
+  def download_packet (self, size):
+    if size == 0:
+      raise Return(bytearray( ))
+    data = yield self.exchange(ReadRadio(size))
+    raise Return(data)
+
+  def download (self, attempts=3):
+    """
+    Download frames until the end of data flag, giving up after
+    attempts empty polls in a row.
+    """
+    results = bytearray( )
+    ailing = 0
+    eod = False
+    self.latencies = [ ]
+    while not eod:
+      begin = time.time( )
+      size = yield self.poll_size( )
+      polled = time.time( )
+      if size == 0:
+        ailing += 1
+        log.warn('%r:BAD AILING %s' % (self, ailing))
+        if ailing >= attempts:
+          break
+        continue
+      ailing = 0
+      data = yield self.download_packet(size)
+      done = time.time( )
+      self.latencies.append(dict(frame=len(self.latencies), size=size,
+                                 bytes=len(data or [ ]),
+                                 poll=(polled - begin) * 1000.0,
+                                 download=(done - polled) * 1000.0,
+                                 millis=(done - begin) * 1000.0))
+      if data:
+        results.extend(data)
+        eod = self.command.eod
+    raise Return(results)
+
+  def transmit_packet (self, command):
+    result = yield self.exchange(TransmitPacket(command))
+    raise Return(result)
+
+
+class AsyncPump (object):
+  """
+  The pump session of :py:`session.Pump`, as coroutines over an
+  :py:`AsyncStick`.  Commands are the classes in :py:`commands`.
+  """
+  def __init__ (self, stick, serial='208850'):
+    self.stick = stick
+    self.serial = serial
+    self.modelNumber = None
+
+  def execute (self, command):
+    """
+    Send command to the pump and download its response, retrying as
+    many times as the command allows.
+    """
+    command.serial = self.serial
+    expected = command.bytesPerRecord * command.maxRecords
+    for i in xrange(max(1, command.retries)):
+      log.info('%s execute attempt: %s' % (self.serial, i + 1))
+      try:
+        yield self.stick.transmit_packet(command)
+        yield sleep(command.effectTime)
+        if expected > 0:
+          data = yield self.stick.download( )
+          command.respond(data)
+        if command.done( ):
+          raise Return(command)
+      except BadDeviceCommError, e:
+        log.critical("ERROR: %s" % e)
+    log.critical('%s: %s failed after %s attempts' % (self.serial, command, i + 1))
+    raise Return(command)
+
+  def query (self, Command, **kwds):
+    command = Command(serial=self.serial, **kwds)
+    yield self.execute(command)
+    raise Return(command)
+
+  def power_control (self, minutes=None):
+    yield self.query(commands.PowerControl, minutes=minutes)
+    data = yield self.stick.download( )
+    raise Return(data)
+
+  def read_model (self):
+    model = yield self.query(commands.ReadPumpModel)
+    self.modelNumber = model.getData( )
+    raise Return(model)
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
@@ -0,0 +1,203 @@
+"""
+archive - decode piles of archived pages, in parallel.
+
+Years of ``ReadHistoryData-page-N.data`` and glucose page dumps hold
+the same pages many times over, since every download repeats the
+pages before it.  :py:`Archive` reads the pages out of every file,
+drops pages it has already seen, decodes the rest across a process
+pool and merges their records into one, time ordered list.
+
+Pages are told apart by the CRC in their last two bytes, confirmed by
+comparing the pages themselves, since with a 16 bit CRC unrelated
+pages share one every so often.  Snapshots of the same page taken at
+different times, a partly written page 0 and the full page it became,
+are different pages, so records an earlier page already gave are also
+dropped while merging, by :py:`record_key`.
+
+>>> from decocare import simulator
+>>> pages = [ simulator.make_page([ 0x34, 0x45, 0x10, 0x28, 0xb6, 0x14, 0x08 ]) ] * 3
+>>> archive = Archive('glucose', processes=1)
+>>> records = archive.decode(archive.unique([ Page('dump', i, page) for i, page in enumerate(pages) ]))
+>>> [ (r['name'], r['date']) for r in records ]
+[('GlucoseSensorData', '2016-02-08T20:49:00'), ('GlucoseSensorData', '2016-02-08T20:54:00'), ('SensorTimestamp', '2016-02-08T20:54:00')]
+>>> archive.stats['pages'], archive.stats['duplicates']
+(1, 2)
+
+"""
+
+import time
+import logging
+import collections
+import multiprocessing
+
+import cgm
+import lib
+import models
+import history
+
+log = logging.getLogger( ).getChild(__name__)
+
+PAGE_SIZE = 1024
+
+Page = collections.namedtuple('Page', 'source index data')
+
+def read_pages (paths, size=PAGE_SIZE):
+  """
+  Yield every whole page in the files at paths, in order.
+  """
+  for path in paths:
+    with open(path, 'rb') as f:
+      blob = f.read( )
+    whole = len(blob) - len(blob) % size
+    if whole < len(blob):
+      log.warn("%s: ignoring %s bytes past the last whole page" % (path, len(blob) - whole))
+    for index, offset in enumerate(xrange(0, whole, size)):
+      yield Page(path, index, blob[offset:offset + size])
+
+def decode_history (data, model, larger):
+  # decode gives the newest record first
+  records = history.HistoryPage(bytearray(data), models.lookup(model, None)).decode(larger=larger)
+  records.reverse( )
+  return records
+
+def decode_glucose (data, model, larger):
+  return cgm.PagedData.Data(bytearray(data), larger=larger).decode( )
+
+DECODERS = dict(pump=decode_history, glucose=decode_glucose)
+DATE_KEYS = dict(pump='timestamp', glucose='date')
+
+def decode_page (job):
+  """
+  Decode one page in a worker: job is (kind, page, model, larger).
+  Returns the page's source and index, its records oldest first, and
+  a description of what went wrong, or None.
+  """
+  kind, page, model, larger = job
+  result = dict(source=page.source, index=page.index, records=[ ], error=None)
+  try:
+    result['records'] = DECODERS[kind](page.data, model, larger)
+  except Exception, e:
+    result['error'] = '%s: %s' % (e.__class__.__name__, e)
+  return result
+
+def dated (records, key):
+  """
+  Pair records with the date to sort them by: their own, or that of
+  the nearest older dated record on the page, or failing that, the
+  nearest newer one.
+
+  >>> [ d for d, r in dated([ { }, dict(date='b'), { }, dict(date='c') ], 'date') ]
+  ['b', 'b', 'b', 'c']
+  """
+  dates = [ ]
+  last = None
+  for record in records:
+    last = record.get(key) or last
+    dates.append(last)
+  first = next((d for d in dates if d is not None), '')
+  return [ (date or first, record) for date, record in zip(dates, records) ]
+
+def record_key (date, record):
+  """
+  What makes a record the same one, wherever it was read: its raw
+  head, date and body bytes, or failing those, all of its decoded
+  fields but where on the page it was found.
+
+  >>> record_key('d', dict(_head='0100', _date='', _body='', timestamp='d'))
+  ('d', '0100', '', '')
+  >>> record_key('d', dict(name='Glucose', sgv=104, _tell=7))
+  ('d', (('name', 'Glucose'), ('sgv', 104)))
+  """
+  if '_head' in record:
+    return (date, record['_head'], record.get('_date'), record.get('_body'))
+  return (date, tuple(sorted([ (k, v) for k, v in record.items( ) if k != '_tell' ])))
+
+class Archive (object):
+  """
+  Decode pages of one kind, 'pump' history or 'glucose', for model,
+  using processes workers (one per cpu by default).
+  """
+  def __init__ (self, kind, model='522', larger=False, processes=None):
+    self.kind = kind
+    self.model = model
+    self.larger = larger
+    self.processes = processes
+    self.stats = dict(pages=0, duplicates=0, errors=0, records=0, repeated=0, seconds=0.0)
+
+  def unique (self, pages):
+    """
+    Yield pages not seen before.
+    """
+    seen = { }
+    for page in pages:
+      crc = lib.BangInt(bytearray(page.data[-2:]))
+      same = seen.setdefault(crc, [ ])
+      if page.data in same:
+        self.stats['duplicates'] += 1
+        log.debug("%s page %s is a duplicate" % (page.source, page.index))
+        continue
+      same.append(page.data)
+      yield page
+
+  def jobs (self, pages):
+    for page in pages:
+      yield (self.kind, page, self.model, self.larger)
+
+  def results (self, pages):
+    """
+    Yield the decoded result of each page, in order.
+    """
+    if self.processes == 1:
+      for job in self.jobs(pages):
+        yield decode_page(job)
+      return
+    pool = multiprocessing.Pool(self.processes)
+    try:
+      for result in pool.imap(decode_page, self.jobs(pages), chunksize=8):
+        yield result
+      pool.close( )
+    finally:
+      pool.terminate( )
+      pool.join( )
+
+  def decode (self, pages):
+    """
+    Decode pages, returning all their records, oldest first, each
+    only once, however many pages it was read from.
+    """
+    began = time.time( )
+    key = DATE_KEYS[self.kind]
+    merged = [ ]
+    seen = set( )
+    for result in self.results(pages):
+      self.stats['pages'] += 1
+      if result['error']:
+        self.stats['errors'] += 1
+        log.error("%s page %s: %s" % (result['source'], result['index'], result['error']))
+      found = [ ]
+      for position, (date, record) in enumerate(dated(result['records'], key)):
+        same = record_key(date, record)
+        if same in seen:
+          self.stats['repeated'] += 1
+          continue
+        found.append(same)
+        merged.append((date, self.stats['pages'], position, record))
+      # a page may hold records alike in every byte; only other pages repeat them
+      seen.update(found)
+    merged.sort(key=lambda entry: entry[:3])
+    self.stats['records'] = len(merged)
+    self.stats['seconds'] = time.time( ) - began
+    return [ entry[3] for entry in merged ]
+
+  def pages_per_second (self):
+    return self.stats['pages'] / max(self.stats['seconds'], 1e-9)
+
+  def run (self, paths):
+    return self.decode(self.unique(read_pages(paths)))
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
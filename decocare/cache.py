@@ -0,0 +1,261 @@
+"""
+cache - persistent, size bounded store of pump pages.
+
+Pages are kept as 1024 byte blobs in a directory, next to a JSON
+index, keyed by their CRC16 trailer plus a digest of their contents:
+16 bits of CRC alone would collide long before a multi-year archive
+fills up.  Every page is checked against its CRC16CCITT trailer on the
+way in and again on the way out, and a blob that fails the check is
+dropped from the cache.
+
+Glucose pages are numbered from the start of the pump's life, so once
+the pump has moved on to a later page an old page never changes, and
+can be found again by a locator made of pump serial and page number,
+without asking the pump.  History pages are numbered from the newest,
+and move every time the pump starts a new page, so they are only ever
+found by their contents; caching them still saves decoding them again.
+
+Decoded records are cached alongside each page, as JSON, under a name
+describing the decoder.
+
+>>> import tempfile, shutil
+>>> from decocare import simulator
+>>> path = tempfile.mkdtemp( )
+>>> cache = PageCache(path)
+>>> page = simulator.make_page(bytearray([ 0x01 ] * 100))
+>>> key = cache.put(page, locator='208850:glucose:10')
+>>> cache.lookup('208850:glucose:10') == page
+True
+>>> cache.put_records(key, 'glucose', [ dict(name='DataEnd') ])
+>>> cache.get_records(key, 'glucose')
+[{u'name': u'DataEnd'}]
+>>> cache.close( )
+>>> shutil.rmtree(path)
+
+"""
+
+import os
+import json
+import hashlib
+import functools
+import logging
+import threading
+
+import lib
+from errors import DataTransferCorruptionError
+
+log = logging.getLogger( ).getChild(__name__)
+
+PAGE_SIZE = 1024
+
+def page_key (page):
+  """
+  Name a page by its CRC trailer and a digest of its contents.
+
+  >>> from decocare import simulator
+  >>> page_key(simulator.make_page([ ]))
+  '9ff5-aae7fe2f43321e9e'
+  """
+  crc = lib.BangInt(page[-2:])
+  return '%04x-%s' % (crc, hashlib.sha1(page).hexdigest( )[:16])
+
+def locked (method):
+  @functools.wraps(method)
+  def wrapper (self, *args, **kwds):
+    with self.lock:
+      return method(self, *args, **kwds)
+  return wrapper
+
+class PageCache (object):
+  """
+  A directory of pages, with an index of keys, locators and sizes.
+
+  max_bytes bounds the total size of pages and decoded records; the
+  least recently used pages are evicted to stay under it.  A cache
+  may be shared between threads.
+
+  Reading a page only moves it up the order in memory; the index is
+  written when pages are added, and by :py:`close`.
+  """
+  index_name = 'index.json'
+  def __init__ (self, path, max_bytes=16 * 1024 * 1024):
+    self.path = path
+    self.max_bytes = max_bytes
+    self.lock = threading.RLock( )
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    self.load( )
+
+  def load (self):
+    self.entries = { }
+    self.locators = { }
+    self.clock = 0
+    self.dirty = False
+    try:
+      with open(os.path.join(self.path, self.index_name)) as f:
+        index = json.load(f)
+      self.entries = index.get('entries', { })
+      self.locators = index.get('locators', { })
+      self.clock = index.get('clock', 0)
+    except (IOError, ValueError), e:
+      log.info("starting new page cache index in %s: %s" % (self.path, e))
+
+  def save (self):
+    index = dict(entries=self.entries, locators=self.locators, clock=self.clock)
+    self.replace(os.path.join(self.path, self.index_name), lambda f: json.dump(index, f))
+    self.dirty = False
+
+  @locked
+  def close (self):
+    """
+    Write the index, if reads have changed the order since it was.
+    """
+    if self.dirty:
+      self.save( )
+
+  def replace (self, name, write):
+    """
+    Call write with a temporary file, then rename it over name, so
+    that name is never left half written.
+    """
+    tmp = name + '.tmp'
+    try:
+      with open(tmp, 'wb') as f:
+        write(f)
+      os.rename(tmp, name)
+    finally:
+      if os.path.exists(tmp):
+        os.remove(tmp)
+
+  def filename (self, key, suffix='page'):
+    return os.path.join(self.path, '%s.%s' % (key, suffix))
+
+  def touch (self, key):
+    self.clock += 1
+    self.entries[key]['used'] = self.clock
+    self.dirty = True
+
+  def size (self):
+    return sum([ entry['size'] for entry in self.entries.values( ) ])
+
+  def __contains__ (self, key):
+    return key in self.entries
+
+  def __len__ (self):
+    return len(self.entries)
+
+  @locked
+  def put (self, page, locator=None):
+    """
+    Store a page, and optionally a locator to find it again by.
+    Returns its key.  Pages failing their CRC check are refused.
+    """
+    page = bytearray(page)
+    if len(page) != PAGE_SIZE or not lib.CRC16CCITT.verify(page):
+      raise DataTransferCorruptionError("refusing to cache page failing CRC check")
+    key = page_key(page)
+    if key not in self.entries:
+      self.replace(self.filename(key), lambda f: f.write(page))
+      self.entries[key] = dict(size=len(page), used=0, decoded=[ ])
+    if locator is not None:
+      self.locators[locator] = key
+    self.touch(key)
+    self.evict( )
+    self.save( )
+    return key
+
+  @locked
+  def get (self, key):
+    """
+    Fetch a page by key, or None.  Pages which no longer pass their
+    CRC check are dropped.
+    """
+    if key not in self.entries:
+      return None
+    try:
+      with open(self.filename(key), 'rb') as f:
+        page = bytearray(f.read( ))
+    except IOError, e:
+      log.info("page %s missing from cache: %s" % (key, e))
+      page = None
+    if page is None or len(page) != PAGE_SIZE or not lib.CRC16CCITT.verify(page):
+      log.info("dropping corrupt page %s from cache" % key)
+      self.remove(key)
+      self.save( )
+      return None
+    self.touch(key)
+    return page
+
+  @locked
+  def lookup (self, locator):
+    """
+    Fetch a page by locator, or None.
+    """
+    key = self.locators.get(locator, None)
+    if key is None:
+      return None
+    return self.get(key)
+
+  @locked
+  def put_records (self, key, decoder, records):
+    """
+    Remember the records decoder decoded from the page key.
+    """
+    if key not in self.entries:
+      return
+    self.replace(self.filename(key, decoder + '.json'), lambda f: json.dump(records, f))
+    entry = self.entries[key]
+    if decoder not in entry['decoded']:
+      entry['decoded'].append(decoder)
+    entry['size'] = PAGE_SIZE + sum([ os.path.getsize(self.filename(key, d + '.json'))
+                                      for d in entry['decoded'] ])
+    self.touch(key)
+    self.evict( )
+    self.save( )
+
+  @locked
+  def get_records (self, key, decoder):
+    """
+    The records decoder decoded from the page key, or None.
+    """
+    entry = self.entries.get(key, None)
+    if entry is None or decoder not in entry['decoded']:
+      return None
+    try:
+      with open(self.filename(key, decoder + '.json')) as f:
+        return json.load(f)
+    except (IOError, ValueError), e:
+      log.info("dropping decoded %s for %s: %s" % (decoder, key, e))
+      entry['decoded'].remove(decoder)
+      self.dirty = True
+      return None
+
+  def remove (self, key):
+    entry = self.entries.pop(key)
+    for name in [ self.filename(key) ] + [ self.filename(key, d + '.json') for d in entry['decoded'] ]:
+      if os.path.exists(name):
+        os.remove(name)
+    for locator, target in self.locators.items( ):
+      if target == key:
+        del self.locators[locator]
+
+  def evict (self):
+    """
+    Drop least recently used pages until under max_bytes.
+    """
+    total = self.size( )
+    if total <= self.max_bytes:
+      return
+    for key in sorted(self.entries, key=lambda k: self.entries[k]['used']):
+      if total <= self.max_bytes:
+        break
+      total -= self.entries[key]['size']
+      log.info("evicting page %s from cache" % key)
+      self.remove(key)
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
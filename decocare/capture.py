@@ -0,0 +1,246 @@
+"""
+capture - record the raw bytes crossing a link, to look at later.
+
+Hexdumping every read and write as it happens is slow, and only worth
+it when something goes wrong.  A :py:`Capture` instead appends each
+frame to a binary file, as it was, with the time and direction, for
+about the cost of the write itself.  :py:`frames` reads them back, and
+``python -m decocare.capture FILE`` hexdumps a capture afterwards.
+
+A :py:`RecordingLink` is a :py:`link.Link` capturing everything to a
+file, and a :py:`ReplayLink` serves a capture back to a
+:py:`stick.Stick`, at full speed or with the recorded timing, which
+makes a real session into a repeatable fixture for tuning the stick.
+
+The file is a 8 byte header, magic and format version, followed by one
+record per frame: a little endian double of seconds since the epoch,
+a direction byte, 'w' for bytes written to the stick or 'r' for bytes
+read from it, the length as an unsigned int, then the bytes.
+
+>>> import os, tempfile
+>>> fd, path = tempfile.mkstemp( )
+>>> os.close(fd)
+>>> capture = Capture(path)
+>>> capture.write(bytearray([ 0x04, 0x00, 0x00 ]))
+>>> capture.read(bytearray([ 0x01, 0x55, 0x04 ]))
+>>> capture.close( )
+>>> [ (direction, str(data).encode('hex')) for when, direction, data in frames(path) ]
+[('w', '040000'), ('r', '015504')]
+>>> os.remove(path)
+
+"""
+
+import sys
+import time
+import struct
+import logging
+
+import lib
+import link
+import metrics
+
+log = logging.getLogger( ).getChild(__name__)
+
+MAGIC = 'DCWC'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+FRAME = struct.Struct('<dcI')
+
+WRITE = 'w'
+READ = 'r'
+
+class Capture (object):
+  """
+  Append frames to the file at path, or an open binary file.
+  """
+  def __init__ (self, path):
+    self.file = open(path, 'wb') if isinstance(path, basestring) else path
+    self.file.write(HEADER.pack(MAGIC, VERSION, 0))
+
+  def frame (self, direction, data, when=None):
+    data = bytes(data)
+    self.file.write(FRAME.pack(when or time.time( ), direction, len(data)))
+    self.file.write(data)
+
+  def write (self, data):
+    self.frame(WRITE, data)
+
+  def read (self, data):
+    self.frame(READ, data)
+
+  def flush (self):
+    self.file.flush( )
+
+  def close (self):
+    self.file.close( )
+
+def frames (path):
+  """
+  Yield (seconds, direction, bytearray) for every frame in a capture.
+  """
+  with open(path, 'rb') as f:
+    magic, version, reserved = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+      raise ValueError("%s is not a version %s wire capture" % (path, VERSION))
+    while True:
+      head = f.read(FRAME.size)
+      if len(head) < FRAME.size:
+        break
+      when, direction, length = FRAME.unpack(head)
+      data = f.read(length)
+      if len(data) < length:
+        break
+      yield when, direction, bytearray(data)
+
+class RecordingLink (link.Link):
+  """
+  A Link to the stick at port, capturing every frame to path.
+  """
+  def __init__ (self, port, path, timeout=None):
+    super(RecordingLink, self).__init__(port, timeout=timeout)
+    self.capture_to(Capture(path))
+
+  def close (self):
+    try:
+      return super(RecordingLink, self).close( )
+    finally:
+      self.capture.close( )
+
+class ReplayError (Exception):
+  """
+  The stick wrote something the capture has no answer for.
+  """
+
+class ReplayLink (link.Link):
+  """
+  Play the capture at path back to a Stick: each write is matched to
+  a recorded one, and the reads that followed it in the recording are
+  served in turn, then empty reads until the next write.
+
+  The stick being tuned may poll a different number of times than the
+  recorded one did.  Recorded repeats of the last write are skipped
+  over to reach the write it makes instead, and repeating the last
+  write once more is answered as it was before.  Anything else raises
+  :py:`ReplayError`.
+
+  speed None replays as fast as the stick asks; otherwise each read is
+  held back as long after its write as it was in the recording,
+  divided by speed.  A replay can be captured in turn, with
+  :py:`capture_to`.
+
+  >>> from decocare import simulator, stick
+  >>> import os, tempfile
+  >>> fd, path = tempfile.mkstemp( )
+  >>> os.close(fd)
+  >>> recorded = simulator.SimulatedLink(simulator.SimulatedPump( ), latency=0)
+  >>> recorded.capture_to(Capture(path))
+  >>> stick.Stick(recorded).open( )
+  True
+  >>> recorded.capture.close( )
+  >>> stick.Stick(ReplayLink(path)).open( )
+  True
+  >>> os.remove(path)
+  """
+  def __init__ (self, path, speed=None):
+    self.port = path
+    self.speed = speed
+    self.frames = list(frames(path))
+    self.position = 0
+    self.last = None
+    self.pending = ''
+    self.anchor = None
+
+  def open (self, newPort=False, **kwds):
+    pass
+
+  def close (self):
+    pass
+
+  def next_write (self, i):
+    while i < len(self.frames) and self.frames[i][1] != WRITE:
+      i += 1
+    return i
+
+  def match (self, data):
+    i = self.next_write(self.position)
+    if i < len(self.frames) and self.frames[i][2] == data:
+      return i
+    if self.last is not None:
+      repeat = self.frames[self.last][2]
+      while i < len(self.frames) and self.frames[i][2] == repeat:
+        i = self.next_write(i + 1)
+      if i < len(self.frames) and self.frames[i][2] == data:
+        return i
+      if data == repeat:
+        return self.last
+    raise ReplayError("no recorded write of %s after frame %s of %s"
+                      % (str(data).encode('hex'), self.position, self.port))
+
+  def write (self, string):
+    data = bytearray(string)
+    i = self.match(data)
+    self.last = i
+    self.position = i + 1
+    self.pending = ''
+    self.anchor = (self.frames[i][0], time.time( ))
+    if self.capture is not None:
+      self.capture.write(data)
+    return len(data)
+
+  def next_read (self):
+    if self.pending:
+      return self.pending
+    if self.position >= len(self.frames) or self.frames[self.position][1] != READ:
+      return ''
+    when, direction, data = self.frames[self.position]
+    self.position += 1
+    if self.speed and self.anchor is not None:
+      recorded, began = self.anchor
+      delay = began + (when - recorded) / self.speed - time.time( )
+      if delay > 0:
+        metrics.sleep(delay, 'replay')
+    return str(data)
+
+  def served (self, data):
+    if self.capture is not None:
+      self.capture.read(data)
+    return data
+
+  def read (self, c):
+    data = self.next_read( )
+    self.pending = data[c:]
+    return self.served(data[:c])
+
+  def readline (self):
+    data = self.next_read( )
+    end = data.find('\n') + 1 or len(data)
+    self.pending = data[end:]
+    return self.served(data[:end])
+
+  def readlines (self):
+    lines = [ ]
+    line = self.readline( )
+    while line:
+      lines.append(line)
+      line = self.readline( )
+    return lines
+
+def dump (path, out=sys.stdout):
+  """
+  Hexdump a capture, the way Link would have logged it.
+  """
+  names = { WRITE: 'usb.write', READ: 'usb.read' }
+  first = None
+  for when, direction, data in frames(path):
+    first = first or when
+    out.write('%+.3fs %s.len: %s\n%s\n' % (when - first, names.get(direction, direction),
+                                            len(data), lib.hexdump(data)))
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+  for path in sys.argv[1:]:
+    dump(path)
+
+#####
+# EOF
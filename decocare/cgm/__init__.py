@@ -12,10 +12,7 @@ from binascii import hexlify
 # TODO: all this stuff could be refactored into re-usable and tested
 # module.
 import io
-import copy
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-from dateutil import parser
+from datetime import datetime, timedelta
 
 from decocare import lib
 from decocare.records import times
@@ -91,6 +88,8 @@ class PagedData (object):
     self.larger = larger
     self.data = self.skip_null_bytes(data)
 
+  FIVE_MINUTES = timedelta(minutes=5)
+
   def is_relative_record(self, record):
     return 'date_type' in record and record['date_type'] == 'relative'
 
@@ -98,45 +97,103 @@ class PagedData (object):
     return self.find_initial_timestamp() is None
 
   def decode (self):
-    records = []
-    timestamp = self.find_initial_timestamp()
-
-    stream = self.stream_from_data(self.data)
-
-    for B in iter(lambda: stream.read(1), ""):
-      B = bytearray(B)
-      record = self.decode_record(B[0], stream, timestamp)
-
-      if record['name'] == 'SensorTimestamp':
-        timestamp = parser.parse(record['date'])
-      elif self.is_relative_record(record) and timestamp:
-        timestamp = timestamp + relativedelta(minutes=-5)
-
-      records.insert(0, record)
+    """
+    Decode the page in a single pass, newest record first.
 
+    Relative records newer than the last reference timestamp on the
+    page are held back until that timestamp turns up, then dated 5
+    minutes apart going forward from it, the same answer
+    find_initial_timestamp gives.  Dates are kept as datetimes while
+    walking the page and only formatted into the records.
+    """
+    records = [ ]
+    timestamp = None
+    # relative records seen while still looking for the initial
+    # reference timestamp, newest first
+    pending = [ ]
+    searching = True
+
+    for record, date in self.iter_records( ):
+      name = record['name']
+      relative = self.is_relative_record(record)
+
+      if searching:
+        if name == 'SensorTimestamp' and not record['timestamp_type'] == 'gap':
+          searching = False
+          count = len(pending)
+          if date is not None:
+            for i, earlier in enumerate(pending):
+              earlier.update(date=(date + self.FIVE_MINUTES * (count - i)).isoformat( ))
+        elif relative:
+          pending.append(record)
+        elif not (name == 'DataEnd' or name == '19-Something'):
+          searching = False
+
+      if name == 'SensorTimestamp':
+        timestamp = date
+      elif relative and timestamp:
+        record.update(date=timestamp.isoformat( ))
+        timestamp = timestamp - self.FIVE_MINUTES
+
+      records.append(record)
+
+    records.reverse( )
     self.records = records
     return self.records
 
+  def iter_records (self):
+    """
+    Walk the (reversed) page, yielding (record, date) newest first.
+    date is the datetime of SensorTimestamp records, None otherwise.
+    Relative records are not dated here.
+    """
+    data = self.data
+    end = len(data)
+    offset = 0
+    while offset < end:
+      op = data[offset]
+      offset += 1
+      size = self.packet_size(op)
+      raw_packet = data[offset:offset + size]
+      yield self.decode_packet(op, raw_packet, offset, None)
+      offset += size
+
+  def packet_size (self, op):
+    if op > 0 and op < 20:
+      template = self.RECORDS.get(op, None)
+      if template is not None:
+        return template['packet_size']
+    return 0
+
   def decode_record (self, op, stream, timestamp):
+    tell = stream.tell( )
+    raw_packet = bytearray(stream.read(self.packet_size(op)))
+    record, date = self.decode_packet(op, raw_packet, tell, timestamp)
+    return record
+
+  def decode_packet (self, op, raw_packet, tell, timestamp):
+    """
+    Decode a record from its op and the packet bytes following it.
+    Returns the record, and the datetime of SensorTimestamp records.
+    """
     if self.larger:
       pass
 
+    date = None
     if op > 0 and op < 20:
-      record = copy.deepcopy(self.RECORDS.get(op, None))
-      if record is None:
+      template = self.RECORDS.get(op, None)
+      if template is None:
         record = dict(name='Could Not Decode',packet_size=0,op=op)
+      else:
+        record = dict(template)
     else:
       record = dict(name='GlucoseSensorData',packet_size=0,date_type='relative',op=op)
       record.update(sgv=(int(op) * 2))
 
-    record['_tell'] = stream.tell( )
-
-    if not record is None and record['packet_size'] > 0:
-      # read the rest of record's bytes
-      raw_packet = bytearray(stream.read(record['packet_size']))
+    record['_tell'] = tell
 
     if record['name'] == 'SensorTimestamp':
-      self.decode_sensor_timestamp(record, raw_packet)
+      date = self.decode_sensor_timestamp(record, raw_packet)
 
     elif self.is_relative_record(record):
       if timestamp:
@@ -161,6 +218,7 @@ class PagedData (object):
         record.update(date=date.isoformat())
       else:
         record.update(_date=str(raw_packet[:4]).encode('hex'))
+      date = None
 
       if record['name'] == 'CalBGForGH':
         self.decode_cal_bg_for_gh(record, raw_packet)
@@ -171,7 +229,7 @@ class PagedData (object):
       if record['name'] == 'SensorSync':
         self.decode_sensor_sync(record, raw_packet)
 
-    return record
+    return record, date
 
   def decode_sensor_timestamp(self, record, raw_packet):
     record.update(raw=self.byte_to_str(raw_packet))
@@ -192,6 +250,7 @@ class PagedData (object):
       record.update(date=date.isoformat())
     else:
       record.update(_date=str(raw_packet[:4]).encode('hex'))
+    return date
 
   def decode_sensor_calibration(self, record, raw_packet):
     record.update(raw=self.byte_to_str(raw_packet))
@@ -254,15 +313,13 @@ class PagedData (object):
     non-relative record other than 0x13 (filler?) or 0x01 (data end)
     before finding the timestamp, returns None
     """
-    stream = self.stream_from_data(self.data)
     offset_count = 0
 
-    for B in iter(lambda: stream.read(1), ""):
-      B = bytearray(B)
-      record = self.decode_record(B[0], stream, None)
+    for record, date in self.iter_records( ):
       if record['name'] == 'SensorTimestamp' and not record['timestamp_type'] == 'gap':
-        timestamp = parser.parse(record['date'])
-        return timestamp + relativedelta(minutes=5*offset_count)
+        if date is None:
+          return None
+        return date + self.FIVE_MINUTES * offset_count
       elif self.is_relative_record(record):
         offset_count = offset_count + 1
       elif not (record['name'] == 'DataEnd' or record['name'] == '19-Something'):
@@ -270,10 +327,7 @@ class PagedData (object):
 
   def byte_to_str (self, byte_array):
     # convert byte array to a string
-    hex_bytes = []
-    for i in range(0, len(byte_array)):
-      hex_bytes.append('{0:02x}'.format(byte_array[i]))
-    return '-'.join(hex_bytes)
+    return '-'.join(map('{0:02x}'.format, byte_array))
 
   def skip_null_bytes (self, data):
     i = 0
@@ -285,6 +339,6 @@ class PagedData (object):
     return io.BufferedReader(io.BytesIO(data))
 
   def check_crc(self, data, expected_crc):
-    computed = lib.CRC16CCITT.compute(bytearray(data))
+    computed = lib.CRC16CCITT.compute(data)
     if lib.BangInt(expected_crc) != computed:
       raise DataTransferCorruptionError("CRC does not match page data")
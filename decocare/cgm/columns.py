@@ -0,0 +1,163 @@
+"""
+columns - compact, typed columns of decoded CGM records.
+
+Months of sensor data as a list of dicts is slow to serialize and slow
+to load again.  Here the records :py:`PagedData.decode` produces are
+stored as four columns instead, one entry per record:
+
+* time, int64: seconds since the epoch of the record's date, taking the
+  pump's clock as if it were UTC, or 0 for undated records
+* sgv, uint16: the glucose value, or 0
+* type, uint8: the record's opcode, with every glucose value (opcodes
+  0x14 and above) stored as 0x14
+* flags, uint8: DATED, SGV, RELATIVE and GAP bits
+
+written little endian, one column after the other, after a 16 byte
+header: magic, format version, reserved, and the number of records.
+A reader can mmap the file and use the columns where they lie, eg with
+``numpy.frombuffer(data, '<i8', count, offset)``.
+
+>>> import os, tempfile
+>>> records = [ dict(name='SensorTimestamp', op='0x08', date='2014-03-21T06:37:00', timestamp_type='page_end'),
+...             dict(name='GlucoseSensorData', op=84, sgv=168, date='2014-03-21T06:42:00', date_type='relative'),
+...             dict(name='DataEnd', op='0x01') ]
+>>> fd, path = tempfile.mkstemp( )
+>>> with os.fdopen(fd, 'wb') as out:
+...   write(records, out)
+3
+>>> columns = Columns(path)
+>>> len(columns), columns.sgv( )
+(3, (0, 168, 0))
+>>> list(columns)[1]
+(1395384120, 168, 20, 7)
+>>> columns.close( ); os.remove(path)
+
+"""
+
+import mmap
+import struct
+import calendar
+from datetime import datetime
+
+from decocare import cgm
+
+MAGIC = 'DCGM'
+VERSION = 1
+HEADER = struct.Struct('<4sHHQ')
+
+GLUCOSE = 0x14
+
+DATED = 0x01
+SGV = 0x02
+RELATIVE = 0x04
+GAP = 0x08
+
+# name, struct format, size
+LAYOUT = [ ('time', 'q', 8), ('sgv', 'H', 2), ('type', 'B', 1), ('flags', 'B', 1) ]
+
+def opcode (record):
+  if record['name'] == 'GlucoseSensorData':
+    return GLUCOSE
+  op = record.get('op', 0)
+  if isinstance(op, basestring):
+    op = int(op, 16)
+  return min(op, GLUCOSE)
+
+def epoch (date):
+  """
+  Seconds since the epoch of an ISO formatted pump date.
+
+  >>> epoch('1970-01-02T00:00:00')
+  86400
+  """
+  return calendar.timegm(datetime.strptime(date[:19], '%Y-%m-%dT%H:%M:%S').timetuple( ))
+
+def row (record):
+  """
+  The column values for one decoded record.
+  """
+  flags = 0
+  time = 0
+  if record.get('date'):
+    time = epoch(record['date'])
+    flags |= DATED
+  sgv = record.get('sgv', 0)
+  if 'sgv' in record:
+    flags |= SGV
+  if record.get('date_type') == 'relative':
+    flags |= RELATIVE
+  if record.get('timestamp_type') == 'gap':
+    flags |= GAP
+  return time, sgv, opcode(record), flags
+
+def write (records, out):
+  """
+  Write records to the file out as columns, and return how many.
+  """
+  rows = map(row, records)
+  count = len(rows)
+  out.write(HEADER.pack(MAGIC, VERSION, 0, count))
+  for i, (name, fmt, size) in enumerate(LAYOUT):
+    out.write(struct.pack('<%d%s' % (count, fmt), *[ r[i] for r in rows ]))
+  return count
+
+def export (pages, path, larger=False):
+  """
+  Decode raw CGM pages, oldest first, and write their records to path.
+  """
+  records = [ ]
+  for page in pages:
+    records.extend(cgm.PagedData.Data(bytearray(page), larger=larger).decode( ))
+  with open(path, 'wb') as out:
+    return write(records, out)
+
+class Columns (object):
+  """
+  Read only view of a column file, memory mapped.
+  """
+  def __init__ (self, path):
+    self.file = open(path, 'rb')
+    self.data = mmap.mmap(self.file.fileno( ), 0, access=mmap.ACCESS_READ)
+    magic, version, reserved, self.count = HEADER.unpack_from(self.data, 0)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError("%s is not a version %s CGM column file" % (path, VERSION))
+    self.offsets = { }
+    offset = HEADER.size
+    for name, fmt, size in LAYOUT:
+      self.offsets[name] = offset
+      offset += size * self.count
+    if len(self.data) < offset:
+      raise ValueError("%s is truncated" % path)
+
+  def __len__ (self):
+    return self.count
+
+  def column (self, name):
+    fmt = dict([ (n, f) for n, f, size in LAYOUT ])[name]
+    return struct.unpack_from('<%d%s' % (self.count, fmt), self.data, self.offsets[name])
+
+  def time (self):
+    return self.column('time')
+
+  def sgv (self):
+    return self.column('sgv')
+
+  def type (self):
+    return self.column('type')
+
+  def flags (self):
+    return self.column('flags')
+
+  def __iter__ (self):
+    return iter(zip(*[ self.column(name) for name, fmt, size in LAYOUT ]))
+
+  def close (self):
+    self.data.close( )
+    self.file.close( )
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
@@ -0,0 +1,161 @@
+"""
+vectorized - decode CGM pages into numpy arrays.
+
+:py:`PagedData.decode` builds a dict per record, dating relative
+records one at a time.  For analysis over many pages only the time,
+glucose value and opcode of each record are needed, and those can be
+found with array operations instead:
+
+* opcodes are classified with lookup tables indexed by the page bytes
+* the 4 byte dates of timestamp and independent records are unpacked
+  for all of them at once
+* relative records are dated from the SensorTimestamp before them with
+  a running count of relative records since that anchor
+
+Finding where records start is the one sequential step, since each
+record's length depends on its opcode; it is a walk over a list of
+precomputed strides.  The results match the scalar decoder: the tests
+compare both on the fixtures in tests/cgm.
+
+numpy is optional, ``pip install decocare[vectorized]``; without it,
+``numpy`` here is None and only the scalar decoder is available.
+
+>>> from decocare import lib
+>>> page = bytearray('\\x34\\x45\\x10\\x28\\xb6\\x14\\x08\\x01'.ljust(1022, '\\x00'))
+>>> crc = lib.CRC16CCITT.compute(page)
+>>> page.extend([ crc >> 8, crc & 0xff ])
+>>> time, sgv, opcode = decode(page)
+>>> [ str(t) for t in time ], sgv.tolist( ), opcode.tolist( )
+(['2016-02-08T20:49:00', '2016-02-08T20:54:00', '2016-02-08T20:54:00', 'NaT'], [104, 138, 0, 0], [52, 69, 8, 1])
+
+"""
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+from decocare import cgm
+from decocare.records.times import Mask
+
+# opcodes at and above this, and 0x00, are glucose values
+GLUCOSE = 0x14
+TIMESTAMP = 0x08
+FILLER = ('DataEnd', '19-Something')
+FIVE_MINUTES = 300
+
+def tables ( ):
+  """
+  Lookup tables indexed by opcode: packet size, and whether records
+  are relative, independent, or filler.
+  """
+  size = numpy.zeros(256, dtype=numpy.intp)
+  relative = numpy.zeros(256, dtype=bool)
+  independent = numpy.zeros(256, dtype=bool)
+  filler = numpy.zeros(256, dtype=bool)
+  for op, template in cgm.PagedData.RECORDS.items( ):
+    size[op] = template['packet_size']
+    relative[op] = template['date_type'] == 'relative'
+    independent[op] = template['date_type'] == 'independent'
+    filler[op] = template['name'] in FILLER
+  relative[0] = True
+  relative[GLUCOSE:] = True
+  return size, relative, independent, filler
+
+def record_starts (data, size):
+  """
+  Offsets of each record in the reversed page data.
+  """
+  strides = (size[data] + 1).tolist( )
+  end = len(strides)
+  starts = [ ]
+  offset = 0
+  while offset < end:
+    starts.append(offset)
+    offset += strides[offset]
+  return numpy.array(starts, dtype=numpy.intp)
+
+def parse_dates (data, at):
+  """
+  The dates packed in the 4 bytes following each offset in at, the way
+  CgmDateDecoder.parse_date reads them, NaT where they are invalid.
+  """
+  b0, b1, b2, b3 = [ data[at + i].astype(numpy.int64) for i in xrange(1, 5) ]
+  year = (b3 & Mask.year) + 2000
+  month = ((b0 & 0xC0) >> 4) + ((b1 & 0xC0) >> 6)
+  day = b2 & Mask.day
+  hour = b0 & 0x1F
+  minute = b1 & 0x3F
+  valid = (month >= 1) & (month <= 12) & (day >= 1) & (hour <= 23) & (minute <= 59)
+  months = ((year - 1970) * 12 + numpy.clip(month, 1, 12) - 1).astype('datetime64[M]')
+  first = months.astype('datetime64[D]')
+  length = ((months + 1).astype('datetime64[D]') - first).astype(numpy.int64)
+  valid &= day <= length
+  dates = (first + (day - 1)).astype('datetime64[s]') + hour * 3600 + minute * 60
+  dates[~valid] = numpy.datetime64('NaT')
+  return dates
+
+def decode (page):
+  """
+  Decode a page, raw bytes or a :py:`cgm.PagedData`, into arrays of
+  time (datetime64[s], NaT for undated records), sgv (uint16, 0 for
+  records without one) and opcode (uint8), oldest record first.
+  """
+  if not isinstance(page, cgm.PagedData):
+    page = cgm.PagedData.Data(bytearray(page))
+  size, relative, independent, filler = tables( )
+  data = numpy.frombuffer(bytes(page.data), dtype=numpy.uint8)
+  at = record_starts(data, size)
+  # room to read a whole packet past the last record
+  data = numpy.concatenate([ data, numpy.zeros(8, dtype=numpy.uint8) ])
+  ops = data[at]
+  count = len(ops)
+
+  sgv = numpy.zeros(count, dtype=numpy.uint16)
+  glucose = (ops == 0) | (ops >= GLUCOSE)
+  sgv[glucose] = ops[glucose].astype(numpy.uint16) * 2
+  sgv[ops == 0x06] = 40
+  sgv[ops == 0x07] = 400
+
+  time = numpy.empty(count, dtype='datetime64[s]')
+  time[:] = numpy.datetime64('NaT')
+  stamped = ops == TIMESTAMP
+  dated = stamped | independent[ops]
+  time[dated] = parse_dates(data, at[dated])
+
+  # relative records, newest first, count down 5 minutes at a time
+  # from the SensorTimestamp before them
+  rel = relative[ops]
+  seen = numpy.cumsum(rel)
+  anchor = numpy.maximum.accumulate(numpy.where(stamped, numpy.arange(count), -1))
+  after = rel & (anchor >= 0)
+  anchors = anchor[after]
+  steps = seen[after] - seen[anchors] - 1
+  time[after] = time[anchors] - steps * FIVE_MINUTES
+
+  # relative records newer than the first SensorTimestamp count up from
+  # it, as long as nothing else comes between
+  if stamped.any( ):
+    first = numpy.argmax(stamped)
+    gap = ((data[at[first] + 3] & 0b01100000) >> 5) == 0x02
+    leading = ops[:first]
+    if not gap and (rel[:first] | filler[leading]).all( ):
+      pending = numpy.flatnonzero(rel[:first])
+      steps = len(pending) - numpy.arange(len(pending))
+      time[pending] = time[first] + steps * FIVE_MINUTES
+
+  return time[::-1], sgv[::-1], ops[::-1].copy( )
+
+def decode_pages (pages):
+  """
+  Decode pages, oldest first, into one set of arrays.
+  """
+  decoded = [ decode(page) for page in pages ]
+  return tuple([ numpy.concatenate(column) for column in zip(*decoded) ])
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
@@ -0,0 +1,288 @@
+"""
+daemon - keep one stick open, and answer pump queries over a socket.
+
+Opening a stick waits for a good signal, reads interface stats and
+the pump model, all before the query a tool was run for.  A
+:py:`Daemon` does that once, then serves requests on a Unix socket,
+one at a time, so short lived tools and cron jobs only wait for the
+query itself.
+
+Requests and replies are JSON, one per line::
+
+  {"id": 1, "method": "call", "params": {"task": "read_status"}}
+  {"id": 1, "result": {...}, "error": null}
+
+Methods are:
+
+* ``ping``
+* ``describe``: the serial, model number, the tasks it can run, and
+  the seconds left in the pump's RF session, if it is tracked
+* ``call``: run a :py:`models.Task` of the pump's model, eg
+  ``read_status``, by name with keyword params, and return its result
+* ``query``: send a command from :py:`commands`, by name, and return
+  the raw bytes of the response, so :py:`RemotePump.query` can hand
+  the caller the same command object :py:`session.Pump.query` would
+* ``power_control``
+* ``interface_stats``
+
+A failed request's error is a dict of the exception's type and message.
+
+Given :py:`rfsession.RFSessions`, the daemon wakes the pump with a
+PowerControl for minutes before any ``call`` or ``query`` made after
+its RF session has lapsed, and records every PowerControl it sends.
+
+>>> import os, tempfile, threading
+>>> from decocare import simulator
+>>> path = os.path.join(tempfile.mkdtemp( ), 'stick.sock')
+>>> daemon = Daemon(simulator.open_pump( ), path)
+>>> worker = threading.Thread(target=daemon.serve_forever)
+>>> worker.start( )
+>>> client = Client(path)
+>>> pump = RemotePump(client)
+>>> pump.serial, pump.modelNumber
+(u'208850', '522')
+>>> pump.model.read_battery_status( )['status']
+'normal'
+>>> client.request('call', task='read_battery_status')['status']
+u'normal'
+>>> pump.query(commands.ReadPumpModel).getData( )
+'522'
+>>> client.close( )
+>>> daemon.shutdown( ); worker.join( ); daemon.server_close( )
+
+"""
+
+import os
+import json
+import socket
+import logging
+import threading
+import SocketServer
+from datetime import datetime
+
+import models
+import commands
+from dateutil.parser import parse as parse_date
+
+log = logging.getLogger( ).getChild(__name__)
+
+# model methods that aren't Tasks, and take a since param
+SINCE = ( 'read_history_since', 'read_glucose_since' )
+# methods that need the pump listening
+RADIO = ( 'call', 'query' )
+
+def encode (obj):
+  """
+  JSON for the things pump queries return.
+  """
+  if isinstance(obj, datetime):
+    return obj.isoformat( )
+  if isinstance(obj, bytearray):
+    return list(obj)
+  if hasattr(obj, '__iter__'):
+    return list(obj)
+  return str(obj)
+
+def is_task (attr):
+  # by class name, since the model may come from decocare.models or models
+  return 'Task' in [ klass.__name__ for klass in type(attr).__mro__ ]
+
+def tasks (model):
+  """
+  Names of the public Tasks of model.
+  """
+  names = [ ]
+  for name in dir(model.__class__):
+    if name.startswith('_'):
+      continue
+    if is_task(getattr(model.__class__, name, None)):
+      names.append(name)
+  return sorted(names) + list(SINCE)
+
+class RemoteError (Exception):
+  """
+  A request failed in the daemon.
+  """
+  def __init__ (self, kind, message):
+    super(RemoteError, self).__init__('%s: %s' % (kind, message))
+    self.kind = kind
+
+class Handler (SocketServer.StreamRequestHandler):
+  def handle (self):
+    for line in iter(self.rfile.readline, ''):
+      try:
+        request = json.loads(line)
+      except ValueError, e:
+        request = None
+      if not isinstance(request, dict):
+        request = dict(id=None, method=None)
+      reply = self.server.answer(request)
+      self.wfile.write(json.dumps(reply, default=encode) + "\n")
+      self.wfile.flush( )
+
+class Daemon (SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+  """
+  Serve pump, a :py:`session.Pump` whose model has been read, on a
+  Unix socket at path.  Requests from any number of clients are run
+  one at a time.  Only the owner may connect.
+  """
+  daemon_threads = True
+  def __init__ (self, pump, path, sessions=None, minutes=10):
+    self.pump = pump
+    self.path = path
+    self.sessions = sessions
+    self.minutes = minutes
+    self.lock = threading.Lock( )
+    if os.path.exists(path):
+      os.remove(path)
+    # the socket is created private, rather than made so afterwards
+    umask = os.umask(0177)
+    try:
+      SocketServer.UnixStreamServer.__init__(self, path, Handler)
+    finally:
+      os.umask(umask)
+
+  def server_close (self):
+    SocketServer.UnixStreamServer.server_close(self)
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+  def answer (self, request):
+    reply = dict(id=request.get('id'), result=None, error=None)
+    method = getattr(self, 'rpc_%s' % request.get('method'), None)
+    try:
+      if method is None:
+        raise ValueError("no such method: %s" % request.get('method'))
+      with self.lock:
+        if request.get('method') in RADIO:
+          self.awake( )
+        reply['result'] = method(**dict([ (str(k), v) for k, v in (request.get('params') or { }).items( ) ]))
+    except Exception, e:
+      log.error("%s failed: %s" % (request.get('method'), e))
+      reply['error'] = dict(type=e.__class__.__name__, message=str(e))
+    return reply
+
+  def awake (self):
+    """
+    Wake the pump if its RF session, when tracked, has lapsed.
+    """
+    if self.sessions is None or self.sessions.is_open(self.pump.serial):
+      return
+    log.info("rf session with %s lapsed, waking it" % self.pump.serial)
+    self.rpc_power_control(minutes=self.minutes)
+
+  def rpc_ping (self):
+    return 'pong'
+
+  def rpc_describe (self):
+    model = self.pump.model
+    rf_session = None
+    if self.sessions is not None:
+      rf_session = self.sessions.remaining(self.pump.serial)
+    return dict(serial=self.pump.serial, model=self.pump.modelNumber, tasks=tasks(model),
+                rf_session=rf_session)
+
+  def rpc_call (self, task=None, params=None):
+    model = self.pump.model
+    if task not in tasks(model):
+      raise ValueError("%s is not a task of %s" % (task, model.__class__.__name__))
+    params = dict([ (str(k), v) for k, v in (params or { }).items( ) ])
+    if task in SINCE:
+      params['since'] = parse_date(params['since'])
+    result = getattr(model, task)(**params)
+    if hasattr(result, 'next'):
+      result = list(result)
+    return result
+
+  def rpc_query (self, command=None, params=None):
+    Command = getattr(commands, command or '', None)
+    if not isinstance(Command, type) or not issubclass(Command, commands.PumpCommand):
+      raise ValueError("%s is not a pump command" % command)
+    params = dict([ (str(k), v) for k, v in (params or { }).items( ) ])
+    response = self.pump.query(Command, **params)
+    return list(response.data)
+
+  def rpc_power_control (self, minutes=None):
+    if minutes is None:
+      minutes = self.minutes
+    data = self.pump.power_control(minutes=minutes)
+    if self.sessions is not None:
+      self.sessions.record(self.pump.serial, minutes)
+    return list(data)
+
+  def rpc_interface_stats (self):
+    return self.pump.stick.interface_stats( )
+
+class Client (object):
+  """
+  Talk to the daemon listening at path.
+  """
+  def __init__ (self, path, timeout=None):
+    self.path = path
+    self.lock = threading.Lock( )
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.settimeout(timeout)
+    self.sock.connect(path)
+    self.stream = self.sock.makefile('rwb')
+    self.ids = 0
+
+  def request (self, method, **params):
+    with self.lock:
+      self.ids += 1
+      self.stream.write(json.dumps(dict(id=self.ids, method=method, params=params), default=encode) + "\n")
+      self.stream.flush( )
+      line = self.stream.readline( )
+    if not line:
+      raise RemoteError('EOFError', "daemon at %s went away" % self.path)
+    reply = json.loads(line)
+    if reply['error']:
+      raise RemoteError(reply['error']['type'], reply['error']['message'])
+    return reply['result']
+
+  def close (self):
+    self.stream.close( )
+    self.sock.close( )
+
+class RemotePump (object):
+  """
+  Stands in for a :py:`session.Pump`, for tools talking to a daemon.
+
+  Its model is the real :py:`models.PumpModel` for the pump's model
+  number, with this as its session, so Tasks, page iterators and
+  history syncing all work as usual: each command is sent by the
+  daemon, and decoded here.
+  """
+  def __init__ (self, client):
+    self.client = client
+    described = client.request('describe')
+    self.serial = described['serial']
+    self.modelNumber = str(described['model'])
+    self.model = models.lookup(self.modelNumber, self)
+
+  def query (self, Command, **kwds):
+    data = self.client.request('query', command=Command.__name__, params=kwds)
+    command = Command(serial=self.serial, **kwds)
+    command.respond(bytearray(data))
+    return command
+
+  def read_model (self):
+    """
+    The daemon read the model when it opened the pump, so answer
+    without asking the pump again.
+    """
+    command = commands.ReadPumpModel(serial=self.serial)
+    command.respond(bytearray([ len(self.modelNumber) ]) + bytearray(self.modelNumber))
+    return command
+
+  def power_control (self, minutes=None):
+    return bytearray(self.client.request('power_control', minutes=minutes))
+
+  def interface_stats (self):
+    return self.client.request('interface_stats')
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
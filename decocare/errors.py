@@ -5,6 +5,8 @@ class AckError(StickError): pass
 
 class BadDeviceCommError(AckError): pass
 
+class BadCRC(StickError): pass
+
 class DataTransferCorruptionError(Exception): pass
 
 #####
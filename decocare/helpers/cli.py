@@ -6,7 +6,7 @@ from pprint import pformat
 
 log = logging.getLogger( ).getChild(__name__)
 
-from decocare import link, stick, session, commands, lib, scan
+from decocare import link, stick, session, commands, lib, scan, capture, rfsession, daemon
 
 class CommandApp(object):
   def __init__(self):
@@ -75,6 +75,16 @@ class CommandApp(object):
                         type=int, default=10,
                         help="How long RF sessions should last"
                         )
+    parser.add_argument('--rf-sessions',
+                        dest='rf_sessions',
+                        default=None,
+                        help="Remember RF sessions here, to skip waking a pump that is still awake [default: ~/.decocare/rf-sessions.json]"
+                        )
+    parser.add_argument('--no-rf-sessions',
+                        dest='track_sessions',
+                        action='store_false', default=True,
+                        help="Always wake the pump, don't trust earlier RF sessions."
+                        )
     parser.add_argument('--auto-init',
                         dest='autoinit',
                         action='store_true', default=False,
@@ -85,6 +95,26 @@ class CommandApp(object):
                         action='store_true', default=False,
                         help="Send power ctrl to initialize RF session."
                         )
+    parser.add_argument('--adaptive-download',
+                        dest='adaptive',
+                        action='store_true', default=False,
+                        help="Poll the stick adaptively instead of sleeping between frames."
+                        )
+    parser.add_argument('--daemon',
+                        dest='daemon',
+                        default=os.environ.get('DECOCARE_DAEMON', None),
+                        help="Talk to the pump through mm-daemon.py listening on this socket, instead of opening the stick [default: $DECOCARE_DAEMON]"
+                        )
+    parser.add_argument('--capture',
+                        dest='capture',
+                        default=None,
+                        help="Record raw frames to this file, for python -m decocare.capture"
+                        )
+    parser.add_argument('--replay',
+                        dest='replay',
+                        default=None,
+                        help="Play back a file recorded with --capture instead of using the stick"
+                        )
     parser = self.customize_parser(parser)
     return parser
 
@@ -110,21 +140,53 @@ class CommandApp(object):
   def run (self, args):
     if not args:
       args = self.configure( )
-    self.prelude(args)
-    self.main(args)
-    self.postlude(args)
+    self.capture = None
+    try:
+      self.prelude(args)
+      self.main(args)
+      self.postlude(args)
+    finally:
+      if self.capture is not None:
+        self.capture.close( )
+
+  def open_link (self, args):
+    if getattr(args, 'replay', None):
+      return capture.ReplayLink(args.replay)
+    return link.Link(args.port)
+
+  def connect (self, args):
+    """
+    Use the pump a daemon has open, instead of the stick.
+    """
+    print "```"
+    print "using daemon at", args.daemon
+    self.uart = None
+    self.pump = daemon.RemotePump(daemon.Client(args.daemon))
+    if args.init or args.autoinit:
+      # the daemon wakes the pump itself when it knows the session lapsed
+      self.pump.power_control(minutes=args.session_life)
+    self.model = self.pump.read_model( )
+    print "```"
+    print '### PUMP MODEL: `%s`' % self.model
 
   def prelude (self, args):
     if args.no_prelude:
       print "##### skipping prelude"
       return
+    if getattr(args, 'daemon', None):
+      self.connect(args)
+      return
     print "## do stuff with an insulin pump over RF"
     print "using", "`", args, "`"
 
     print "```"
-    if args.port == 'scan' or args.port == "":
+    if (args.port == 'scan' or args.port == "") and not getattr(args, 'replay', None):
       args.port = scan.scan( )
-    uart = stick.Stick(link.Link(args.port))
+    device = self.open_link(args)
+    if getattr(args, 'capture', None):
+      self.capture = capture.Capture(args.capture)
+      device.capture_to(self.capture)
+    uart = stick.Stick(device, adaptive=args.adaptive)
     print "```"
     print "```"
     uart.open( )
@@ -145,24 +207,57 @@ class CommandApp(object):
       print "##### skipping normal RF preludes"
       return
     print "```"
-    if not args.autoinit:
+    self.sessions = None
+    if getattr(args, 'track_sessions', False):
+      self.sessions = rfsession.RFSessions(args.rf_sessions)
+    if args.autoinit:
+      self.autoinit(args)
+    elif args.init and self.still_awake(args):
+      pass
+    else:
       if args.init:
-        pump.power_control(minutes=args.session_life)
+        self.power_control(args)
       model = pump.read_model( )
       self.model = model
-    else:
-      self.autoinit(args)
     print "```"
     print '### PUMP MODEL: `%s`' % self.model
 
+  def power_control (self, args):
+    self.pump.power_control(minutes=args.session_life)
+    if self.sessions is not None:
+      self.sessions.record(args.serial, args.session_life)
+
+  def still_awake (self, args):
+    """
+    Read the model without waking the pump, if it was woken recently
+    enough.  Forget the session if the pump doesn't answer.
+    """
+    if self.sessions is None:
+      return False
+    remaining = self.sessions.remaining(args.serial)
+    if not remaining:
+      return False
+    print "RF SESSION STILL OPEN", remaining, "seconds"
+    try:
+      self.sniff_model( )
+      if len(self.model.getData( )) == 3:
+        return True
+    except Exception, e:
+      log.info("no answer inside rf session: %s" % e)
+    print "RF SESSION LOST"
+    self.sessions.forget(args.serial)
+    return False
+
   def autoinit (self, args):
+    if self.still_awake(args):
+      return
     for n in xrange(3):
       print "AUTO INIT", n
       self.sniff_model( )
       if len(self.model.getData( )) != 3:
         self.stats
         print "SENDING POWER ON", n
-        self.pump.power_control(minutes=args.session_life)
+        self.power_control(args)
       else:
         print '### PUMP MODEL: `%s`' % self.model
         break
@@ -178,7 +273,8 @@ class CommandApp(object):
     self.stats( )
   def stats (self):
     print "```"
-    stats = self.uart.interface_stats( )
+    source = self.uart if self.uart is not None else self.pump
+    stats = source.interface_stats( )
     print "```"
     print "```javascript"
     print pformat(stats)
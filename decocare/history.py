@@ -6,6 +6,7 @@ specifically targeted at decoding ReadHistoryData data.
 """
 import io
 from binascii import hexlify
+from collections import Mapping
 
 import lib
 from records import *
@@ -682,10 +683,10 @@ class questionable3b (KnownRecord):
 _confirmed.append(questionable3b)
 
 
-from dateutil.relativedelta import relativedelta
+from datetime import timedelta
 def parse_midnight (data):
     mid = unmask_m_midnight(data)
-    oneday = relativedelta(days=1)
+    oneday = timedelta(days=1)
     try:
       date = datetime(*mid) + oneday
       return date
@@ -789,6 +790,46 @@ def parse_record(fd, head=bytearray( ), larger=False, model=None):
   return record
 
 
+def record_length (record):
+  """
+  How many bytes parse_record consumes for this record: at least the
+  two bytes of head already read to pick the record type, then the
+  rest of the head, the date and the body.
+  """
+  return (max(2, record.head_length) + max(0, record.date_length)
+          + max(0, record.body_length))
+
+# values of head[1] to try, to find records whose length depends on it
+_length_probes = (0x00, 0x01, 0xff)
+_length_tables = { }
+
+def length_table (model=None):
+  """
+  Map each opcode to the length of its records, for model.
+
+  Records whose length depends on the bytes in their head, or which
+  can't be built for this model, map to None; those have to be
+  instantiated to find out.  Tables are built once per model class.
+
+  >>> table = length_table( )
+  >>> table[0x34], table[0x7b], table[0x55]
+  (7, 10, None)
+  """
+  key = type(model)
+  table = _length_tables.get(key, None)
+  if table is None:
+    table = { }
+    for opcode in xrange(256):
+      lengths = set( )
+      for probe in _length_probes:
+        try:
+          lengths.add(record_length(suggest(bytearray([ opcode, probe ]), model=model)))
+        except AttributeError, e:
+          lengths.add(None)
+      table[opcode] = lengths.pop( ) if len(lengths) == 1 else None
+    _length_tables[key] = table
+  return table
+
 def describe( ):
   keys = _known.keys( )
   out  = [ ]
@@ -803,8 +844,9 @@ class PagedData (object):
 
   def __init__ (self, raw, model):
     self.model = model
+    raw = bytearray(raw)
     data, crc = raw[0:1022], raw[1022:]
-    computed = lib.CRC16CCITT.compute(bytearray(data))
+    computed = lib.CRC16CCITT.compute(data)
     if lib.BangInt(crc) != computed:
       assert lib.BangInt(crc) == computed, "CRC does not match page data"
 
@@ -822,12 +864,14 @@ class PagedData (object):
       i = i+1
     return data[i:]
 
+_terminator = bytearray([ 0x00, 0x00 ])
+
 class HistoryPage (PagedData):
   def clean (self, data):
     # data.reverse( )
     # self.data = self.eat_nulls(data)
     #self.data.reverse( )
-    self.data = data[:]
+    self.data = bytearray(data)
     # XXX: under some circumstances, zero is the correct value and
     # eat_nulls actually eats valid data.  This ugly hack restores two
     # nulls back ot the end.
@@ -838,47 +882,320 @@ class HistoryPage (PagedData):
     self.data.append(0x00)
     self.data.append(0x00)
     """
-    self.stream = io.BufferedReader(io.BytesIO(self.data))
-  def decode (self, larger=False):
+
+  def spans (self):
+    """
+    Walk the record boundaries in the page, without decoding them,
+    yielding (offset, length) pairs oldest first, up to the null
+    terminator.
+    """
+    data = self.data
+    end = len(data)
+    lengths = length_table(self.model)
+    offset = 0
+    while offset < end:
+      head = data[offset:offset + 2]
+      if head == _terminator:
+        break
+      length = lengths.get(head[0], None)
+      if length is None:
+        length = record_length(suggest(head, model=self.model))
+      yield offset, min(length, end - offset)
+      offset += length
+
+  def walk (self, larger=False):
+    """
+    Parse the page with integer offsets, taking one slice per record,
+    the same bytes parse_record would read from a stream.  Yields
+    (record, decoded) oldest first; the null terminator, if there is
+    one, is yielded as (None, None).
+    """
+    data = self.data
+    end = len(data)
+    lengths = length_table(self.model)
+    offset = 0
+    while offset < end:
+      head = data[offset:offset + 2]
+      if head == _terminator:
+        yield None, None
+        return
+      record = suggest(head, larger, model=self.model)
+      length = lengths.get(head[0], None)
+      if length is None:
+        length = record_length(record)
+      bolus = data[offset:offset + length]
+      offset += length
+      yield record, parse_bolus(record, bolus)
+
+  def collect (self, make, attach, larger=False):
+    """
+    Gather records made by make(record, decoded), newest first.
+    Records without a timestamp are attach(rec, skipped)ed to the next
+    dated record, or to the last one at the end of the page.
+    """
     records = [ ]
     skipped = [ ]
-    for B in iter(lambda: bytearray(self.stream.read(2)), bytearray("")):
-      if B == bytearray( [ 0x00, 0x00 ] ):
-        if skipped:
-          if len(records) > 0:
-            last = records[-1]
-            last.update(appended=last.get('appended', [ ]) + skipped)
-          # records.extend(skipped)
-          skipped = [ ]
+    for record, decoded in self.walk(larger):
+      if record is None:
+        if skipped and len(records) > 0:
+          attach(records[-1], skipped)
         break
-      record = parse_record(self.stream, B, larger=larger, model=self.model)
-      data = record.decode( )
+      rec = make(record, decoded)
       if record.datetime:
-        rec = dict(timestamp=record.datetime.isoformat( ),
-                   _type=str(record.__class__.__name__),
-                   _body=lib.hexlify(record.body),
-                   _head=lib.hexlify(record.head),
-                   _date=lib.hexlify(record.date),
-                   _description=str(record))
-        if data is not None:
-          rec.update(data)
-          if skipped:
-            rec.update(appended=skipped)
-            skipped = [ ]
+        if decoded is not None and skipped:
+          attach(rec, skipped)
+          skipped = [ ]
         records.append(rec)
       else:
-        rec = dict(_type=str(record.__class__.__name__),
-                   _body=lib.hexlify(record.body),
-                   _head=lib.hexlify(record.head),
-                   _date=lib.hexlify(record.date),
-                   _description=str(record))
-        data = record.decode( )
-        if data is not None:
-          rec.update(data=data)
         skipped.append(rec)
     records.reverse( )
     return records
 
+  def stream (self, make, attach, larger=False):
+    """
+    Like collect, but lazily: find the record boundaries with spans,
+    then decode from the newest record backwards, yielding each as
+    soon as the undated records attached to it are known, so that a
+    consumer who stops early never pays for decoding older records.
+    """
+    data = self.data
+    spans = list(self.spans( ))
+    end = 0
+    if spans:
+      end = spans[-1][0] + spans[-1][1]
+    terminated = data[end:end + 2] == _terminator
+
+    # dated records not yet yielded, newest first; after the first
+    # dated record with fields is found, held[0] is always one
+    held = [ ]
+    # undated records walked since held[0], newest first
+    group = [ ]
+    # undated records newer than every dated record with fields,
+    # waiting for held[0] to collect its own group first
+    trailing = None
+    for offset, length in reversed(spans):
+      record = suggest(data[offset:offset + 2], larger, model=self.model)
+      decoded = parse_bolus(record, data[offset:offset + length])
+      rec = make(record, decoded)
+      if not record.datetime:
+        group.append(rec)
+        continue
+      if decoded is None:
+        held.append(rec)
+        continue
+      if trailing is None:
+        # the undated records at the end of the page belong to the
+        # newest dated record, but only if the page was terminated
+        trailing = [ ]
+        if terminated and group:
+          if held:
+            attach(held[0], group[::-1])
+          else:
+            trailing = group[::-1]
+      else:
+        self.close_group(attach, held[0], group, trailing)
+        trailing = [ ]
+      for rec_ in held:
+        yield rec_
+      held = [ rec ]
+      group = [ ]
+    if trailing is None:
+      if terminated and group and held:
+        attach(held[0], group[::-1])
+    elif held:
+      self.close_group(attach, held[0], group, trailing)
+    for rec_ in held:
+      yield rec_
+
+  @staticmethod
+  def close_group (attach, rec, group, trailing):
+    if group:
+      attach(rec, group[::-1])
+    if trailing:
+      attach(rec, trailing)
+
+  def decode (self, larger=False):
+    """
+    Decode the page into dicts, newest record first.
+    """
+    return self.collect(describe_record, append_skipped, larger=larger)
+
+  def iter_decode (self, larger=False):
+    """
+    Lazily decode the page into dicts, newest record first.
+    """
+    return self.stream(describe_record, append_skipped, larger=larger)
+
+  def records (self, larger=False):
+    """
+    Decode the page into compact HistoryRecords, newest record first.
+    """
+    return self.collect(HistoryRecord.from_record, HistoryRecord.attach, larger=larger)
+
+  def iter_records (self, larger=False):
+    """
+    Lazily decode the page into compact HistoryRecords, newest first.
+    """
+    return self.stream(HistoryRecord.from_record, HistoryRecord.attach, larger=larger)
+
+def parse_bolus (record, bolus):
+  """
+  Parse the bytes read for record, the way parse_record does, and
+  return the decoded result.
+  """
+  if len(bolus) < record.min_length( ):
+    # too short to parse; leave what parse_record would have read
+    record.head = bolus[:max(2, record.head_length)]
+    record.bolus = bolus
+    return record.decode( )
+  return record.parse(bolus)
+
+def describe_record (record, decoded):
+  """
+  The dict HistoryPage.decode returns for a record.
+  """
+  rec = dict(_type=record.__class__.__name__,
+             _body=lib.hexlify(record.body),
+             _head=lib.hexlify(record.head),
+             _date=lib.hexlify(record.date),
+             _description=str(record))
+  if record.datetime:
+    rec.update(timestamp=record.datetime.isoformat( ))
+    if decoded is not None:
+      rec.update(decoded)
+  elif decoded is not None:
+    rec.update(data=decoded)
+  return rec
+
+def append_skipped (rec, skipped):
+  rec.update(appended=rec.get('appended', [ ]) + skipped)
+
+class HistoryRecord (object):
+  """
+  Compact, read only, dict like view of a decoded history record.
+  Uses __slots__, so an instance carries no __dict__.
+
+  Holds just the record type, the bytes it was parsed from, its
+  timestamp and decoded fields.  The hexlified _head, _date and _body
+  and the _description are worked out from the bytes when asked for.
+  as_dict( ) returns the same dict HistoryPage.decode would.
+
+  >>> rec = HistoryRecord(LowReservoir, LowReservoir._test_1, None,
+  ...                     datetime(2012, 12, 7, 11, 2, 43), dict(amount=20.0))
+  >>> rec['_head'], rec['amount'], rec['timestamp']
+  ('34c8', 20.0, '2012-12-07T11:02:43')
+  >>> print rec['_description']
+  LowReservoir 2012-12-07T11:02:43 head[2], body[0] op[0x34]
+  """
+  __slots__ = ('klass', 'bolus', 'model', 'datetime', 'decoded', 'appended')
+  lazy = ('_type', '_body', '_head', '_date', '_description')
+
+  def __init__ (self, klass, bolus, model, datetime, decoded, appended=None):
+    self.klass = klass
+    self.bolus = bolus
+    self.model = model
+    self.datetime = datetime
+    self.decoded = decoded
+    self.appended = appended
+
+  @classmethod
+  def from_record (klass, record, decoded):
+    rec = klass(record.__class__, record.bolus, record.model,
+                record.datetime, decoded)
+    if record.datetime:
+      # keep only what makes it into the record
+      rec.decoded = rec.fields( ) or None
+    return rec
+
+  @staticmethod
+  def attach (rec, skipped):
+    rec.appended = (rec.appended or [ ]) + skipped
+
+  def fields (self):
+    """
+    The decoded fields merged into a dated record, the way dict.update
+    merges them, whatever decode( ) returned.
+    """
+    if isinstance(self.decoded, dict):
+      return self.decoded
+    fields = { }
+    if self.decoded is not None:
+      fields.update(self.decoded)
+    return fields
+
+  def record (self):
+    """
+    Rebuild the full record object from the bytes.
+    """
+    record = self.klass(self.bolus[:2], self.model)
+    parse_bolus(record, self.bolus)
+    return record
+
+  def __getitem__ (self, key):
+    if key == 'appended' and self.appended:
+      return self.appended
+    if self.datetime:
+      fields = self.fields( )
+      if key in fields:
+        return fields[key]
+      if key == 'timestamp':
+        return self.datetime.isoformat( )
+    elif key == 'data' and self.decoded is not None:
+      return self.decoded
+    if key == '_type':
+      return self.klass.__name__
+    if key in self.lazy:
+      record = self.record( )
+      if key == '_description':
+        return str(record)
+      return lib.hexlify(getattr(record, key[1:]))
+    raise KeyError(key)
+
+  def keys (self):
+    keys = list(self.lazy)
+    if self.datetime:
+      keys.append('timestamp')
+      keys.extend([ k for k in self.fields( ) if k not in keys ])
+    elif self.decoded is not None:
+      keys.append('data')
+    if self.appended and 'appended' not in keys:
+      keys.append('appended')
+    return keys
+
+  def __iter__ (self):
+    return iter(self.keys( ))
+
+  def __len__ (self):
+    return len(self.keys( ))
+
+  def __contains__ (self, key):
+    return key in self.keys( )
+
+  def get (self, key, default=None):
+    if key in self:
+      return self[key]
+    return default
+
+  def items (self):
+    return self.as_dict( ).items( )
+
+  def values (self):
+    return self.as_dict( ).values( )
+
+  def as_dict (self):
+    """
+    Materialize into a plain dict, appended records and all.
+    """
+    record = self.record( )
+    rec = describe_record(record, self.decoded)
+    if self.appended:
+      rec.update(appended=[ skipped.as_dict( ) for skipped in self.appended ])
+    return rec
+
+# collections.Mapping has no __slots__ on python 2, subclassing it
+# would bring back the __dict__ on every instance.
+Mapping.register(HistoryRecord)
+
 if __name__ == '__main__':
   import doctest
   doctest.testmod( )
@@ -42,7 +42,15 @@ from datetime import datetime
 
 import dateutil.parser
 from dateutil import relativedelta
-from binascii import unhexlify, hexlify
+from binascii import unhexlify, hexlify, crc_hqx
+import struct
+import re
+
+try:
+  # optional compiled extension, see setup.py
+  from decocare._crc import crc8 as _crc8
+except ImportError:
+  _crc8 = None
 
 def _fmt_hex( bytez ):
   return ' '.join( [ '%#04x' % x for x in list( bytez ) ] )
@@ -188,13 +196,61 @@ class CRC16CCITT:
     32310, 20053, 24180, 11923, 16050, 3793, 7920 ]
   @classmethod
   def compute( klass, block ):
+    """
+    binascii.crc_hqx is the same CCITT polynomial, done in C; we only
+    need to seed it with 0xFFFF.  Works on any buffer without copying.
+    """
+    return crc_hqx( as_buffer( block ), 0xFFFF )
+
+  @classmethod
+  def compute_python( klass, block ):
+    """
+    Pure python version of compute, byte by byte through the lookup table.
+
+    >>> CRC16CCITT.compute_python( bytearray( [ 2, 6, 6, 3 ] ) )
+    16845
+    """
     result = 65535
-    #result = 0
-    for i in xrange( len( block ) ):
-      tmp = block[ i ] ^ result >> 8
-      result = ( klass.lookup[ tmp ] ^ result << 8 ) & 0xFFFF
+    lookup = klass.lookup
+    for b in block:
+      result = ( lookup[ b ^ result >> 8 ] ^ result << 8 ) & 0xFFFF
     return result
 
+  @classmethod
+  def verify( klass, page, offset=0, size=1024 ):
+    """
+    Check the two byte trailer of one page, found at offset within
+    page, which may be a bytearray, str, memoryview, or mmap.
+
+    >>> page = bytearray( [ 2, 6, 6, 3, 0x41, 0xCD ] )
+    >>> CRC16CCITT.verify( page, size=6 )
+    True
+    >>> CRC16CCITT.verify( page[:-1] + bytearray( [ 0x00 ] ), size=6 )
+    False
+    """
+    body = window( page, offset, size - 2 )
+    expected, = struct.unpack_from( '>H', page, offset + size - 2 )
+    return crc_hqx( body, 0xFFFF ) == expected
+
+  @classmethod
+  def verify_pages( klass, pages, size=1024 ):
+    """
+    Bulk version of verify.  Given a buffer of concatenated pages, eg a
+    whole archive file or mmap, or a list of pages, check each page's
+    trailer in one call, without copying any page.  Returns a list of
+    booleans, one per page.
+
+    >>> page = bytearray( [ 2, 6, 6, 3, 0x41, 0xCD ] )
+    >>> CRC16CCITT.verify_pages( page * 3, size=6 )
+    [True, True, True]
+    >>> CRC16CCITT.verify_pages( [ page, bytearray( 6 ) ], size=6 )
+    [True, False]
+    """
+    if isinstance( pages, ( list, tuple ) ):
+      return [ klass.verify( page, size=size ) for page in pages ]
+    return [ klass.verify( pages, offset, size )
+             for offset in xrange( 0, len( pages ) - size + 1, size ) ]
+
 
 class CRC8:
   lookup = [ 0, 155, 173, 54, 193, 90, 108, 247, 25, 130, 180, 47,
@@ -219,12 +275,55 @@ class CRC8:
 
   @classmethod
   def compute( klass, block ):
+    if _crc8 is None:
+      return klass.compute_python( block )
+    try:
+      return _crc8( as_buffer( block ) )
+    except ValueError:
+      # list with values outside of a byte; let compute_python mask them.
+      return klass.compute_python( block )
+
+  @classmethod
+  def compute_python( klass, block ):
+    """
+    Pure python version of compute, used when the _crc extension is
+    not available.
+
+    >>> CRC8.compute_python( bytearray( [ 0x00, 0xFF, 0x00 ] ) )
+    177
+    """
     result = 0
-    for i in xrange( len( block ) ):
-      result = klass.lookup[ ( result ^ block[ i ] & 0xFF ) ]
+    lookup = klass.lookup
+    for b in block:
+      result = lookup[ result ^ b & 0xFF ]
     return result
 
 
+_buffer_types = ( bytearray, str, memoryview, buffer )
+
+def as_buffer( block ):
+  """
+  Most callers hand us a bytearray, but plenty of packets are still
+  built as lists of ints.  Only copy those.
+  """
+  if isinstance( block, _buffer_types ):
+    return block
+  try:
+    return memoryview( block )
+  except TypeError:
+    return bytearray( block )
+
+def window( data, offset, size ):
+  """
+  Zero copy slice of data.  Objects without the new buffer interface,
+  like mmap, get an old style buffer instead of a memoryview.
+  """
+  try:
+    return memoryview( data )[ offset:offset + size ]
+  except TypeError:
+    return buffer( data, offset, size )
+
+
 def BangLong( bytez ):
   ( a, b, c, d ) = bytez
   l = a << 24 | b << 16 | c << 8 | d;
@@ -247,6 +346,25 @@ def makeByte(highNibble, lowNibble):
 ENCODE_TABLE = [ 21, 49, 50, 35, 52, 37, 38, 22,
                  26, 25, 42, 11, 44, 13, 14, 28 ]
 
+# 6 bit symbol -> nibble, None for symbols that aren't in ENCODE_TABLE
+DECODE_TABLE = [ None ] * 64
+for _nibble, _symbol in enumerate(ENCODE_TABLE):
+  DECODE_TABLE[_symbol] = _nibble
+
+# A byte encodes to 12 bits, two symbols, which is exactly three hex
+# digits.  Working in hex lets hexlify/unhexlify and a regex do the bit
+# shuffling, so that whole frames go through a few table passes instead
+# of a loop per bit.
+_ENCODE_HEX = { }
+_DECODE_HEX = { }
+for _byte in xrange(256):
+  _chunk = ENCODE_TABLE[_byte >> 4] << 6 | ENCODE_TABLE[_byte & 0xF]
+  _ENCODE_HEX['%02x' % _byte] = '%03x' % _chunk
+  _DECODE_HEX['%03x' % _chunk] = '%02x' % _byte
+del _nibble, _symbol, _byte, _chunk
+_hex_pairs = re.compile('..', re.S).findall
+_hex_triples = re.compile('...', re.S).findall
+
 _enc_test_1 = [ 0xA7, 0x47, 0x33, 0x62, 0x5D, 0x02, 0x01, 0x01, 0x00, 0x00,
                 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
                 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
@@ -277,34 +395,27 @@ def encodeDC(msg):
     True
     >>> encodeDC(_enc_test_2) == bytearray(_enc_result_2)
     True
+    >>> encodeDC([ ])
+    bytearray(b'')
 
 
   """
-  msg = bytearray(msg)
-  # realign bytes
-  nibbles = [ ]
-  result = [ ]
-  # collect nibbles
-  for b in msg:
-    highNibble = b >> 4 & 0xF
-    lowNibble  = b & 0xF
-    dcValue1   = ENCODE_TABLE[highNibble]
-    dcValue2   = ENCODE_TABLE[lowNibble]
-    nibbles.append(dcValue1 >> 2)
-
-    high2Bits = dcValue1 & 0x3
-    low2Bits  = dcValue2 >> 4 & 0x3
-    nibbles.append( high2Bits << 2 | low2Bits )
-    nibbles.append( dcValue2 & 0xF )
-
-  for i in xrange(0, len(nibbles), 2):
-    # last item gets a padding terminator
-    high, low = nibbles[i], 5
-    # most elide the next item
-    if i < len(nibbles) - 1:
-      low = nibbles[i+1]
-    result.append(makeByte(high, low))
-  return bytearray(result)
+  # each byte becomes exactly three hex digits of symbols; an odd
+  # number of bytes leaves half a byte, which gets a padding terminator
+  symbols = ''.join(map(_ENCODE_HEX.__getitem__,
+                        _hex_pairs(hexlify(bytearray(msg)))))
+  if len(symbols) % 2:
+    symbols += '5'
+  return bytearray(unhexlify(symbols))
+
+def encodeDCFrames(frames):
+  """
+  Encode a list of frames.
+
+    >>> encodeDCFrames([ _enc_test_1, _enc_test_2 ]) == [ bytearray(_enc_result_1), bytearray(_enc_result_2) ]
+    True
+  """
+  return map(encodeDC, frames)
 
 
 _decode_test_1 = [0xA9, 0x6D, 0x16, 0x8E, 0x39, 0xB2, 0x68, 0xD5, 0x59, 0x56,
@@ -335,43 +446,47 @@ def decodeDC(msg):
     True
     >>> decodeDC(_decode_test_2) == bytearray(_decode_result_2)
     True
+    >>> decodeDC([ 0xFF, 0xFF, 0xFF ])
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid 4b6b symbols: 'fff'
   """
   msg = bytearray(msg)
-  result      = [ ]
-  nibbleCount =  0
-  bitCount    =  0
-  sixBitValue =  0
-  highValue   =  0
-  highNibble  =  0
-  #
-  for B in msg:
-    bP = 7
-    while bP >= 0:
-      bitValue = B >> bP & 0x1
-      sixBitValue = sixBitValue << 1 | bitValue
-      bitCount += 1
-      if bitCount != 6:
-        bP -= 1
-        continue; # next
-      nibbleCount += 1
-      if nibbleCount == 1:
-        highNibble = decodeDCByte(sixBitValue)
-      else:
-        lowNibble = decodeDCByte(sixBitValue)
-        byteValue = makeByte(highNibble, lowNibble)
-        # append to result
-        result.append(byteValue)
-        nibbleCount = 0
-      sixBitValue = 0
-      bitCount    = 0
-      bP -= 1
-
-  return bytearray(result)
+  # every three bytes hold two 12 bit pairs of symbols, one byte each
+  try:
+    result = ''.join(map(_DECODE_HEX.__getitem__, _hex_triples(hexlify(msg))))
+  except KeyError, e:
+    raise ValueError("invalid 4b6b symbols: %r" % e.args[0])
+  # a lone trailing byte holds half a pair; check it, like the
+  # bitwise decoder always has, but there's no byte to emit
+  if len(msg) % 3 == 1:
+    decodeDCByte(msg[-1] >> 2)
+  return bytearray(unhexlify(result))
+
+def decodeDCFrames(frames):
+  """
+  Decode a list of frames.
+
+    >>> decodeDCFrames([ _decode_test_1, _decode_test_2 ]) == [ bytearray(_decode_result_1), bytearray(_decode_result_2) ]
+    True
+  """
+  return map(decodeDC, frames)
 
 def decodeDCByte(B):
-  # B should be 0 < B && B < 63
-  # look up in decode table
-  return ENCODE_TABLE.index(B)
+  """
+  Look up a single 6 bit symbol.
+
+    >>> decodeDCByte(21)
+    0
+    >>> decodeDCByte(0)
+    Traceback (most recent call last):
+    ...
+    ValueError: invalid 4b6b symbol: 0
+  """
+  nibble = DECODE_TABLE[B & 0x3F]
+  if nibble is None:
+    raise ValueError("invalid 4b6b symbol: %r" % B)
+  return nibble
 
 
 def decode_hexline (line):
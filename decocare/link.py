@@ -13,9 +13,25 @@ log = io.getChild(__name__)
 class AlreadyInUseException (Exception):
   pass
 
+class Hexdump( object ):
+  """
+  Hexdump data only once a log record is actually formatted, so wire
+  tracing costs nothing while INFO is off.
+
+  >>> str( Hexdump( '\x01\x55' ) ) == lib.hexdump( bytearray( '\x01\x55' ) )
+  True
+  """
+  __slots__ = ( 'data', )
+  def __init__( self, data ):
+    self.data = data
+
+  def __str__( self ):
+    return lib.hexdump( bytearray( self.data ) )
+
 class Link( object ):
   __timeout__ = .500
   port = None
+  capture = None
   def __init__( self, port, timeout=None ):
     if timeout is not None:
       self.__timeout__ = timeout
@@ -43,33 +59,49 @@ class Link( object ):
     io.info( 'closing serial port' )
     return self.serial.close( )
 
+  def capture_to( self, sink ):
+    """
+    Record every frame written and read to sink, a
+    :py:`capture.Capture`, or stop recording with None.
+    """
+    self.capture = sink
+
   def write( self, string ):
     r = self.serial.write( string )
-    io.info( 'usb.write.len: %s\n%s' % ( len( string ),
-                                         lib.hexdump( bytearray( string ) ) ) )
+    if self.capture is not None:
+      self.capture.write( string )
+    if io.isEnabledFor( logging.INFO ):
+      io.info( 'usb.write.len: %s\n%s', len( string ), Hexdump( string ) )
     return r
 
   def read( self, c ):
     r = self.serial.read( c )
-    io.info( 'usb.read.len: %s'   % ( len( r ) ) )
-    io.info( 'usb.read.raw:\n%s' % ( lib.hexdump( bytearray( r ) ) ) )
+    if self.capture is not None:
+      self.capture.read( r )
+    if io.isEnabledFor( logging.INFO ):
+      io.info( 'usb.read.len: %s', len( r ) )
+      io.info( 'usb.read.raw:\n%s', Hexdump( r ) )
     return r
 
   def readline( self ):
     r = self.serial.readline( )
-    io.info( 'usb.read.len: %s\n%s' % ( len( r ),
-                                        lib.hexdump( bytearray( r ) ) ) )
+    if self.capture is not None:
+      self.capture.read( r )
+    if io.isEnabledFor( logging.INFO ):
+      io.info( 'usb.read.len: %s\n%s', len( r ), Hexdump( r ) )
     return r
 
   def readlines( self ):
     r = self.serial.readlines( )
-    io.info( 'usb.read.len: %s\n%s' % ( len( r ),
-                                        lib.hexdump( bytearray( ''.join( r ) ) ) ) )
+    if self.capture is not None:
+      self.capture.read( ''.join( r ) )
+    if io.isEnabledFor( logging.INFO ):
+      io.info( 'usb.read.len: %s\n%s', len( r ), Hexdump( ''.join( r ) ) )
     return r
 
 if __name__ == '__main__':
   import doctest
-  doctest.testmost( )
+  doctest.testmod( )
 
 
 #####
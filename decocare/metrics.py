@@ -0,0 +1,222 @@
+"""
+metrics - counters and latency histograms for the hot paths.
+
+The stick and session count what they do here as they do it: round
+trips per opcode, bytes per frame, polls, zero length reads, bad CRCs,
+NAKs and every second spent in ``time.sleep``.  Read them back as a
+dict with :py:`Registry.snapshot`, or as Prometheus text with
+:py:`Registry.prometheus`, to see where a slow sync spends its time.
+
+Metrics are kept in a :py:`Registry`, by default the module's
+:py:`REGISTRY`, and may carry labels, given as keyword arguments.
+
+>>> registry = Registry( )
+>>> reads = registry.counter('reads_total', 'Reads, by result')
+>>> reads.inc(result='empty')
+>>> reads.inc(2, result='empty')
+>>> seconds = registry.histogram('read_seconds', 'Read time', buckets=(.1, 1))
+>>> seconds.observe(.05)
+>>> seconds.observe(.5)
+>>> registry.snapshot( )['reads_total']['values']
+{'result="empty"': 3}
+>>> print registry.prometheus( ),
+# HELP read_seconds Read time
+# TYPE read_seconds histogram
+read_seconds_bucket{le="0.1"} 1
+read_seconds_bucket{le="1"} 2
+read_seconds_bucket{le="+Inf"} 2
+read_seconds_sum 0.55
+read_seconds_count 2
+# HELP reads_total Reads, by result
+# TYPE reads_total counter
+reads_total{result="empty"} 3
+
+"""
+
+import time
+import threading
+
+# seconds, from a quick LinkStatus up to a slow page
+BUCKETS = (.001, .005, .010, .025, .050, .100, .250, .500, 1, 2.5, 5, 10)
+
+def label_text (labels):
+  """
+  >>> label_text(( ('opcode', 141), ('kind', 'pump') ))
+  'opcode="141",kind="pump"'
+  """
+  return ','.join([ '%s="%s"' % (name, value) for name, value in labels ])
+
+def number (value):
+  """
+  >>> number(3.0), number(.25)
+  ('3', '0.25')
+  """
+  return repr(value) if value != int(value) else '%d' % value
+
+class Metric (object):
+  kind = None
+  def __init__ (self, name, help, lock):
+    self.name = name
+    self.help = help
+    self.lock = lock
+    self.values = { }
+
+  def key (self, labels):
+    return tuple(sorted(labels.items( )))
+
+  def reset (self):
+    with self.lock:
+      self.values = { }
+
+class Counter (Metric):
+  """
+  A count that only goes up.
+  """
+  kind = 'counter'
+  def inc (self, amount=1, **labels):
+    key = self.key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+  def get (self, **labels):
+    return self.values.get(self.key(labels), 0)
+
+  def snapshot (self):
+    return dict([ (label_text(key), value) for key, value in self.values.items( ) ])
+
+  def lines (self):
+    for key, value in sorted(self.values.items( )):
+      labels = key and '{%s}' % label_text(key) or ''
+      yield '%s%s %s' % (self.name, labels, number(value))
+
+class Histogram (Metric):
+  """
+  Observations counted into buckets, with their count and sum.
+  """
+  kind = 'histogram'
+  def __init__ (self, name, help, lock, buckets=BUCKETS):
+    super(Histogram, self).__init__(name, help, lock)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe (self, value, **labels):
+    key = self.key(labels)
+    with self.lock:
+      state = self.values.get(key, None)
+      if state is None:
+        state = self.values[key] = dict(count=0, sum=0.0, buckets=[ 0 ] * len(self.buckets))
+      state['count'] += 1
+      state['sum'] += value
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          state['buckets'][i] += 1
+          break
+
+  def time (self, **labels):
+    """
+    Observe the seconds a with block takes.
+    """
+    return Timer(self, labels)
+
+  def get (self, **labels):
+    return self.values.get(self.key(labels), dict(count=0, sum=0.0))
+
+  def snapshot (self):
+    snapshot = { }
+    for key, state in self.values.items( ):
+      snapshot[label_text(key)] = dict(count=state['count'], sum=state['sum'],
+                                       buckets=dict(zip(map(number, self.buckets),
+                                                        self.cumulative(state))))
+    return snapshot
+
+  def cumulative (self, state):
+    total = 0
+    counts = [ ]
+    for count in state['buckets']:
+      total += count
+      counts.append(total)
+    return counts
+
+  def lines (self):
+    for key, state in sorted(self.values.items( )):
+      prefix = key and label_text(key) + ',' or ''
+      bounds = map(number, self.buckets) + [ '+Inf' ]
+      for bound, count in zip(bounds, self.cumulative(state) + [ state['count'] ]):
+        yield '%s_bucket{%sle="%s"} %s' % (self.name, prefix, bound, count)
+      labels = key and '{%s}' % label_text(key) or ''
+      yield '%s_sum%s %s' % (self.name, labels, number(state['sum']))
+      yield '%s_count%s %s' % (self.name, labels, state['count'])
+
+class Timer (object):
+  def __init__ (self, histogram, labels):
+    self.histogram = histogram
+    self.labels = labels
+
+  def __enter__ (self):
+    self.began = time.time( )
+    return self
+
+  def __exit__ (self, *exc):
+    self.histogram.observe(time.time( ) - self.began, **self.labels)
+
+class Registry (object):
+  """
+  A set of metrics, each created once by name.
+  """
+  def __init__ (self):
+    self.lock = threading.Lock( )
+    self.metrics = { }
+
+  def register (self, klass, name, help, **kwds):
+    with self.lock:
+      metric = self.metrics.get(name, None)
+      if metric is None:
+        metric = self.metrics[name] = klass(name, help, self.lock, **kwds)
+    return metric
+
+  def counter (self, name, help):
+    return self.register(Counter, name, help)
+
+  def histogram (self, name, help, buckets=BUCKETS):
+    return self.register(Histogram, name, help, buckets=buckets)
+
+  def reset (self):
+    for metric in self.metrics.values( ):
+      metric.reset( )
+
+  def snapshot (self):
+    """
+    Every metric as a dict of type, help and values by label.
+    """
+    with self.lock:
+      return dict([ (name, dict(type=metric.kind, help=metric.help, values=metric.snapshot( )))
+                    for name, metric in self.metrics.items( ) ])
+
+  def prometheus (self):
+    """
+    Every metric in the Prometheus text exposition format.
+    """
+    lines = [ ]
+    with self.lock:
+      for name, metric in sorted(self.metrics.items( )):
+        lines.append('# HELP %s %s' % (name, metric.help))
+        lines.append('# TYPE %s %s' % (name, metric.kind))
+        lines.extend(metric.lines( ))
+    return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry( )
+
+SLEEP = REGISTRY.histogram('decocare_sleep_seconds', 'Time spent in time.sleep, by where')
+
+def sleep (seconds, where='other'):
+  """
+  time.sleep, counting the time slept under where.
+  """
+  SLEEP.observe(seconds, where=where)
+  time.sleep(seconds)
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
@@ -1,7 +1,16 @@
 
 from decocare import commands, history, cgm
 from decocare import lib
+from decocare.cache import page_key
+from decocare.errors import DataTransferCorruptionError
+import sys
 import types
+import Queue
+import logging
+import threading
+from datetime import datetime, timedelta
+
+log = logging.getLogger( ).getChild(__name__)
 
 class Task (object):
   def __init__ (self, msg, handler=None, **kwargs):
@@ -41,18 +50,114 @@ class Cursor (object):
     self.kwds = kwds
   def get_page_info (self):
     self.info = self.inst.session.query(self.Info)
+  def numbers (self):
+    self.get_page_info( )
+    for num in self.range(self.info.getData( )):
+      yield num
+  def fetch (self, num):
+    """
+    The bytes of page num, ready to decode; everything that talks to
+    the pump happens here.
+    """
+    return self.fetch_page(num)
   def download_page (self, num):
-    page = self.inst.session.query(self.Page, page=num)
-    for record in self.find_records(page):
+    data = self.fetch(num)
+    for record in self.find_records(data):
       yield record
+  def locator (self, num):
+    """
+    A name for page num that stays valid, if the page can never
+    change, so that it can be found in the page cache without asking
+    the pump.  None otherwise.
+    """
+    return None
+  def fetch_page (self, num, refresh=False):
+    """
+    The bytes of page num, from the model's page cache if it has
+    them, otherwise from the pump, adding them to the cache.
+    """
+    cache = self.inst.cache
+    locator = self.locator(num)
+    if cache is not None and locator is not None and not refresh:
+      data = cache.lookup(locator)
+      if data is not None:
+        log.info("page %s from cache" % locator)
+        return data
+    page = self.inst.session.query(self.Page, page=num)
+    if cache is not None:
+      try:
+        cache.put(page.data, locator=locator)
+      except DataTransferCorruptionError, e:
+        log.info("not caching page %s: %s" % (num, e))
+    return page.data
+  def decode_records (self, data):
+    """
+    Decode a page, or find its records in the page cache.
+    """
+    cache = self.inst.cache
+    if cache is None:
+      return self.decode(data)
+    key = page_key(data)
+    name = '%s-%s' % (self.__class__.__name__, self.inst.__class__.__name__)
+    records = cache.get_records(key, name)
+    if records is None:
+      records = self.decode(data)
+      try:
+        cache.put_records(key, name, records)
+      except TypeError, e:
+        log.info("not caching records for %s: %s" % (key, e))
+    return records
   def range (self, info):
     raise NotImplemented( )
-  def find_records (self, response):
+  def decode (self, data):
     raise NotImplemented( )
+  def find_records (self, data):
+    return self.decode_records(data)
   def iter (self):
-    self.get_page_info( )
-    for n in self.range(self.info.getData( )):
-      yield self.download_page(n)
+    depth = self.kwds.get('pipeline', None)
+    if depth:
+      return self.iter_pipelined(depth)
+    return (self.download_page(num) for num in self.numbers( ))
+  def iter_pipelined (self, depth=2):
+    """
+    Like iter, but a thread fetches up to depth pages ahead of the
+    consumer, so the radio is busy with the next page while the
+    previous one is decoded.  Pages come out in order; a failure to
+    fetch is raised in the consumer.
+    """
+    pages = Queue.Queue(maxsize=depth)
+    stop = threading.Event( )
+    def offer (item):
+      while not stop.is_set( ):
+        try:
+          pages.put(item, timeout=.100)
+          return True
+        except Queue.Full:
+          pass
+      return False
+    def produce ( ):
+      try:
+        for num in self.numbers( ):
+          if not offer((self.fetch(num), None)):
+            return
+      except Exception:
+        offer((None, sys.exc_info( )))
+        return
+      offer((None, None))
+    worker = threading.Thread(target=produce, name='%s-fetch' % self.__class__.__name__)
+    worker.daemon = True
+    worker.start( )
+    try:
+      while True:
+        data, error = pages.get( )
+        if error is not None:
+          raise error[0], error[1], error[2]
+        if data is None:
+          break
+        yield self.find_records(data)
+    finally:
+      stop.set( )
+      worker.join( )
 
 class PageIterator (Task):
 
@@ -80,6 +185,8 @@ class PumpModel (object):
   MMOL_DEFAULT = False
   larger = False
   Ian50Body = 30
+  # a cache.PageCache, for iter_history_pages/iter_glucose_pages
+  cache = None
   def __init__(self, model, session):
     self.model = model
     self.session = session
@@ -144,15 +251,23 @@ class PumpModel (object):
       return xrange(start, end, -1)
     def cgm_paged_data(self, page_bytes):
       return cgm.PagedData.Data(page_bytes, larger=self.inst.larger)
-    def find_records (self, response):
-      return reversed(self.cgm_paged_data(response.data).decode())
-    def download_page (self, num):
-      page = self.inst.session.query(self.Page, page=num)
-      if self.cgm_paged_data(page.data).needs_timestamp():
+    def locator (self, num):
+      # glucose pages are numbered from the start; once the pump is
+      # writing a later page, this one never changes again
+      serial = getattr(self.inst.session, 'serial', None)
+      if serial and num < int(self.info.getData( )['page']):
+        return '%s:glucose:%s' % (serial, num)
+      return None
+    def decode (self, data):
+      return self.cgm_paged_data(data).decode( )
+    def find_records (self, data):
+      return reversed(self.decode_records(data))
+    def fetch (self, num):
+      data = self.fetch_page(num)
+      if self.cgm_paged_data(data).needs_timestamp():
         self.inst.session.query(self.WriteTimestamp)
-        page = self.inst.session.query(self.Page, page=num)
-      for record in self.find_records(page):
-        yield record
+        data = self.fetch_page(num, refresh=True)
+      return data
 
 
   @PageIterator.handler( )
@@ -163,14 +278,81 @@ class PumpModel (object):
       start = 0
       end = int(info)
       return xrange(start, end)
-    def find_records (self, response):
-      decoder = history.HistoryPage(response.data, self.inst)
+    def decode (self, data):
+      decoder = history.HistoryPage(data, self.inst)
       records = decoder.decode( )
       return records
+    def find_records (self, data):
+      if self.inst.cache is not None:
+        return self.decode_records(data)
+      # nothing to cache, so decode only as far as the consumer reads
+      return history.HistoryPage(data, self.inst).iter_decode( )
+    def numbers (self):
+      # page 0 is always there; only ask how many pages there are
+      # once the consumer reads past it
+      yield 0
+      self.get_page_info( )
+      for num in self.range(self.info.getData( )):
+        if num > 0:
+          yield num
 
   filter_glucose_date = Task(commands.FilterGlucoseHistory.ISO)
   filter_isig_date = Task(commands.FilterISIGHistory.ISO)
 
+  def iter_history_since (self, since):
+    """
+    Pump history records at or after since, newest first.  Pages are
+    fetched one at a time, and decoded only as far back as since, so
+    that recent history costs a single page; the page count is only
+    asked for when since reaches back past page 0.
+    """
+    cutoff = since.replace(tzinfo=None).isoformat( )
+    cursor = self.__class__.iter_history_pages.Cursor(self)
+    number = 0
+    pages = None
+    while True:
+      for record in cursor.download_page(number):
+        if record.get('timestamp', cutoff) < cutoff:
+          return
+        yield record
+      number += 1
+      if pages is None:
+        cursor.get_page_info( )
+        pages = int(cursor.info.getData( ))
+      if number >= pages:
+        return
+
+  def read_history_since (self, since):
+    return list(self.iter_history_since(since))
+
+  # whether the pump answers FilterGlucoseHistory
+  filters_glucose = False
+
+  def iter_glucose_since (self, since):
+    """
+    Glucose records at or after since, newest first.  Pumps which
+    answer FilterGlucoseHistory tell us the oldest page to read; the
+    filter only works in whole days, so records are still cut off at
+    since as they are read.
+    """
+    cutoff = since.replace(tzinfo=None).isoformat( )
+    cursor = self.__class__.iter_glucose_pages.Cursor(self)
+    cursor.get_page_info( )
+    pages = cursor.range(cursor.info.getData( ))
+    if self.filters_glucose:
+      end = datetime.now( ) + timedelta(days=1)
+      window = self.filter_glucose_date(begin=cutoff, end=end.isoformat( ))
+      if isinstance(window, dict):
+        pages = [ n for n in pages if n >= window['begin'] ]
+    for number in pages:
+      for record in cursor.download_page(number):
+        if record.get('date', cutoff) < cutoff:
+          return
+        yield record
+
+  def read_glucose_since (self, since):
+    return list(self.iter_glucose_since(since))
+
   @Task.handler(commands.ReadHistoryData)
   def read_history_data (self, response):
     decoder = history.HistoryPage(response.data, self)
@@ -280,6 +462,7 @@ class Model715 (Model515):
 
 class Model522 (Model515):
   MMOL_DEFAULT = False
+  filters_glucose = True
   old6cBody = 38
   pass
 
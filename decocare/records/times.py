@@ -198,6 +198,16 @@ def encode_second(sec=18, month=10):
   encoded = sec | (high << 6)
   return bytearray( [ encoded ] )
 
+def encode_date(date):
+  """
+  Encode a datetime into the 5 bytes parse_date reads.
+
+  >>> parse_date(encode_date(datetime(2012, 11, 16, 14, 20, 19))).isoformat( )
+  '2012-11-16T14:20:19'
+  """
+  monthbyte = encode_monthbyte(sec=date.second, minute=date.minute, month=date.month)
+  return monthbyte + bytearray([ date.hour, date.day, date.year - 2000 ])
+
 def test_time_encoders( ):
   """
   >>> test_time_encoders( )
@@ -0,0 +1,270 @@
+"""
+retry - how long to wait, and whether to try again, when the radio fails.
+
+The stick and session used to wait fixed, worst case times: half a
+second after an empty read, the whole of a command's effectTime
+before every download, whether the link was healthy or not.  A
+:py:`Policy` decides instead, from what it has seen so far:
+
+* failures are classified, by :py:`classify`, as :py:`BAD_CRC`,
+  :py:`NAK`, :py:`ACK`, :py:`ZERO_READ` or :py:`INCOMPLETE`
+* each class backs off from a small first pause, doubling with every
+  failure in a row, with jitter, never longer than the old fixed wait
+* a :py:`Breaker` stops trying for a while after too many failures
+  in a row, rather than spending every retry of every command on a
+  stick or pump that has gone away
+* :py:`Latencies` learns how long each opcode takes to answer, and on
+  a stick that polls until the answer arrives, the effectTime wait is
+  cut down to what the pump usually needs
+
+>>> steady = { ZERO_READ: Backoff(.010, .500, jitter=0) }
+>>> policy = Policy(backoff=steady, sleep=lambda seconds, where: None)
+>>> policy.pause(ZERO_READ, worst=.250)
+0.01
+>>> for n in xrange(8):
+...   policy.failed(ZERO_READ)
+>>> policy.pause(ZERO_READ, worst=.250)
+0.25
+>>> policy.succeeded( )
+>>> policy.pause(ZERO_READ, worst=.250)
+0.01
+
+"""
+
+import time
+import random
+import logging
+
+import metrics
+from errors import StickError, AckError, BadDeviceCommError, BadCRC
+
+log = logging.getLogger( ).getChild(__name__)
+
+BAD_CRC = 'bad_crc'
+NAK = 'nak'
+ACK = 'ack'
+ZERO_READ = 'zero_read'
+INCOMPLETE = 'incomplete'
+
+FAILURES = metrics.REGISTRY.counter('decocare_retry_failures_total',
+                                    'Failures seen by the retry policy, by class')
+OPENED = metrics.REGISTRY.counter('decocare_retry_breaker_open_total',
+                                  'Times the circuit breaker opened')
+
+class CircuitOpen (StickError):
+  """
+  Too many failures in a row; not trying again yet.
+  """
+
+def classify (error):
+  """
+  The failure class of an exception, or None if it shouldn't be
+  retried.
+
+  >>> classify(BadDeviceCommError( )), classify(AckError( )), classify(ValueError( ))
+  ('nak', 'ack', None)
+  """
+  if isinstance(error, BadCRC):
+    return BAD_CRC
+  if isinstance(error, BadDeviceCommError):
+    return NAK
+  if isinstance(error, AckError):
+    return ACK
+  return None
+
+class Backoff (object):
+  """
+  Pause first seconds after the first failure, factor times longer
+  after each further one, up to cap.  The jitter fraction of each
+  pause is random, so retries don't fall into step with the radio.
+
+  >>> backoff = Backoff(.1, 1, jitter=0)
+  >>> [ backoff.delay(n) for n in xrange(5) ]
+  [0.1, 0.2, 0.4, 0.8, 1.0]
+  """
+  def __init__ (self, first, cap, factor=2, jitter=.5):
+    self.first = first
+    self.cap = cap
+    self.factor = factor
+    self.jitter = jitter
+
+  def delay (self, failures, rng=random):
+    delay = min(self.cap, self.first * self.factor ** failures)
+    return delay - delay * self.jitter * rng.random( )
+
+# per class; the old fixed waits are the caps, given at each call
+BACKOFF = {
+  BAD_CRC: Backoff(.010, .100),
+  NAK: Backoff(.050, 1),
+  ACK: Backoff(.050, 1),
+  ZERO_READ: Backoff(.010, .500),
+  INCOMPLETE: Backoff(.100, 1),
+}
+
+class Breaker (object):
+  """
+  Open after threshold failures in a row; while open, :py:`allow`
+  says no, until reset seconds have passed, then lets one attempt
+  through to see if things are better.
+
+  >>> now = [ 0 ]
+  >>> breaker = Breaker(threshold=2, reset=10, clock=lambda: now[0])
+  >>> breaker.failure( ); breaker.failure( )
+  >>> breaker.allow( )
+  False
+  >>> now[0] = 11
+  >>> breaker.allow( ), breaker.allow( )
+  (True, False)
+  >>> breaker.success( )
+  >>> breaker.allow( )
+  True
+  """
+  def __init__ (self, threshold=8, reset=30, clock=time.time):
+    self.threshold = threshold
+    self.reset = reset
+    self.clock = clock
+    self.failures = 0
+    self.opened = None
+
+  def allow (self):
+    if self.opened is None:
+      return True
+    if self.clock( ) - self.opened >= self.reset:
+      # half open: one try, then wait out reset again if it fails too
+      self.opened = self.clock( )
+      return True
+    return False
+
+  def success (self):
+    self.failures = 0
+    self.opened = None
+
+  def failure (self):
+    self.failures += 1
+    if self.failures >= self.threshold:
+      if self.opened is None:
+        OPENED.inc( )
+        log.warn("%s failures in a row, circuit open for %ss" % (self.failures, self.reset))
+      self.opened = self.clock( )
+
+class Latencies (object):
+  """
+  Exponentially weighted mean and mean deviation of the seconds each
+  opcode takes to answer.
+
+  >>> latencies = Latencies(alpha=.5, samples=2)
+  >>> latencies.observe(128, .2)
+  >>> latencies.expected(128) is None
+  True
+  >>> latencies.observe(128, .4)
+  >>> round(latencies.expected(128, deviations=0), 3)
+  0.3
+  """
+  def __init__ (self, alpha=.2, samples=3):
+    self.alpha = alpha
+    self.samples = samples
+    self.seen = { }
+
+  def observe (self, opcode, seconds):
+    count, mean, deviation = self.seen.get(opcode, (0, seconds, 0.0))
+    deviation += self.alpha * (abs(seconds - mean) - deviation)
+    mean += self.alpha * (seconds - mean)
+    self.seen[opcode] = (count + 1, mean, deviation)
+
+  def forget (self, opcode):
+    self.seen.pop(opcode, None)
+
+  def expected (self, opcode, deviations=4):
+    """
+    Seconds opcode usually answers within, or None until seen enough.
+    """
+    count, mean, deviation = self.seen.get(opcode, (0, 0, 0))
+    if count < self.samples:
+      return None
+    return mean + deviations * deviation
+
+class Policy (object):
+  """
+  Retry decisions for one stick and the session using it.
+  """
+  # how long an adaptive stick will poll for an answer
+  poll_window = 1
+  def __init__ (self, backoff=None, breaker=None, latencies=None,
+                sleep=metrics.sleep, rng=random):
+    self.backoff = dict(BACKOFF, **(backoff or { }))
+    self.breaker = breaker or Breaker( )
+    self.latencies = latencies or Latencies( )
+    self.sleep = sleep
+    self.rng = rng
+    self.streaks = { }
+
+  def check (self):
+    """
+    Raise :py:`CircuitOpen` instead of trying, while the breaker is.
+    """
+    if not self.breaker.allow( ):
+      raise CircuitOpen("%s failures in a row, waiting %ss before trying again"
+                        % (self.breaker.failures, self.breaker.reset))
+
+  def retrying (self, kind):
+    """
+    A failure of kind, about to be retried on the spot; it only counts
+    against the breaker if the retry fails too, see :py:`unrecovered`.
+    """
+    FAILURES.inc(kind=kind)
+    self.streaks[kind] = self.streaks.get(kind, 0) + 1
+
+  def unrecovered (self, kind):
+    log.info("%s not recovered by retrying" % kind)
+    self.breaker.failure( )
+
+  def cleared (self, kind):
+    """
+    A retry of kind worked.  Only the streak of that kind is over; the
+    breaker waits for a whole command to succeed.
+    """
+    self.streaks.pop(kind, None)
+
+  def failed (self, kind, opcode=None):
+    self.retrying(kind)
+    self.unrecovered(kind)
+    if opcode is not None:
+      # whatever was learned about it may be why
+      self.latencies.forget(opcode)
+
+  def succeeded (self, opcode=None, seconds=None):
+    self.streaks = { }
+    self.breaker.success( )
+    if opcode is not None and seconds is not None:
+      self.latencies.observe(opcode, seconds)
+
+  def pause (self, kind, worst=None):
+    """
+    Sleep before retrying after a failure of kind, no longer than
+    worst; returns the seconds slept.
+    """
+    delay = self.backoff[kind].delay(max(0, self.streaks.get(kind, 0) - 1), self.rng)
+    if worst is not None:
+      delay = min(delay, worst)
+    self.sleep(delay, 'retry_%s' % kind)
+    return delay
+
+  def effect (self, command, adaptive=False):
+    """
+    Seconds to wait for command to take effect before downloading the
+    answer.  A stick that polls for the answer only needs to start
+    polling within its window of when the answer usually comes.
+    """
+    if not adaptive:
+      return command.effectTime
+    expected = self.latencies.expected(command.code)
+    if expected is None:
+      return command.effectTime
+    return max(0, min(command.effectTime, expected - self.poll_window))
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
@@ -0,0 +1,97 @@
+"""
+rfsession - remember when each pump's radio was woken, and for how long.
+
+A PowerControl command keeps the pump listening for RF for some
+minutes, and costs many seconds to send.  :py:`RFSessions` keeps, per
+pump serial, when the last one was sent and for how many minutes, in a
+JSON file shared between runs, so a tool started again within that
+window can talk to the pump straight away.
+
+The window is trusted a little less than it claims, by margin seconds,
+since the pump started counting before we wrote it down.  If the pump
+doesn't answer anyway, :py:`RFSessions.forget` it and wake the pump
+again.
+
+>>> import os, tempfile
+>>> fd, path = tempfile.mkstemp( )
+>>> os.close(fd)
+>>> sessions = RFSessions(path)
+>>> sessions.record('208850', 10, now=1000)
+>>> RFSessions(path).remaining('208850', now=1300)
+270
+>>> sessions.is_open('208850', now=1000 + 10 * 60)
+False
+>>> sessions.forget('208850')
+>>> sessions.is_open('208850', now=1000)
+False
+>>> os.remove(path)
+
+"""
+
+import os
+import json
+import time
+import logging
+
+log = logging.getLogger( ).getChild(__name__)
+
+PATH = os.path.join('~', '.decocare', 'rf-sessions.json')
+
+class RFSessions (object):
+  """
+  RF session windows by pump serial, persisted at path, by default
+  $DECOCARE_RF_SESSIONS or ~/.decocare/rf-sessions.json.
+  """
+  def __init__ (self, path=None, margin=30):
+    self.path = os.path.expanduser(path or os.environ.get('DECOCARE_RF_SESSIONS', PATH))
+    self.margin = margin
+
+  def load (self):
+    try:
+      with open(self.path) as f:
+        return json.load(f)
+    except (IOError, ValueError), e:
+      log.info("no rf sessions in %s: %s" % (self.path, e))
+      return { }
+
+  def save (self, sessions):
+    directory = os.path.dirname(self.path)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    partial = self.path + '.tmp'
+    with open(partial, 'w') as f:
+      json.dump(sessions, f)
+    os.rename(partial, self.path)
+
+  def record (self, serial, minutes, now=None):
+    """
+    A PowerControl for minutes was just sent to serial.
+    """
+    sessions = self.load( )
+    sessions[serial] = dict(began=now or time.time( ), minutes=minutes)
+    self.save(sessions)
+
+  def forget (self, serial):
+    sessions = self.load( )
+    if sessions.pop(serial, None) is not None:
+      self.save(sessions)
+
+  def remaining (self, serial, now=None):
+    """
+    Seconds left in serial's RF session, or 0.
+    """
+    session = self.load( ).get(serial, None)
+    if not session:
+      return 0
+    ends = session['began'] + session['minutes'] * 60 - self.margin
+    return max(0, int(ends - (now or time.time( ))))
+
+  def is_open (self, serial, now=None):
+    return self.remaining(serial, now=now) > 0
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
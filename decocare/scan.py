@@ -11,9 +11,15 @@ class ID:
     candidate = ''.join([prefix, usb_id, postfix])
     return candidate
 
-def scan (prefix='/dev/serial/by-id/*-', template=ID.template):
+def scan_all (prefix='/dev/serial/by-id/*-', template=ID.template):
+  """
+  Every carelink stick plugged in, in a stable order.
+  """
   candidate = template(prefix)
-  results = glob.glob(candidate)
+  return sorted(glob.glob(candidate))
+
+def scan (prefix='/dev/serial/by-id/*-', template=ID.template):
+  results = scan_all(prefix, template)
   return (results[0:1] or ['']).pop( )
 
 if __name__ == '__main__':
@@ -5,13 +5,24 @@ log = logging.getLogger( ).getChild(__name__)
 import commands
 import lib
 import models
-from errors import StickError, AckError, BadDeviceCommError
+import metrics
+import retry
+from errors import StickError
+
+EXECUTE = metrics.REGISTRY.histogram('decocare_session_execute_seconds',
+                                     'Pump command round trips, by opcode')
+ATTEMPTS = metrics.REGISTRY.counter('decocare_session_attempts_total',
+                                    'Attempts at each pump command, by opcode')
+FAILURES = metrics.REGISTRY.counter('decocare_session_failures_total',
+                                    'Pump commands that ran out of retries, by opcode')
 
 
 class Session(object):
   def __init__(self, stick):
     self.stick = stick
     self.should_download = True
+    # shared with the stick, so both see every failure
+    self.policy = getattr(stick, 'policy', None) or retry.Policy( )
   def init(self, skip_power_control=False):
     stick = self.stick
     log.info('test fetching product info %s' % stick)
@@ -28,21 +39,41 @@ class Session(object):
 
   def execute(self, command):
     self.command = command
-    for i in xrange(max(1, self.command.retries)):
+    began = time.time( )
+    attempts = max(1, self.command.retries)
+    for i in xrange(attempts):
       log.info('execute attempt: %s' % (i + 1))
+      self.policy.check( )
+      ATTEMPTS.inc(opcode=command.code)
       try:
         self.expectedLength = self.command.bytesPerRecord * self.command.maxRecords
         self.transfer( )
+        sent = time.time( )
+        # only answers that are downloaded can be learned
+        learn = self.should_download and self.expectedLength > 0
         if self.should_download:
-          log.info('sleeping %s before download' % command.effectTime)
-          time.sleep(command.effectTime)
+          adaptive = learn and getattr(self.stick, 'adaptive', False)
+          effect = self.policy.effect(command, adaptive=adaptive)
+          log.info('sleeping %s before download' % effect)
+          metrics.sleep(effect, 'effect')
           self.download( )
         log.info('finished executing:%s' % command)
         if command.done( ):
+          EXECUTE.observe(time.time( ) - began, opcode=command.code)
+          answered = time.time( ) - sent if learn else None
+          self.policy.succeeded(command.code, answered)
           return command
-      except BadDeviceCommError, e:
+        kind = retry.INCOMPLETE
+      except StickError, e:
+        kind = retry.classify(e)
+        if kind is None:
+          raise
         log.critical("ERROR: %s" % e)
         # self.clearBuffers( )
+      self.policy.failed(kind, command.code)
+      if i + 1 < attempts:
+        self.policy.pause(kind)
+    FAILURES.inc(opcode=command.code)
     log.critical('this seems like a problem')
 
   def download(self):
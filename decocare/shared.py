@@ -0,0 +1,236 @@
+"""
+shared - one stick, any number of threads, short reads first.
+
+:py:`stick.Stick` and :py:`session.Pump` keep the state of the
+exchange in progress on themselves, so only one thread may use them at
+a time.  A :py:`SharedStick` gives a pump session a thread of its own,
+and a priority queue of work for it: commands are submitted from any
+thread, and each gets a :py:`Future` of its response.
+
+Commands run in priority order, then in the order they came.  Short
+status reads are :py:`URGENT`, history pages :py:`BULK`, everything
+else :py:`NORMAL`; a history download asks for one page at a time, so
+a status read submitted meanwhile goes ahead of its next page.
+
+:py:`SharedStick.session` gives a stand in for a :py:`session.Pump`,
+whose model sends its commands through the queue:
+
+>>> from decocare import simulator
+>>> shared = SharedStick(simulator.open_pump(simulator.SimulatedPump( )))
+>>> pump = shared.session( )
+>>> pump.model.read_battery_status( )['status']
+'normal'
+>>> future = shared.submit(commands.ReadPumpModel(serial=pump.serial))
+>>> future.result( ).getData( )
+'522'
+>>> shared.close( )
+
+"""
+
+import sys
+import Queue
+import logging
+import itertools
+import threading
+
+import models
+import commands
+from errors import StickError
+
+log = logging.getLogger( ).getChild(__name__)
+
+URGENT = 0
+NORMAL = 10
+BULK = 20
+# after everything else, so close lets queued work finish
+STOP = sys.maxint
+
+# the first class a command is an instance of decides its priority
+PRIORITIES = [
+  (commands.ReadPumpStatus, URGENT),
+  (commands.ReadBasalTemp, URGENT),
+  (commands.ReadBasalTemp508, URGENT),
+  (commands.ReadBatteryStatus, URGENT),
+  (commands.ReadRemainingInsulin, URGENT),
+  (commands.ReadHistoryData, BULK),
+]
+
+def priority_of (command):
+  """
+  >>> priority_of(commands.ReadPumpStatus( )) < priority_of(commands.ReadRTC( ))
+  True
+  >>> priority_of(commands.ReadGlucoseHistory(page=0)) == BULK
+  True
+  """
+  for klass, priority in PRIORITIES:
+    if isinstance(command, klass):
+      return priority
+  return NORMAL
+
+class Cancelled (Exception):
+  """
+  The work was cancelled before it ran.
+  """
+
+class Timeout (Exception):
+  """
+  The work didn't finish in time.
+  """
+
+class Future (object):
+  """
+  The result of work queued on a :py:`SharedStick`, once it has run.
+  """
+  PENDING, RUNNING, FINISHED = 'pending', 'running', 'finished'
+  def __init__ (self):
+    self.lock = threading.Lock( )
+    self.finished = threading.Event( )
+    self.state = self.PENDING
+    self.value = None
+    self.error = None
+
+  def start (self):
+    """
+    Called as the work begins; False if it was cancelled instead.
+    """
+    with self.lock:
+      if self.state != self.PENDING:
+        return False
+      self.state = self.RUNNING
+      return True
+
+  def cancel (self):
+    """
+    Don't run the work, if it hasn't begun.
+    """
+    with self.lock:
+      if self.state != self.PENDING:
+        return False
+      self.state = self.FINISHED
+    self.error = (Cancelled, Cancelled( ), None)
+    self.finished.set( )
+    return True
+
+  def set_result (self, value):
+    self.value = value
+    self.state = self.FINISHED
+    self.finished.set( )
+
+  def set_exception (self, exc_info):
+    self.error = exc_info
+    self.state = self.FINISHED
+    self.finished.set( )
+
+  def done (self):
+    return self.finished.is_set( )
+
+  def exception (self, timeout=None):
+    if not self.finished.wait(timeout):
+      raise Timeout("not done after %s seconds" % timeout)
+    return self.error and self.error[1]
+
+  def result (self, timeout=None):
+    """
+    Wait for the work, and return its result or raise its exception.
+    """
+    if self.exception(timeout) is not None:
+      raise self.error[0], self.error[1], self.error[2]
+    return self.value
+
+class SharedStick (object):
+  """
+  Run work for any number of threads on pump, a :py:`session.Pump`
+  whose model has been read, from one thread that owns it.
+  """
+  def __init__ (self, pump):
+    self.pump = pump
+    self.queue = Queue.PriorityQueue( )
+    self.order = itertools.count( )
+    self.lock = threading.Lock( )
+    self.closed = False
+    self.worker = threading.Thread(target=self.work, name='shared-%s' % pump.serial)
+    self.worker.daemon = True
+    self.worker.start( )
+
+  def work (self):
+    while True:
+      priority, order, func, args, future = self.queue.get( )
+      if func is None:
+        break
+      if not future.start( ):
+        continue
+      try:
+        future.set_result(func(*args))
+      except Exception:
+        log.info("queued %s failed: %s" % (getattr(func, '__name__', func), sys.exc_info( )[1]))
+        future.set_exception(sys.exc_info( ))
+
+  def call (self, func, *args, **kwds):
+    """
+    Queue func(*args) to run on the pump's thread, at priority,
+    NORMAL by default, and return its :py:`Future`.
+    """
+    priority = kwds.pop('priority', NORMAL)
+    future = Future( )
+    with self.lock:
+      if self.closed:
+        raise StickError("shared stick for %s is closed" % self.pump.serial)
+      self.queue.put((priority, next(self.order), func, args, future))
+    return future
+
+  def execute (self, command):
+    self.pump.execute(command)
+    return command
+
+  def submit (self, command, priority=None):
+    """
+    Queue a :py:`commands.PumpCommand`, by default at the priority
+    :py:`priority_of` gives it.  The future's result is the command,
+    with its response.
+    """
+    if priority is None:
+      priority = priority_of(command)
+    return self.call(self.execute, command, priority=priority)
+
+  def session (self, priority=None):
+    return SharedPump(self, priority=priority)
+
+  def close (self):
+    """
+    Run what is queued, then stop.
+    """
+    with self.lock:
+      if self.closed:
+        return
+      self.closed = True
+      self.queue.put((STOP, next(self.order), None, None, None))
+    self.worker.join( )
+
+class SharedPump (object):
+  """
+  Stands in for a :py:`session.Pump` in one thread, sending its
+  commands through a :py:`SharedStick`, at priority if given.
+  """
+  def __init__ (self, shared, priority=None):
+    self.shared = shared
+    self.priority = priority
+    self.serial = shared.pump.serial
+    self.modelNumber = shared.pump.modelNumber
+    self.model = models.lookup(self.modelNumber, self)
+
+  def query (self, Command, **kwds):
+    command = Command(serial=self.serial, **kwds)
+    return self.shared.submit(command, priority=self.priority).result( )
+
+  def read_model (self):
+    return self.query(commands.ReadPumpModel)
+
+  def power_control (self, minutes=None):
+    return self.shared.call(self.shared.pump.power_control, minutes).result( )
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
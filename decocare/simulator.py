@@ -0,0 +1,415 @@
+"""
+simulator - an in-process carelink stick and pump, for offline use.
+
+:py:`SimulatedLink` stands in for :py:`link.Link`, so that
+:py:`stick.Stick`, :py:`session.Pump` and :py:`models.PumpModel` run
+unmodified, exchanging real stick opcodes with a model of the stick's
+firmware instead of a serial port.  Behind the stick sits a
+:py:`SimulatedPump` which answers pump commands, including serving
+canned history and glucose pages.
+
+Radio timing is modeled with a latency before the first frame of a
+response arrives in the stick's radio buffer, and a time per frame
+after that.  A drop rate corrupts frames in flight, so that they fail
+the CRC check in ReadRadio, just like a noisy link.
+
+>>> link = SimulatedLink(SimulatedPump(serial='208850'))
+>>> from decocare import stick
+>>> uart = stick.Stick(link, adaptive=True)
+>>> uart.open( )
+True
+>>> uart.product_info( )['rf.freq']
+'916.5Mhz'
+
+"""
+
+import time
+import random
+import logging
+from datetime import date, datetime, timedelta
+
+import lib
+import link
+import stick
+import session
+import history
+import cgm
+from records import times
+
+log = logging.getLogger( ).getChild(__name__)
+
+FRAME_SIZE = 64
+
+def make_page (data, size=1024):
+  """
+  Pad data with nulls and append the CRC trailer, the way pages come
+  off the pump.
+
+  >>> page = make_page(bytearray([ 0x01 ]))
+  >>> len(page)
+  1024
+  >>> lib.BangInt(page[-2:]) == lib.CRC16CCITT.compute(page[:-2])
+  True
+  """
+  page = bytearray(data)
+  body = size - 2
+  page.extend(bytearray(body - len(page)))
+  page = page[:body]
+  crc = lib.CRC16CCITT.compute(page)
+  page.extend([ lib.HighByte(crc), lib.LowByte(crc) ])
+  return page
+
+def split_pages (data, size=1024):
+  """
+  Split a file full of concatenated pages into a list of pages.
+  """
+  data = bytearray(data)
+  return [ data[i:i+size] for i in xrange(0, len(data), size) ]
+
+def make_history_page (model=None, seed=None, start=None, step=5, opcodes=None):
+  """
+  Build a history page full of records picked at random from opcodes,
+  by default all the known record types for model, each with random
+  head and body bytes and a good date, step minutes after the one
+  before, from start.  Records that don't decode are left out, so the
+  whole page decodes cleanly.
+
+  >>> page = make_history_page(seed=1, start=datetime(2015, 6, 1))
+  >>> len(page)
+  1024
+  >>> records = history.HistoryPage(page, None).decode( )
+  >>> len(records) > 10
+  True
+  """
+  rand = random.Random(seed)
+  clock = start or datetime(2015, 1, 1)
+  opcodes = opcodes or sorted(history._known.keys( ))
+  body = bytearray( )
+  while True:
+    head = bytearray([ rand.choice(opcodes), rand.randint(0, 255) ])
+    try:
+      record = history.suggest(head, model=model)
+    except AttributeError:
+      continue
+    length = history.record_length(record)
+    if len(body) + length > 1020:
+      break
+    bolus = head + bytearray([ rand.randint(0, 255) for i in xrange(length - 2) ])
+    offset = record.head_length
+    if record.date_length == 5:
+      bolus[offset:offset + 5] = times.encode_date(clock)
+    elif record.date_length == 2:
+      # daily totals carry just the day, see history.unmask_m_midnight
+      bolus[offset:offset + 2] = bytearray([ clock.day | (clock.month >> 1) << 5,
+                                             (clock.year - 2000) | (clock.month & 1) << 7 ])
+    try:
+      record.parse(bolus)
+      str(record)
+    except Exception:
+      continue
+    body.extend(bolus)
+    clock = clock + timedelta(minutes=step)
+  return make_page(body)
+
+class SimulatedPump (object):
+  """
+  Model of a pump, answering the commands found in commands.py.
+
+  Responses are plain bytearrays, the same payload
+  PumpCommand.respond/getData expect to see.  Subclass, or pass
+  responses, a dict of opcode to bytearray or callable(params), to
+  teach it new tricks.
+  """
+  model = '522'
+  def __init__ (self, serial='208850', model=None, history=None,
+                glucose=None, clock=None, responses=None):
+    self.serial = serial
+    if model is not None:
+      self.model = model
+    self.history = [ bytearray(page) for page in (history or [ make_page([ ]) ]) ]
+    self.glucose = dict( )
+    for number, page in (glucose or { }).items( ):
+      self.glucose[int(number)] = bytearray(page)
+    self.clock = clock
+    self.responses = dict(responses or { })
+    self.received = [ ]
+    self.handlers = {
+      93: self.power_control,
+      112: self.read_rtc,
+      114: self.read_battery_status,
+      128: self.read_history_data,
+      141: self.read_pump_model,
+      154: self.read_glucose_history,
+      157: self.read_cur_page_number,
+      168: self.filter_glucose_history,
+      205: self.read_cur_glucose_page_number,
+      206: self.read_pump_status,
+    }
+
+  def respond (self, code, params):
+    """
+    Produce the payload for a command.
+    """
+    self.received.append((code, list(params)))
+    canned = self.responses.get(code, None)
+    if canned is not None:
+      if callable(canned):
+        return bytearray(canned(params))
+      return bytearray(canned)
+    handler = self.handlers.get(code, None)
+    if handler is not None:
+      return handler(params)
+    return bytearray(FRAME_SIZE)
+
+  def power_control (self, params):
+    return bytearray(FRAME_SIZE)
+
+  def read_pump_model (self, params):
+    return bytearray([ len(self.model) ]) + bytearray(self.model)
+
+  def read_pump_status (self, params):
+    return bytearray([ 0x03, 0x00, 0x00 ])
+
+  def read_battery_status (self, params):
+    return bytearray([ 0x00, 0x00, 0x8c ])
+
+  def read_rtc (self, params):
+    clock = self.clock or datetime.now( )
+    return bytearray([ clock.hour, clock.minute, clock.second,
+                       lib.HighByte(clock.year), lib.LowByte(clock.year),
+                       clock.month, clock.day ])
+
+  def read_cur_page_number (self, params):
+    pages = len(self.history)
+    return bytearray([ pages >> 24 & 0xFF, pages >> 16 & 0xFF,
+                       pages >> 8 & 0xFF, pages & 0xFF ])
+
+  def read_history_data (self, params):
+    page = params and params[0] or 0
+    if page < len(self.history):
+      return self.history[page]
+    return make_page([ ])
+
+  def read_cur_glucose_page_number (self, params):
+    numbers = sorted(self.glucose.keys( )) or [ 0 ]
+    last = numbers[-1]
+    return bytearray([ last >> 24 & 0xFF, last >> 16 & 0xFF,
+                       last >> 8 & 0xFF, last & 0xFF,
+                       0x00, len(self.glucose), 0x00, len(self.glucose) ])
+
+  def filter_glucose_history (self, params):
+    """
+    The first and last glucose pages holding records dated between
+    the begin and end days in params, or the newest page if none do.
+    """
+    begin = date(lib.BangInt(params[0:2]), params[2], params[3]).isoformat( )
+    end = date(lib.BangInt(params[4:6]), params[6], params[7]).isoformat( )
+    found = [ ]
+    for number in sorted(self.glucose):
+      records = cgm.PagedData.Data(self.glucose[number]).decode( )
+      days = [ record['date'][:10] for record in records if record.get('date') ]
+      if [ day for day in days if begin <= day <= end ]:
+        found.append(number)
+    if not found:
+      found = sorted(self.glucose)[-1:] or [ 0 ]
+    first, last = found[0], found[-1]
+    return bytearray([ lib.HighByte(first), lib.LowByte(first),
+                       lib.HighByte(last), lib.LowByte(last) ])
+
+  def read_glucose_history (self, params):
+    number = 0
+    for param in params:
+      number = number << 8 | param
+    return self.glucose.get(number, make_page([ ]))
+
+
+class SimulatedSerial (object):
+  """
+  Model of the carelink stick's firmware, behind a serial port api.
+
+  Every write is a stick opcode.  The reply is queued up, ready for
+  the next read, just like the real stick.
+  """
+  product = dict(serial=bytearray([ 0x00, 0x00, 0x01 ]),
+                 version=bytearray([ 1, 1 ]),
+                 rf=0x00,
+                 description='CareLink  ',
+                 software=bytearray([ 1, 0 ]))
+  def __init__ (self, pump=None, latency=.050, frame_time=.010,
+                drop_rate=0.0, signal=100, seed=None):
+    self.pump = pump or SimulatedPump( )
+    self.latency = latency
+    self.frame_time = frame_time
+    self.drop_rate = drop_rate
+    self.signal = signal
+    self.random = random.Random(seed)
+    self.output = bytearray( )
+    self.frames = [ ]
+    self.stats = dict(usb=[ 0 ] * 6, radio=[ 0 ] * 6)
+    self.opened = True
+    self.baudrate = 9600
+
+  def isOpen (self):
+    return self.opened
+
+  def close (self):
+    self.opened = False
+
+  def write (self, string):
+    msg = bytearray(string)
+    self.stats['usb'][5] += 1
+    op = msg[0]
+    handler = {
+      0x01: self.transmit_packet,
+      0x03: self.link_status,
+      0x04: self.product_info,
+      0x05: self.interface_stats,
+      0x06: self.signal_strength,
+      0x0C: self.read_radio,
+    }.get(op, self.unknown)
+    self.output = handler(msg)
+    return len(msg)
+
+  def read (self, c):
+    r, self.output = self.output[:c], self.output[c:]
+    if r:
+      self.stats['usb'][4] += 1
+    return str(r)
+
+  def readline (self):
+    return self.read(len(self.output))
+
+  def inWaiting (self):
+    return len(self.output)
+
+  def readlines (self):
+    return [ self.readline( ) ]
+
+  def ack (self, data=None):
+    return bytearray([ 0x01, 0x55, 0x00 ]) + bytearray(data or [ ])
+
+  def unknown (self, msg):
+    return bytearray([ 0x01, 0x66, 0x00 ])
+
+  def product_info (self, msg):
+    info = self.product
+    interfaces = bytearray([ 2, 0x00, 0x03, 0x01, 0x01 ])
+    data = (info['serial'] + info['version'] + bytearray([ info['rf'] ]) +
+            bytearray(info['description'][:10].ljust(10)) +
+            info['software'] + interfaces)
+    return self.ack(data)
+
+  def interface_stats (self, msg):
+    counters = self.stats['usb' if msg[1:2] == bytearray([ 1 ]) else 'radio']
+    data = bytearray(counters[0:4])
+    for counter in counters[4:6]:
+      data.extend([ counter >> 24 & 0xFF, counter >> 16 & 0xFF,
+                    counter >> 8 & 0xFF, counter & 0xFF ])
+    return self.ack(data)
+
+  def signal_strength (self, msg):
+    return self.ack([ self.signal ])
+
+  def arrived (self, now=None):
+    now = now or time.time( )
+    return [ frame for frame in self.frames if frame[0] <= now ]
+
+  def link_status (self, msg):
+    status = 0x00
+    size = 0
+    ready = self.arrived( )
+    if ready:
+      status = 0x01
+      size = len(ready[0][1])
+    elif self.frames:
+      status = 0x02
+    return self.ack([ 0x00, 0x00, status, lib.HighByte(size), lib.LowByte(size) ])
+
+  def read_radio (self, msg):
+    ready = self.arrived( )
+    if not ready:
+      return bytearray( )
+    frame = self.frames.pop(0)
+    self.stats['radio'][4] += 1
+    return frame[1]
+
+  def transmit_packet (self, msg):
+    serial = str(msg[4:7]).encode('hex')
+    count = ((msg[7] & 0x7F) << 8) | msg[8]
+    pages = msg[11]
+    code = msg[13]
+    params = list(msg[15:15+count])
+    self.stats['radio'][5] += 1
+    self.frames = [ ]
+    if serial == self.pump.serial and (pages > 0 or code == 93):
+      self.schedule(self.pump.respond(code, params))
+    return self.ack(bytearray(FRAME_SIZE - 3))
+
+  def schedule (self, payload):
+    """
+    Chop a response into radio frames, due to arrive over time.
+    """
+    payload = bytearray(payload)
+    if len(payload) < FRAME_SIZE:
+      payload.extend(bytearray(FRAME_SIZE - len(payload)))
+    chunks = [ payload[i:i+FRAME_SIZE] for i in xrange(0, len(payload), FRAME_SIZE) ]
+    start = time.time( ) + self.latency
+    for i, chunk in enumerate(chunks):
+      eod = i == len(chunks) - 1
+      arrival = start + i * self.frame_time
+      self.frames.append((arrival, self.format_frame(chunk, eod)))
+
+  def format_frame (self, data, eod=False):
+    """
+    Frame data the way ReadRadio expects: a 13 byte header holding
+    the length and end of data flag, the data, then a CRC8.
+    """
+    length = len(data)
+    head = bytearray(13)
+    head[0] = 0x02
+    head[5] = (lib.HighByte(length) & 0x7F) | (0x80 if eod else 0x00)
+    head[6] = lib.LowByte(length)
+    crc = lib.CRC8.compute(data)
+    if self.drop_rate and self.random.random( ) < self.drop_rate:
+      self.stats['radio'][0] += 1
+      crc = crc ^ 0xFF
+    return head + data + bytearray([ crc ])
+
+
+class SimulatedLink (link.Link):
+  """
+  A Link with a SimulatedSerial instead of a serial port.
+  """
+  def __init__ (self, pump=None, timeout=None, **kwds):
+    if timeout is not None:
+      self.__timeout__ = timeout
+    self.port = 'simulated'
+    self.serial = SimulatedSerial(pump, **kwds)
+
+  def open (self, newPort=False, **kwds):
+    self.serial.opened = True
+
+def open_pump (pump=None, adaptive=True, latency=0, frame_time=0, **kwds):
+  """
+  Put a real Stick and session.Pump in front of a SimulatedPump, and
+  read the model, ready to use.  Radio timing defaults to instant.
+
+  >>> session = open_pump(SimulatedPump(model='523'))
+  >>> session.model.larger
+  True
+  """
+  pump = pump or SimulatedPump( )
+  link = SimulatedLink(pump, latency=latency, frame_time=frame_time, **kwds)
+  uart = stick.Stick(link, adaptive=adaptive)
+  uart.open( )
+  device = session.Pump(uart, pump.serial)
+  device.read_model( )
+  return device
+
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
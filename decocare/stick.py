@@ -2,6 +2,8 @@
 import lib
 import logging
 import time
+import metrics
+import retry
 
 """
 stick - implement a naive open source driver for Medtronic's
@@ -22,11 +24,25 @@ format can be read.
 
 log = logging.getLogger( ).getChild(__name__)
 
-from errors import StickError, AckError, BadDeviceCommError
+from errors import StickError, AckError, BadDeviceCommError, BadCRC
 
-class BadCRC(StickError): pass
 class UnresponsiveError (StickError): pass
 
+ROUND_TRIP = metrics.REGISTRY.histogram('decocare_stick_round_trip_seconds',
+                                        'Stick command round trips, by command')
+FRAME_BYTES = metrics.REGISTRY.histogram('decocare_stick_frame_bytes',
+                                         'Bytes in each downloaded radio frame',
+                                         buckets=(0, 1, 16, 32, 48, 63, 64))
+POLLS = metrics.REGISTRY.histogram('decocare_stick_poll_iterations',
+                                   'LinkStatus polls before the radio had data',
+                                   buckets=(1, 2, 3, 5, 10, 20, 50))
+ZERO_READS = metrics.REGISTRY.counter('decocare_stick_zero_reads_total',
+                                      'Reads from the stick that came back empty, by where')
+BAD_CRCS = metrics.REGISTRY.counter('decocare_stick_bad_crc_total',
+                                    'Radio frames failing their CRC8')
+NAKS = metrics.REGISTRY.counter('decocare_stick_naks_total',
+                                'Stick commands answered without an ACK, by command')
+
 def CRC8(data):
   return lib.CRC8.compute(data)
 
@@ -76,6 +92,7 @@ class StickCommand(object):
     # status == 102 'f' NAK, look up NAK
     if status == 85: # 'U'
       return raw[:3], raw[3:]
+    NAKS.inc(command=self.__class__.__name__)
     assert False, ("NAK!!\n%s" % lib.hexdump(raw[:3]))
     
 
@@ -224,6 +241,12 @@ class LinkStatus(StickCommand):
     log.info(msg)
     self.reasons = reasons
 
+  def receiving(self):
+    """
+    Is the radio still busy receiving a frame into its buffer?
+    """
+    return (getattr(self, 'status', 0) & 0x2) > 0
+
   def parse(self, result):
     """
       #>>>
@@ -276,6 +299,7 @@ class ReadRadio(StickCommand):
     log.info('readData; raw[retries] %s' % int(raw[3]))
     dl_status = int(raw[0])
     if dl_status != 0x02: # this differs from the others?
+      NAKS.inc(command=self.__class__.__name__)
       raise BadDeviceCommError("bad dl raw! %r" % raw)
       assert (int(raw[0]) == 2), repr(raw)
     return raw[:1], raw
@@ -324,8 +348,9 @@ class ReadRadio(StickCommand):
                           'head:\n%s\n' % (lib.hexdump(head)),
                           'data:\n%s\n' % (lib.hexdump(data)) ] )
       log.info(msg)
-      log.info("XXX:IGNORE:BadCRC:returning empty message, sleep .100, avoid errors.")
-      time.sleep(.100)
+      log.info("XXX:IGNORE:BadCRC:returning empty message, avoid errors.")
+      BAD_CRCS.inc( )
+      self.bad_crc = True
       return bytearray( )
       raise BadCRC(msg)
     assert crc == expected_crc
@@ -417,6 +442,54 @@ class TransmitPacket(StickCommand):
     #self.checkAck(results)
 
 
+class PollSchedule(object):
+  """
+  Adaptive delays between LinkStatus polls.
+
+  While the radio reports that it is receiving, we poll again right away.
+  Only when the radio buffer is empty and idle do we back off,
+  starting small and growing until we reach the same ceiling the
+  fixed poll loop uses.
+
+  >>> schedule = PollSchedule( )
+  >>> schedule.next( )
+  0.005
+  >>> schedule.next( )
+  0.01
+  >>> schedule.next(busy=True)
+  0
+  >>> schedule.next( )
+  0.005
+  >>> [ schedule.next( ) for x in xrange(6) ][-1]
+  0.1
+
+  """
+  initial = .005
+  factor  = 2
+  maximum = .100
+  def __init__(self, initial=None, maximum=None, factor=None):
+    if initial is not None:
+      self.initial = initial
+    if maximum is not None:
+      self.maximum = maximum
+    if factor is not None:
+      self.factor = factor
+    self.reset( )
+
+  def reset(self):
+    self.delay = 0
+
+  def next(self, busy=False):
+    if busy:
+      self.reset( )
+      return self.delay
+    if self.delay == 0:
+      self.delay = self.initial
+    else:
+      self.delay = min(self.maximum, self.delay * self.factor)
+    return self.delay
+
+
 
 class Stick(object):
   """
@@ -446,12 +519,21 @@ class Stick(object):
   The Stick object provides a bunch of useful methods, that given a link,
   will represent the state of one active usb stick.
 
+  Passing adaptive=True replaces the fixed sleeps between polls in
+  download with an adaptive schedule, see adaptive_download.
+
   """
   link = None
-  def __init__(self, link):
+  adaptive = False
+  def __init__(self, link, adaptive=None, policy=None):
     self.link = link
     self.command = None
     self._download_i = False
+    if adaptive is not None:
+      self.adaptive = adaptive
+    self.policy = policy or retry.Policy( )
+    self.schedule = PollSchedule( )
+    self.latencies = [ ]
 
   def __str__(self):
     s = [ self.__class__.__name__,
@@ -487,14 +569,18 @@ class Stick(object):
     raw = bytearray(self.link.read(size))
 
     """
+    began = time.time( )
     raw = self.send_force_read( )
     if not raw or len(raw) == 0:
-      log.info('process zero length READ, try once more sleep .010')
-      time.sleep(.010)
+      ZERO_READS.inc(where='process')
+      log.info('process zero length READ, try once more')
+      self.backoff(retry.ZERO_READ, .010)
       raw = bytearray(self.link.read(self.command.size))
+      self.recovered(raw, retry.ZERO_READ)
 
     ack, response = self.command.respond(raw)
     info = self.command.parse(response)
+    ROUND_TRIP.observe(time.time( ) - began, command=self.command.__class__.__name__)
     log.info('finished processing {0}, {1}'.format(self.command, repr(info)))
     msg = ':'.join(['PROCESS', 'END'
            ] + map(str, [ self.timer.millis( ), self.command]))
@@ -557,13 +643,39 @@ class Stick(object):
       self._poll_size = size
       if size == 0:
         log.debug('poll zero, sleeping in POLL, .100')
-        time.sleep(.100)
+        metrics.sleep(.100, 'poll')
       i += 1
     log.info('%s:STOP POLL after %s attempts:size:%s' % (self, i, size))
+    POLLS.observe(i)
     self._poll_size = size
     self._poll_i = False
     return size
-    
+
+  def adaptive_poll_size(self, timeout=1):
+    """
+      like poll_size, but instead of sleeping .100 after every empty
+      poll, ask the schedule how long to wait.  While the radio is
+      receiving we poll again immediately.
+    """
+    size  = 0
+    start = time.time()
+    i     = 0
+    self.schedule.reset( )
+    while size == 0 and time.time() - start < timeout:
+      self._poll_i = i
+      size  = self.read_status( )
+      self._poll_size = size
+      if size == 0:
+        delay = self.schedule.next(busy=self.last_status.receiving( ))
+        if delay:
+          metrics.sleep(delay, 'poll')
+      i += 1
+    log.info('%s:STOP ADAPTIVE POLL after %s attempts:size:%s' % (self, i, size))
+    POLLS.observe(i)
+    self._poll_size = size
+    self._poll_i = False
+    return size
+
   def read_status(self):
     """
     Get current link status.
@@ -573,6 +685,25 @@ class Stick(object):
     self.last_status = self.command
     return result
 
+  def backoff(self, kind, worst):
+    """
+    Count a failure of kind, and pause before trying again, no longer
+    than worst, the fixed wait this used to be.
+    """
+    self.policy.retrying(kind)
+    self.policy.pause(kind, worst=worst)
+
+  def recovered(self, raw, kind):
+    """
+    Only a retry read that comes back empty too counts against the
+    breaker; one that works ends the streak of kind.
+    """
+    if raw:
+      self.policy.cleared(kind)
+    else:
+      self.policy.unrecovered(kind)
+    return bool(raw)
+
   def old_download_packet(self, size):
     """
     Naive version of downloading a packet.
@@ -605,12 +736,14 @@ class Stick(object):
       log.info('link %s sending %s)' % ( self, reader ))
       self.link.write(reader.format( ))
       log.debug('sleeping %s' % reader.delay)
-      time.sleep(reader.delay)
+      metrics.sleep(reader.delay, 'command')
       raw = bytearray(self.link.read(size))
       if len(raw) == 0:
-        log.info('zero length READ, try once more sleep .250')
-        time.sleep(.250)
+        ZERO_READS.inc(where='send_force_read')
+        log.info('zero length READ, try once more')
+        self.backoff(retry.ZERO_READ, .250)
         raw = bytearray(self.link.read(self.command.size))
+        self.recovered(raw, retry.ZERO_READ)
 
       if len(raw) != 0:
         log.info(' '.join(['quit send_force_read,',
@@ -640,6 +773,7 @@ class Stick(object):
       log.info('Download Size is ZERO, returning nothing')
       return bytearray( )
       
+    began = time.time( )
     raw = self.send_force_read( )
     # return
     # packet = self.process( )
@@ -658,13 +792,23 @@ class Stick(object):
 
     # if len(raw) == 0:
     if not raw:
-      log.info('zero length READ, try once more sleep .500')
-      time.sleep(.500)
+      ZERO_READS.inc(where='download_packet')
+      log.info('zero length READ, try once more')
+      self.backoff(retry.ZERO_READ, .500)
       raw = bytearray(self.link.read(self.command.size))
+      self.recovered(raw, retry.ZERO_READ)
 
     try:
       ack, response = self.command.respond(raw)
       info = self.command.parse(response)
+      ROUND_TRIP.observe(time.time( ) - began, command=reader.__class__.__name__)
+      FRAME_BYTES.observe(len(info))
+      if getattr(reader, 'bad_crc', False):
+        # the frame is lost, download will ask for the rest again
+        self.backoff(retry.BAD_CRC, .100)
+        self.policy.unrecovered(retry.BAD_CRC)
+      else:
+        self.policy.cleared(retry.BAD_CRC)
       msg = ':'.join(['PROCESS', 'END'
              ] + map(str, [ self.timer.millis( ), self.command]))
       log.info(msg)
@@ -677,12 +821,13 @@ class Stick(object):
       if original_size < 64:
         #size = self.read_status( )
         #size = self.poll_size( )
-        log.info('XXX:JUST a bit more READ new size: %s, sleep .100' % original_size)
+        log.info('XXX:JUST a bit more READ new size: %s' % original_size)
         self.link.write(status.format( ))
-        time.sleep(.100)
+        self.backoff(retry.INCOMPLETE, .100)
         raw = bytearray(self.link.read(64))
         ack, response = reader.respond(raw)
         info = reader.parse(response)
+        self.policy.cleared(retry.INCOMPLETE)
         return info
 
       ack, body = status.respond(raw)
@@ -692,9 +837,11 @@ class Stick(object):
 
       raw = bytearray(self.link.read(size))
       if len(raw) == 0:
-        log.info('NESTED zero length READ, try once more sleep .100')
-        time.sleep(.100)
+        ZERO_READS.inc(where='download_packet')
+        log.info('NESTED zero length READ, try once more')
+        self.backoff(retry.ZERO_READ, .100)
         raw = bytearray(self.link.read(self.command.size))
+        self.recovered(raw, retry.ZERO_READ)
 
         ack, body = status.respond(raw)
         info = self.command.parse(body)
@@ -709,6 +856,8 @@ class Stick(object):
     Theory is to download anything and everything available off the radio
     buffer, and to wait if necessary.
     """
+    if self.adaptive:
+      return self.adaptive_download(size)
     eod = False
     results = bytearray( )
     ailing = 0
@@ -726,13 +875,13 @@ class Stick(object):
       if size is None:
         log.info("%s:begin first poll first sleep .250" % (stats.format(self, i, 0,
                                           len(results), len(data))))
-        time.sleep(.250)
+        metrics.sleep(.250, 'download')
         size = self.poll_size( )
         log.info("%s:end first poll" % (stats.format(self, i, size,
                                         len(results), len(data))))
       if size == 0:
         if i % 3 == 0:
-          time.sleep(1.5)
+          metrics.sleep(1.5, 'download')
         #time.sleep(1.5)
         size = self.poll_size( )
       """
@@ -767,14 +916,14 @@ class Stick(object):
       else:
         log.info("%s:no data, try again sleep .400" % (stats.format(self, i, size,
                                             len(results), len(data))))
-        time.sleep(.400)
+        metrics.sleep(.400, 'download')
       # eod = expect_eod and size < 15
       eod = expect_eod
       # or size < 15
       if not eod:
         log.info("%s:no eod, sleep .200 try again" % (stats.format(self, i, size,
                                             len(results), len(data))))
-        time.sleep(.200)
+        metrics.sleep(.200, 'download')
         size = self.poll_size( )
 
     log.info("%s:DONE" % (stats.format(self, i, size,
@@ -783,6 +932,62 @@ class Stick(object):
     # self.reader = None
     return results
 
+  def adaptive_download(self, size=None, attempts=3):
+    """
+    Event driven version of download.
+
+    Rather than sleeping a fixed amount between every step, poll
+    LinkStatus with adaptive_poll_size and download each frame as
+    soon as the radio buffer reports it.  Give up after attempts
+    polls in a row come back empty.
+
+    Records a latency entry for every frame in self.latencies:
+    the poll and download time in milliseconds plus the frame size,
+    so we can see where the time goes.
+    """
+    eod = False
+    results = bytearray( )
+    ailing = 0
+    i = 0
+    stats = '{}:adaptive_download(attempts[{}],expect[{}],results[{}])'
+    self.latencies = [ ]
+    log.info('adaptive_download:start:%s' % i)
+    while not eod:
+      i += 1
+      self._download_i = i
+      begin = time.time( )
+      if not size:
+        size = self.adaptive_poll_size( )
+      polled = time.time( )
+      if size == 0:
+        ailing += 1
+        log.warn("%s:BAD AILING %s" % (stats.format(self, i, size,
+                                       len(results)), ailing))
+        if ailing >= attempts:
+          break
+        continue
+      ailing = 0
+      data = self.download_packet(size)
+      done = time.time( )
+      latency = dict(frame=len(self.latencies), size=size,
+                     bytes=len(data or [ ]),
+                     poll=(polled - begin) * 1000.0,
+                     download=(done - polled) * 1000.0,
+                     millis=(done - begin) * 1000.0)
+      self.latencies.append(latency)
+      log.info("%s:frame latency:%r" % (stats.format(self, i, size,
+                                        len(results)), latency))
+      if data:
+        results.extend(data)
+        eod = self.command.eod
+      size = None
+
+    total = sum([ l['millis'] for l in self.latencies ])
+    log.info("%s:DONE:%s frames in %.1fms" % (stats.format(self, i, size,
+             len(results)), len(self.latencies), total))
+    self._download_i = False
+    return results
+
   def clear_buffer(self):
     """
     An alternative download solution.  This can be helpful in
@@ -0,0 +1,152 @@
+"""
+supervisor - drive several sticks, each bound to one pump, in parallel.
+
+A :py:`Binding` pairs the port of a carelink stick with the serial of
+the pump it talks to.  The :py:`Supervisor` opens a stick and pump
+session for every binding on a worker thread of its own, runs the same
+job against each, and delivers an outcome per device to a shared,
+bounded sink.  A device failing only fails its own outcome, and workers
+wait for the sink to drain rather than piling up results nobody reads.
+
+>>> from decocare import simulator
+>>> pumps = { 'a': simulator.SimulatedPump(serial='208850'),
+...           'b': simulator.SimulatedPump(serial='665455', model='523') }
+>>> def open_link (port):
+...   return simulator.SimulatedLink(pumps[port], latency=0, frame_time=0)
+>>> supervisor = Supervisor(bind([ '208850', '665455' ], ports=[ 'a', 'b' ]),
+...                         open_link=open_link)
+>>> outcomes = supervisor.run(lambda pump: pump.modelNumber)
+>>> sorted([ (o['serial'], o['result'], o['error']) for o in outcomes ])
+[('208850', '522', None), ('665455', '523', None)]
+
+"""
+
+import Queue
+import logging
+import threading
+
+import link
+import scan
+import stick
+import session
+
+log = logging.getLogger( ).getChild(__name__)
+
+class Binding (object):
+  """
+  The stick at port talks to the pump with serial.
+
+  >>> Binding.parse('/dev/ttyUSB0=208850')
+  <Binding /dev/ttyUSB0=208850>
+  """
+  def __init__ (self, port, serial):
+    self.port = port
+    self.serial = serial
+
+  @classmethod
+  def parse (klass, text):
+    port, serial = text.rsplit('=', 1)
+    return klass(port, serial)
+
+  def __str__ (self):
+    return '%s=%s' % (self.port, self.serial)
+
+  def __repr__ (self):
+    return '<%s %s>' % (self.__class__.__name__, self)
+
+def bind (serials, ports=None, taken=( )):
+  """
+  Bind pump serials to sticks, in order; by default every stick scan
+  finds.  Sticks in taken, already bound to some other pump, and
+  sticks left over are not used.
+
+  >>> bind(['208850'], ports=['/dev/a', '/dev/b'], taken=[Binding('/dev/a', '665455')])
+  [<Binding /dev/b=208850>]
+  """
+  if ports is None:
+    ports = scan.scan_all( )
+  busy = set([ binding.port for binding in taken ])
+  ports = [ port for port in ports if port not in busy ]
+  if len(ports) < len(serials):
+    raise ValueError("%s pumps, but only %s sticks: %s" % (len(serials), len(ports), ports))
+  for port in ports[len(serials):]:
+    log.info("no pump for stick %s" % port)
+  return [ Binding(port, serial) for port, serial in zip(ports, serials) ]
+
+class Supervisor (object):
+  """
+  Run a job, a callable taking a :py:`session.Pump` whose model has
+  been read, against every binding concurrently.
+
+  Outcomes are dicts of port, serial, the job's result and error, a
+  description of whatever went wrong with that device, or None.
+  maxsize bounds how many outcomes may wait in the sink, by default
+  backlog, however many devices there are.  With init, each pump is
+  woken with a PowerControl for minutes before its model is read.
+  """
+  backlog = 2
+  def __init__ (self, bindings, open_link=None, adaptive=True, maxsize=None,
+                init=False, minutes=10):
+    self.bindings = list(bindings)
+    self.open_link = open_link or link.Link
+    self.adaptive = adaptive
+    self.init = init
+    self.minutes = minutes
+    self.sink = Queue.Queue(maxsize=maxsize or self.backlog)
+    self.workers = [ ]
+
+  def open (self, uart, binding):
+    uart.open( )
+    pump = session.Pump(uart, binding.serial)
+    if self.init:
+      pump.power_control(minutes=self.minutes)
+    pump.read_model( )
+    return pump
+
+  def work (self, binding, job):
+    outcome = dict(port=binding.port, serial=binding.serial, result=None, error=None)
+    device = None
+    try:
+      device = self.open_link(binding.port)
+      pump = self.open(stick.Stick(device, adaptive=self.adaptive), binding)
+      outcome['result'] = job(pump)
+    except Exception, e:
+      log.error("%s failed: %s" % (binding, e))
+      outcome['error'] = '%s: %s' % (e.__class__.__name__, e)
+    finally:
+      if device is not None:
+        try:
+          device.close( )
+        except Exception, e:
+          log.info("closing %s: %s" % (binding.port, e))
+    # waits while the sink is full
+    self.sink.put(outcome)
+
+  def start (self, job):
+    self.workers = [ ]
+    for binding in self.bindings:
+      worker = threading.Thread(target=self.work, args=(binding, job),
+                                name='supervisor-%s' % binding.serial)
+      worker.daemon = True
+      worker.start( )
+      self.workers.append(worker)
+
+  def results (self):
+    """
+    Yield outcomes as devices finish, until every worker has.
+    """
+    for worker in self.workers:
+      yield self.sink.get( )
+    for worker in self.workers:
+      worker.join( )
+
+  def run (self, job):
+    self.start(job)
+    return list(self.results( ))
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
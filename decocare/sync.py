@@ -0,0 +1,171 @@
+"""
+sync - incremental history download.
+
+Each HistorySync run reads history page 0 first, and only goes on to
+older pages until it meets history it has already returned, so a
+polling loop typically costs a single page over RF.  What has been
+seen is kept as a :py:`HighWaterMark`: the CRC of page 0 as last read,
+and the timestamp and digest of the newest record, persisted as JSON
+between runs.
+
+>>> from decocare import simulator
+>>> pages = [ simulator.make_history_page(seed=1, start=datetime(2015, 6, 1)) ]
+>>> pump = simulator.open_pump(simulator.SimulatedPump(history=pages))
+>>> sync = HistorySync(pump.model)
+>>> len(sync.sync( )) > 0
+True
+>>> sync.sync( )
+[]
+
+"""
+
+import json
+import hashlib
+import logging
+from datetime import datetime
+
+import lib
+import commands
+from history import HistoryPage
+
+log = logging.getLogger( ).getChild(__name__)
+
+def record_digest (record):
+  """
+  Identify a decoded history record by the bytes it was decoded from.
+  """
+  raw = ':'.join([ record['_head'], record['_date'], record['_body'] ])
+  return hashlib.sha1(raw).hexdigest( )
+
+def page_crc (page):
+  """
+  The CRC trailer a page arrived with.
+  """
+  return lib.BangInt(page[-2:])
+
+class HighWaterMark (object):
+  """
+  The newest history already synced.
+
+  >>> mark = HighWaterMark(crc=0x1234, timestamp='2015-06-01T00:05:00', digest='ab')
+  >>> mark.seen(dict(timestamp='2015-06-01T00:00:00'), 'cd')
+  True
+  >>> mark.seen(dict(timestamp='2015-06-01T00:05:00'), 'cd')
+  False
+  >>> mark.seen(dict(timestamp='2015-06-01T00:05:00'), 'ab')
+  True
+  >>> HighWaterMark.from_dict(mark.to_dict( )).to_dict( ) == mark.to_dict( )
+  True
+  """
+  def __init__ (self, crc=None, timestamp=None, digest=None):
+    self.crc = crc
+    self.timestamp = timestamp
+    self.digest = digest
+
+  def seen (self, record, digest):
+    """
+    Whether record is at or behind the mark.  Records sharing the
+    mark's timestamp are new, unless they are the mark itself.
+    """
+    if self.timestamp is None:
+      return False
+    if digest == self.digest:
+      return True
+    return record.get('timestamp') < self.timestamp
+
+  def to_dict (self):
+    return dict(crc=self.crc, timestamp=self.timestamp, digest=self.digest)
+
+  @classmethod
+  def from_dict (klass, data):
+    return klass(crc=data.get('crc'), timestamp=data.get('timestamp'),
+                 digest=data.get('digest'))
+
+  @classmethod
+  def load (klass, path):
+    try:
+      with open(path) as f:
+        return klass.from_dict(json.load(f))
+    except (IOError, ValueError), e:
+      log.info("no high water mark in %s: %s" % (path, e))
+      return klass( )
+
+  def save (self, path):
+    with open(path, 'w') as f:
+      json.dump(self.to_dict( ), f)
+
+class HistorySync (object):
+  """
+  Download only the pump history newer than the last run.
+
+  model is a :py:`models.PumpModel` with a session; path, if given,
+  is where the high water mark is persisted between runs.
+  """
+  def __init__ (self, model, path=None, max_pages=None):
+    self.model = model
+    self.path = path
+    self.max_pages = max_pages
+    self.mark = HighWaterMark( )
+    if path:
+      self.mark = HighWaterMark.load(path)
+    self.pages_read = 0
+
+  def download_page (self, number):
+    response = self.model.session.query(commands.ReadHistoryData, page=number)
+    self.pages_read += 1
+    return response.data
+
+  def count_pages (self):
+    pages = int(self.model.read_current_history_pages( ))
+    if self.max_pages:
+      pages = min(pages, self.max_pages)
+    return pages
+
+  def sync (self):
+    """
+    Return records newer than the high water mark, newest first, and
+    move the mark up to the newest of them.
+    """
+    self.pages_read = 0
+    page = self.download_page(0)
+    crc = page_crc(page)
+    if self.mark.timestamp is not None and crc == self.mark.crc:
+      log.info("history page 0 unchanged, crc %#06x" % crc)
+      return [ ]
+
+    found = [ ]
+    number = 0
+    pages = None
+    while True:
+      done = False
+      for record in HistoryPage(page, self.model).iter_decode( ):
+        digest = record_digest(record)
+        if self.mark.seen(record, digest):
+          done = True
+          break
+        found.append((record, digest))
+      if done:
+        break
+      number += 1
+      if pages is None:
+        pages = self.count_pages( )
+      if number >= pages:
+        break
+      page = self.download_page(number)
+
+    log.info("found %s new records in %s pages" % (len(found), self.pages_read))
+    if found:
+      newest, digest = found[0]
+      self.mark = HighWaterMark(crc=crc, timestamp=newest['timestamp'], digest=digest)
+    else:
+      self.mark.crc = crc
+    if self.path:
+      self.mark.save(self.path)
+    return [ record for record, digest in found ]
+
+if __name__ == '__main__':
+  import doctest
+  doctest.testmod( )
+
+#####
+# EOF
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # PYTHON_ARGCOMPLETE_OK
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
 import platform
 
 import decocare
@@ -19,9 +19,17 @@ setup(name='decocare',
     url="https://github.com/openaps/decocare",
     #namespace_packages = ['insulaudit'],
     packages=find_packages( ),
+    # optional: lib falls back to pure python CRC8 if this fails to build
+    ext_modules = [
+      Extension('decocare._crc', ['decocare/_crc.c'], optional=True),
+    ],
     install_requires = [
       'pyserial', 'python-dateutil', 'argcomplete'
     ],
+    extras_require = {
+      # decocare.cgm.vectorized
+      'vectorized': [ 'numpy' ],
+    },
     scripts = [
       'bin/mm-press-key.py',
       'bin/mm-send-comm.py',
@@ -31,6 +39,9 @@ setup(name='decocare',
       'bin/mm-latest.py',
       'bin/mm-bolus.py',
       'bin/mm-set-rtc.py',
+      'bin/mm-supervise.py',
+      'bin/mm-decode-archive.py',
+      'bin/mm-daemon.py',
       'bin/mm-pretty-csv',
     ],
     classifiers = [
@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import unittest
+from decocare import cgm
+from decocare.cgm import columns
+
+HERE = os.path.dirname(__file__)
+FIXTURE = os.path.join(HERE, '..', '..', 'page_10-18_glucose.data')
+
+class TestColumns(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp( )
+    self.path = os.path.join(self.tmp, 'glucose.columns')
+    with open(FIXTURE, 'rb') as f:
+      blob = f.read( )
+    self.pages = [ blob[i:i+1024] for i in xrange(0, len(blob), 1024) ]
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_round_trip_fixture(self):
+    records = [ ]
+    for page in self.pages:
+      records.extend(cgm.PagedData.Data(bytearray(page)).decode( ))
+    count = columns.export(self.pages, self.path)
+    self.assertEqual(count, len(records))
+    self.assertEqual(os.path.getsize(self.path), columns.HEADER.size + 12 * count)
+    stored = columns.Columns(self.path)
+    try:
+      self.assertEqual(list(stored), map(columns.row, records))
+      sgv = [ r['sgv'] for r in records if 'sgv' in r ]
+      flags = stored.flags( )
+      self.assertEqual([ v for v, f in zip(stored.sgv( ), flags) if f & columns.SGV ], sgv)
+      dated = [ t for t, f in zip(stored.time( ), flags) if f & columns.DATED ]
+      self.assertEqual(dated[0], columns.epoch('2014-03-21T06:37:00'))
+    finally:
+      stored.close( )
+
+  def test_rejects_other_files(self):
+    with open(self.path, 'wb') as f:
+      f.write('{"not": "columns"}')
+    self.assertRaises(ValueError, columns.Columns, self.path)
+
+if __name__ == '__main__':
+  unittest.main( )
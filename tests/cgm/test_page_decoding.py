@@ -0,0 +1,33 @@
+import os
+import gzip
+import json
+import unittest
+from decocare import cgm
+
+HERE = os.path.dirname(__file__)
+FIXTURE = os.path.join(HERE, '..', '..', 'page_10-18_glucose.data')
+# decoded by the decoder this one replaced, one page per line
+EXPECTED = os.path.join(HERE, 'page_10-18_glucose.json.gz')
+
+class TestPageDecoding(unittest.TestCase):
+
+  def test_matches_recorded_output(self):
+    with open(FIXTURE, 'rb') as f:
+      blob = f.read( )
+    expected = gzip.open(EXPECTED).read( ).splitlines( )
+    pages = [ blob[i:i+1024] for i in xrange(0, len(blob), 1024) ]
+    self.assertEqual(len(pages), len(expected))
+    for page, line in zip(pages, expected):
+      records = cgm.PagedData.Data(page).decode( )
+      self.assertEqual(json.loads(json.dumps(records)), json.loads(line))
+
+  def test_initial_timestamp_matches_decode(self):
+    with open(FIXTURE, 'rb') as f:
+      page = f.read(1024)
+    paged = cgm.PagedData.Data(page)
+    records = paged.decode( )
+    newest = [ r for r in records if r['name'] == 'GlucoseSensorData' ][-1]
+    self.assertEqual(paged.find_initial_timestamp( ).isoformat( ), newest['date'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,81 @@
+import os
+import base64
+import random
+import unittest
+from decocare import cgm, lib
+from decocare.cgm import vectorized
+
+HERE = os.path.dirname(__file__)
+FIXTURE = os.path.join(HERE, '..', '..', 'page_10-18_glucose.data')
+
+# pages from test_timestamping and test_event_decoding: pending
+# relative records, gaps, page ends and independent records
+PAGES = [ '34451028B6140801', '1008B61408344501', '1048B61408344501',
+          '1008B61408114501', '1028B61408', '1048B6140B', '0000020E0AB40B10',
+          '0E0AAE0B0A', '0F33444D0D', '8C120F13674F0F', 'A08F135B4F0E', '01' ]
+
+def make_into_page(body):
+  page = bytearray(body)
+  while len(page) < 1022:
+    page.append(0x00)
+  crc = lib.CRC16CCITT.compute(page)
+  page.extend([crc >> 8 & 0xFF, crc & 0xFF])
+  return page
+
+def scalar(page):
+  rows = [ ]
+  for record in cgm.PagedData.Data(bytearray(page)).decode( ):
+    op = record['op']
+    if isinstance(op, basestring):
+      op = int(op, 16)
+    rows.append((record.get('date', 'NaT'), record.get('sgv', 0), op))
+  return rows
+
+def vectors(time, sgv, opcode):
+  return zip(map(str, time), sgv.tolist( ), opcode.tolist( ))
+
+@unittest.skipIf(vectorized.numpy is None, "numpy is not installed")
+class TestVectorized(unittest.TestCase):
+
+  def setUp(self):
+    with open(FIXTURE, 'rb') as f:
+      blob = f.read( )
+    self.pages = [ blob[i:i+1024] for i in xrange(0, len(blob), 1024) ]
+
+  def test_fixture_matches_scalar_decode(self):
+    for page in self.pages:
+      self.assertEqual(vectors(*vectorized.decode(page)), scalar(page))
+
+  def test_decode_pages(self):
+    time, sgv, opcode = vectorized.decode_pages(self.pages)
+    expected = [ ]
+    for page in self.pages:
+      expected.extend(scalar(page))
+    self.assertEqual(vectors(time, sgv, opcode), expected)
+    self.assertEqual(str(time.dtype), 'datetime64[s]')
+
+  def test_timestamping_pages(self):
+    for body in PAGES:
+      page = make_into_page(base64.b16decode(body))
+      self.assertEqual(vectors(*vectorized.decode(page)), scalar(page), body)
+
+  def test_noise_matches_scalar_decode(self):
+    rand = random.Random(16)
+    common = [ 0x00, 0x01, 0x02, 0x06, 0x07, 0x08, 0x0b, 0x0e, 0x13, 0x50 ]
+    for i in xrange(300):
+      body = [ ]
+      for n in xrange(rand.randint(1, 60)):
+        if rand.random( ) < 0.7:
+          body.append(rand.choice(common))
+        else:
+          body.append(rand.randint(0, 255))
+      page = make_into_page(body)
+      try:
+        expected = scalar(page)
+      except IndexError:
+        # a truncated packet at the end of the page
+        continue
+      self.assertEqual(vectors(*vectorized.decode(page)), expected)
+
+if __name__ == '__main__':
+  unittest.main( )
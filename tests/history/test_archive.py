@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from decocare import archive
+from decocare import history
+from decocare import models
+from decocare import simulator
+
+class TestArchive(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp( )
+    self.model = models.lookup('522', None)
+    self.pages = [ simulator.make_history_page(self.model, seed=seed, start=datetime(2015, 6, 1 + seed))
+                   for seed in xrange(4) ]
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def dump(self, name, pages):
+    path = os.path.join(self.tmp, name)
+    with open(path, 'wb') as f:
+      for page in pages:
+        f.write(str(page))
+    return path
+
+  def test_overlapping_dumps(self):
+    # each download repeats the pages before it
+    paths = [ self.dump('first.data', self.pages[:2]),
+              self.dump('second.data', self.pages[:3]),
+              self.dump('third.data', self.pages) ]
+    decoder = archive.Archive('pump', model='522', processes=2)
+    records = decoder.run(paths)
+    self.assertEqual(decoder.stats['pages'], 4)
+    self.assertEqual(decoder.stats['duplicates'], 5)
+    self.assertEqual(decoder.stats['errors'], 0)
+    expected = [ ]
+    for page in self.pages:
+      expected.extend(history.HistoryPage(page, self.model).decode( ))
+    self.assertEqual(len(records), len(expected))
+    stamps = [ r['timestamp'] for r in records if 'timestamp' in r ]
+    self.assertEqual(stamps, sorted(stamps))
+    self.assertEqual(sorted(stamps), sorted([ r['timestamp'] for r in expected if 'timestamp' in r ]))
+
+  def test_partial_page_and_its_later_copy(self):
+    full = self.pages[0]
+    records = history.HistoryPage(full, self.model).decode( )
+    records.reverse( )
+    # page 0 as downloaded before its first 20 records were followed by the rest
+    written = sum([ len(r['_head'] + r['_date'] + r['_body']) / 2 for r in records[:20] ])
+    partial = simulator.make_page(full[:written])
+    path = self.dump('partial.data', [ partial, full ])
+    decoder = archive.Archive('pump', model='522', processes=1)
+    merged = decoder.run([ path ])
+    self.assertEqual(decoder.stats['pages'], 2)
+    self.assertEqual(decoder.stats['repeated'], 20)
+    self.assertEqual(len(merged), len(records))
+    self.assertEqual(sorted([ r['_head'] + r['_date'] + r['_body'] for r in merged ]),
+                     sorted([ r['_head'] + r['_date'] + r['_body'] for r in records ]))
+
+  def test_bad_pages_are_counted(self):
+    corrupt = bytearray(self.pages[0])
+    corrupt[10] ^= 0xff
+    path = self.dump('bad.data', [ corrupt, self.pages[1] ])
+    decoder = archive.Archive('pump', model='522', processes=1)
+    records = decoder.run([ path ])
+    self.assertEqual(decoder.stats['errors'], 1)
+    self.assertEqual(len(records), len(history.HistoryPage(self.pages[1], self.model).decode( )))
+
+if __name__ == '__main__':
+  unittest.main( )
@@ -0,0 +1,35 @@
+import json
+import unittest
+from collections import Mapping
+from datetime import datetime
+from decocare import history
+from decocare import models
+from decocare import simulator
+
+class TestCompactRecords(unittest.TestCase):
+
+  def setUp(self):
+    self.model = models.lookup('523', None)
+    page = simulator.make_history_page(self.model, seed=2, start=datetime(2015, 6, 1))
+    self.decoder = history.HistoryPage(page, self.model)
+
+  def test_same_as_decode(self):
+    records = self.decoder.records( )
+    self.assertEqual([ rec.as_dict( ) for rec in records ], self.decoder.decode( ))
+
+  def test_dict_view(self):
+    expected = self.decoder.decode( )
+    for rec, want in zip(self.decoder.records( ), expected):
+      self.assertTrue(isinstance(rec, Mapping))
+      self.assertEqual(sorted(rec.keys( )), sorted(want.keys( )))
+      self.assertEqual(rec['_description'], want['_description'])
+      self.assertEqual(rec.get('timestamp'), want.get('timestamp'))
+      self.assertEqual(json.dumps(rec.as_dict( ), sort_keys=True),
+                       json.dumps(want, sort_keys=True))
+
+  def test_no_instance_dict(self):
+    rec = self.decoder.records( )[0]
+    self.assertFalse(hasattr(rec, '__dict__'))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,57 @@
+import os
+import unittest
+from datetime import datetime
+from decocare import history
+from decocare import simulator
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', '..', 'page_10-18_glucose.data')
+
+class TestHistorySince(unittest.TestCase):
+
+  def setUp(self):
+    self.pages = [ simulator.make_history_page(seed=n, start=datetime(2015, 6, 10 - n))
+                   for n in xrange(3) ]
+    with open(FIXTURE, 'rb') as f:
+      glucose = simulator.split_pages(f.read( ))
+    self.pump = simulator.SimulatedPump(history=self.pages,
+                                        glucose=dict(zip(range(10, 19), glucose)))
+    self.session = simulator.open_pump(self.pump)
+    self.model = self.session.model
+    self.pump.received = [ ]
+
+  def received(self):
+    return [ code for code, params in self.pump.received ]
+
+  def newest(self, number):
+    return history.HistoryPage(self.pages[number], self.model).decode( )
+
+  def test_recent_history_costs_one_page(self):
+    records = self.newest(0)
+    since = datetime.strptime(records[9]['timestamp'], '%Y-%m-%dT%H:%M:%S')
+    found = self.model.read_history_since(since)
+    self.assertEqual(found, records[:10])
+    self.assertEqual(self.received( ), [ 128 ])
+
+  def test_older_history_reads_on(self):
+    records = self.newest(0) + self.newest(1)
+    older = self.newest(1)[-1]
+    since = datetime.strptime(older['timestamp'], '%Y-%m-%dT%H:%M:%S')
+    found = self.model.read_history_since(since)
+    self.assertEqual(found, records)
+    self.assertEqual(self.received( ), [ 128, 157, 128, 128 ])
+
+  def test_glucose_filter_bounds_pages(self):
+    since = datetime(2014, 4, 26, 12, 0)
+    found = self.model.read_glucose_since(since)
+    self.assertTrue(found)
+    dates = [ r['date'] for r in found if 'date' in r ]
+    self.assertTrue(min(dates) >= since.isoformat( ))
+    pages = set([ tuple(params) for code, params in self.pump.received if code == 154 ])
+    self.assertEqual(pages, set([ (0, 0, 0, 18), (0, 0, 0, 17) ]))
+    self.assertTrue(168 in self.received( ))
+    everything = list(self.model.iter_glucose_pages( ))
+    self.assertEqual(found, everything[:len(found)])
+    self.assertTrue(everything[len(found)]['date'] < since.isoformat( ))
+
+if __name__ == '__main__':
+  unittest.main( )
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+import unittest
+from decocare import cache
+from decocare import simulator
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', '..', 'page_10-18_glucose.data')
+
+class TestPageCache(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp( )
+    with open(FIXTURE, 'rb') as f:
+      pages = simulator.split_pages(f.read( ))
+    self.pump = simulator.SimulatedPump(glucose=dict(zip(range(10, 19), pages)))
+    self.session = simulator.open_pump(self.pump)
+    self.session.model.cache = cache.PageCache(self.tmp)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def glucose_pages_read(self):
+    # the current page may be read twice, around writing a timestamp
+    return len(set([ tuple(params) for code, params in self.pump.received if code == 154 ]))
+
+  def test_old_glucose_pages_come_from_cache(self):
+    first = list(self.session.model.iter_glucose_pages( ))
+    self.assertEqual(self.glucose_pages_read( ), 9)
+    self.pump.received = [ ]
+    second = list(self.session.model.iter_glucose_pages( ))
+    # only the current page, 18, is read again
+    self.assertEqual(self.glucose_pages_read( ), 1)
+    self.assertEqual(second, first)
+
+  def test_corrupt_page_is_fetched_again(self):
+    model = self.session.model
+    list(model.iter_glucose_pages( ))
+    key = model.cache.locators['%s:glucose:12' % self.pump.serial]
+    with open(model.cache.filename(key), 'r+b') as f:
+      f.seek(100)
+      f.write('\xff\xff')
+    self.pump.received = [ ]
+    list(model.iter_glucose_pages( ))
+    self.assertEqual(self.glucose_pages_read( ), 2)
+
+  def test_eviction_bounds_size(self):
+    store = cache.PageCache(os.path.join(self.tmp, 'small'), max_bytes=4 * 1024)
+    keys = [ store.put(simulator.make_page([ n ])) for n in range(10) ]
+    self.assertEqual(len(store), 4)
+    self.assertEqual([ key in store for key in keys ], [ False ] * 6 + [ True ] * 4)
+    self.assertEqual(len(os.listdir(store.path)), 5)
+
+  def test_reads_save_index_on_close(self):
+    store = cache.PageCache(os.path.join(self.tmp, 'lru'), max_bytes=2 * 1024)
+    first, second = [ store.put(simulator.make_page([ n ])) for n in range(2) ]
+    saved = [ ]
+    save = store.save
+    store.save = lambda: saved.append(save( ))
+    for n in range(3):
+      store.get(first)
+    self.assertEqual(saved, [ ])
+    store.close( )
+    self.assertEqual(len(saved), 1)
+    reopened = cache.PageCache(store.path, max_bytes=2 * 1024)
+    reopened.put(simulator.make_page([ 2 ]))
+    self.assertTrue(first in reopened)
+    self.assertFalse(second in reopened)
+
+  def test_failed_records_leave_no_file(self):
+    store = cache.PageCache(os.path.join(self.tmp, 'records'))
+    key = store.put(simulator.make_page([ 1 ]))
+    store.put_records(key, 'history', [ dict(name='DataEnd') ])
+    self.assertRaises(TypeError, store.put_records, key, 'history', [ object( ) ])
+    self.assertEqual(store.get_records(key, 'history'), [ dict(name='DataEnd') ])
+    self.assertEqual(len(os.listdir(store.path)), 3)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,98 @@
+import io
+import sys
+import random
+import unittest
+from datetime import datetime
+from decocare import lib
+from decocare import history
+from decocare import models
+from decocare import simulator
+
+def stream_decode (page, model):
+  """
+  HistoryPage.decode as it was, reading records from a stream with
+  parse_record, for comparison.
+  """
+  data = bytearray(page[:1022])
+  stream = io.BufferedReader(io.BytesIO(data))
+  records = [ ]
+  skipped = [ ]
+  for B in iter(lambda: bytearray(stream.read(2)), bytearray("")):
+    if B == bytearray( [ 0x00, 0x00 ] ):
+      if skipped:
+        if len(records) > 0:
+          last = records[-1]
+          last.update(appended=last.get('appended', [ ]) + skipped)
+        skipped = [ ]
+      break
+    record = history.parse_record(stream, B, model=model)
+    data = record.decode( )
+    rec = dict(_type=str(record.__class__.__name__),
+               _body=lib.hexlify(record.body),
+               _head=lib.hexlify(record.head),
+               _date=lib.hexlify(record.date),
+               _description=str(record))
+    if record.datetime:
+      rec.update(timestamp=record.datetime.isoformat( ))
+      if data is not None:
+        rec.update(data)
+        if skipped:
+          rec.update(appended=skipped)
+          skipped = [ ]
+      records.append(rec)
+    else:
+      if data is not None:
+        rec.update(data=data)
+      skipped.append(rec)
+  records.reverse( )
+  return records
+
+def outcome (func, *args):
+  try:
+    return func(*args)
+  except Exception, e:
+    return type(e)
+
+class TestPageDecoding(unittest.TestCase):
+  MODELS = [ '522', '523', '554' ]
+
+  def test_matches_stream_decoder(self):
+    for name in self.MODELS:
+      model = models.lookup(name, None)
+      for seed in xrange(10):
+        page = simulator.make_history_page(model, seed=seed, start=datetime(2015, 6, 1))
+        expected = stream_decode(page, model)
+        self.assertEqual(history.HistoryPage(page, model).decode( ), expected)
+
+  def test_matches_stream_decoder_on_noise(self):
+    rand = random.Random(6)
+    model = models.lookup('522', None)
+    # bad daily total dates get printed by parse_midnight
+    stdout, sys.stdout = sys.stdout, io.BytesIO( )
+    try:
+      for seed in xrange(50):
+        page = simulator.make_page([ rand.randint(0, 255) for i in xrange(1022) ])
+        expected = outcome(stream_decode, page, model)
+        decoded = outcome(history.HistoryPage(page, model).decode)
+        self.assertEqual(decoded, expected)
+    finally:
+      sys.stdout = stdout
+
+  def test_decodes_str_pages(self):
+    model = models.lookup('522', None)
+    page = simulator.make_history_page(model, seed=2, start=datetime(2015, 6, 1))
+    self.assertEqual(history.HistoryPage(str(page), model).decode( ),
+                     history.HistoryPage(page, model).decode( ))
+
+  def test_spans_cover_records(self):
+    model = models.lookup('523', None)
+    page = simulator.make_history_page(model, seed=3)
+    decoder = history.HistoryPage(page, model)
+    spans = list(decoder.spans( ))
+    records = decoder.decode( )
+    self.assertEqual(len(spans), len(records))
+    offset, length = spans[-1]
+    self.assertEqual(decoder.data[offset + length:offset + length + 2], bytearray(2))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,50 @@
+import os
+import unittest
+from datetime import datetime
+from itertools import islice
+from decocare import simulator
+
+FIXTURE = os.path.join(os.path.dirname(__file__), '..', '..', 'page_10-18_glucose.data')
+
+class TestPipelinedPages(unittest.TestCase):
+
+  def setUp(self):
+    pages = [ simulator.make_history_page(seed=n, start=datetime(2015, 6, 10 - n))
+              for n in xrange(4) ]
+    with open(FIXTURE, 'rb') as f:
+      glucose = simulator.split_pages(f.read( ))
+    self.pump = simulator.SimulatedPump(history=pages,
+                                        glucose=dict(zip(range(10, 19), glucose)))
+    self.session = simulator.open_pump(self.pump)
+    self.model = self.session.model
+
+  def history_pages_read(self):
+    return len([ code for code, params in self.pump.received if code == 128 ])
+
+  def test_history_matches_sequential(self):
+    expected = list(self.model.iter_history_pages( ))
+    self.assertEqual(list(self.model.iter_history_pages(pipeline=2)), expected)
+
+  def test_glucose_matches_sequential(self):
+    expected = list(self.model.iter_glucose_pages( ))
+    self.assertEqual(list(self.model.iter_glucose_pages(pipeline=2)), expected)
+
+  def test_fetch_errors_reach_consumer(self):
+    def broken(params):
+      if params and params[0] == 2:
+        raise IOError("radio gone")
+      return self.pump.read_history_data(params)
+    self.pump.responses[128] = broken
+    records = self.model.iter_history_pages(pipeline=1)
+    self.assertRaises(IOError, list, records)
+
+  def test_stopping_early_stops_fetching(self):
+    self.pump.received = [ ]
+    records = self.model.iter_history_pages(pipeline=1)
+    list(islice(records, 3))
+    records.close( )
+    # the page being decoded, one queued, and one in flight at most
+    self.assertTrue(self.history_pages_read( ) <= 3, self.history_pages_read( ))
+
+if __name__ == '__main__':
+  unittest.main( )
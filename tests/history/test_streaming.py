@@ -0,0 +1,68 @@
+import io
+import sys
+import random
+import unittest
+from datetime import datetime
+from itertools import islice
+from decocare import history
+from decocare import models
+from decocare import simulator
+
+class TestStreamingDecode(unittest.TestCase):
+  MODELS = [ '522', '523', '554' ]
+
+  def test_matches_decode(self):
+    for name in self.MODELS:
+      model = models.lookup(name, None)
+      for seed in xrange(20):
+        page = simulator.make_history_page(model, seed=seed, start=datetime(2015, 6, 1))
+        decoder = history.HistoryPage(page, model)
+        self.assertEqual(list(decoder.iter_decode( )), decoder.decode( ))
+        self.assertEqual([ r.as_dict( ) for r in decoder.iter_records( ) ],
+                         [ r.as_dict( ) for r in decoder.records( ) ])
+
+  def test_matches_decode_on_noise(self):
+    rand = random.Random(11)
+    model = models.lookup('522', None)
+    # bad daily total dates get printed by parse_midnight
+    stdout, sys.stdout = sys.stdout, io.BytesIO( )
+    try:
+      for seed in xrange(50):
+        page = simulator.make_page([ rand.randint(0, 255) for i in xrange(1022) ])
+        decoder = history.HistoryPage(page, model)
+        try:
+          expected = decoder.decode( )
+        except Exception:
+          continue
+        self.assertEqual(list(decoder.iter_decode( )), expected)
+    finally:
+      sys.stdout = stdout
+
+  def test_stopping_early_decodes_less(self):
+    page = simulator.make_history_page(seed=3, start=datetime(2015, 6, 1))
+    decoder = history.HistoryPage(page, None)
+    made = [ ]
+    def make(record, decoded):
+      made.append(record)
+      return history.describe_record(record, decoded)
+    newest = list(islice(decoder.stream(make, history.append_skipped), 3))
+    self.assertEqual(newest, decoder.decode( )[:3])
+    self.assertTrue(len(made) < len(list(decoder.spans( ))) / 2, len(made))
+
+  def test_pages_fetched_on_demand(self):
+    pages = [ simulator.make_history_page(seed=n, start=datetime(2015, 6, 10 - n))
+              for n in xrange(3) ]
+    pump = simulator.SimulatedPump(history=pages)
+    session = simulator.open_pump(pump)
+    pump.received = [ ]
+    records = session.model.iter_history_pages( )
+    list(islice(records, 5))
+    # only page 0, and without asking how many pages there are
+    self.assertEqual([ code for code, params in pump.received ], [ 128 ])
+    rest = list(records)
+    self.assertEqual([ code for code, params in pump.received ], [ 128, 157, 128, 128 ])
+    self.assertEqual(len(rest) + 5, sum([ len(history.HistoryPage(p, session.model).decode( ))
+                                          for p in pages ]))
+
+if __name__ == '__main__':
+  unittest.main( )
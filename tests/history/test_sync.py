@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from decocare import history
+from decocare import simulator
+from decocare import sync
+
+class TestHistorySync(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp( )
+    self.state = os.path.join(self.tmp, 'history-sync.json')
+    self.older = simulator.make_history_page(seed=7, start=datetime(2015, 5, 30))
+    self.full = simulator.make_history_page(seed=8, start=datetime(2015, 6, 1))
+    spans = list(history.HistoryPage(self.full, None).spans( ))
+    # the current page, before its last few records were written
+    offset, length = spans[-4]
+    self.partial = simulator.make_page(self.full[:offset])
+    self.pump = simulator.SimulatedPump(history=[ self.partial, self.older ])
+    self.session = simulator.open_pump(self.pump)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def decode(self, page):
+    return history.HistoryPage(page, self.session.model).decode( )
+
+  def written_since(self):
+    """
+    Records on the full page that are newer than the partial one.
+    """
+    full = self.decode(self.full)
+    newest = self.decode(self.partial)[0]
+    return full[:[ r['_head'] + r['_date'] for r in full ].index(newest['_head'] + newest['_date'])]
+
+  def test_first_run_reads_everything(self):
+    syncer = sync.HistorySync(self.session.model, self.state)
+    records = syncer.sync( )
+    self.assertEqual(records, self.decode(self.partial) + self.decode(self.older))
+    self.assertEqual(syncer.pages_read, 2)
+
+  def test_unchanged_reads_one_page(self):
+    sync.HistorySync(self.session.model, self.state).sync( )
+    syncer = sync.HistorySync(self.session.model, self.state)
+    self.assertEqual(syncer.sync( ), [ ])
+    self.assertEqual(syncer.pages_read, 1)
+
+  def test_new_records_on_current_page(self):
+    sync.HistorySync(self.session.model, self.state).sync( )
+    self.pump.history[0] = self.full
+    syncer = sync.HistorySync(self.session.model, self.state)
+    records = syncer.sync( )
+    self.assertTrue(len(records) > 0)
+    self.assertEqual(records, self.written_since( ))
+    self.assertEqual(syncer.pages_read, 1)
+
+  def test_pump_rolls_to_a_new_page(self):
+    syncer = sync.HistorySync(self.session.model, self.state)
+    syncer.sync( )
+    fresh = simulator.make_history_page(seed=9, start=datetime(2015, 6, 3))
+    self.pump.history = [ fresh, self.full, self.older ]
+    records = syncer.sync( )
+    self.assertEqual(records, self.decode(fresh) + self.written_since( ))
+    self.assertEqual(syncer.pages_read, 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+import time
+from decocare import aio
+from decocare import capture
+from decocare import commands
+from decocare import simulator
+
+class TestAsyncDownload(unittest.TestCase):
+
+  def make_page(self, fill):
+    return simulator.make_page(bytearray([ fill ] * 1022))
+
+  def open_pump(self, serial, fill):
+    pages = [ self.make_page(fill), self.make_page(fill + 1) ]
+    pump = simulator.SimulatedPump(serial=serial, history=pages)
+    serial_port = simulator.SimulatedSerial(pump, latency=.005, frame_time=.001)
+    return aio.AsyncPump(aio.AsyncStick(aio.AsyncLink(serial_port)), serial)
+
+  def read_page(self, pump, page):
+    yield pump.stick.open( )
+    yield pump.read_model( )
+    response = yield pump.query(commands.ReadHistoryData, page=page)
+    raise aio.Return(response.data)
+
+  def test_read_history_page(self):
+    pump = self.open_pump('208850', 0x33)
+    data, = aio.Loop( ).run(self.read_page(pump, 1))
+    self.assertEqual(data, self.make_page(0x34))
+    self.assertEqual(pump.modelNumber, '522')
+    self.assertEqual(len(pump.stick.latencies), 16)
+
+  def test_capture(self):
+    tmp = tempfile.mkdtemp( )
+    try:
+      path = os.path.join(tmp, 'wire.capture')
+      pump = self.open_pump('208850', 0x33)
+      pump.stick.link.capture_to(capture.Capture(path))
+      data, = aio.Loop( ).run(self.read_page(pump, 0))
+      pump.stick.link.capture.close( )
+      frames = list(capture.frames(path))
+    finally:
+      shutil.rmtree(tmp)
+    self.assertEqual(set([ direction for when, direction, frame in frames ]), set([ 'w', 'r' ]))
+    radio = [ frame[13:13 + 64] for when, direction, frame in frames
+              if direction == 'r' and len(frame) > 64 and frame[0] == 0x02 ]
+    self.assertTrue(bytearray( ).join(radio).endswith(data))
+
+  def test_sticks_run_concurrently(self):
+    pumps = [ self.open_pump('208850', 0x33), self.open_pump('665455', 0x55) ]
+    start = time.time( )
+    pages = aio.Loop( ).run(*[ self.read_page(pump, 0) for pump in pumps ])
+    elapsed = time.time( ) - start
+    self.assertEqual(pages, [ self.make_page(0x33), self.make_page(0x55) ])
+    # each pump waits out two effect times; one after the other would
+    # take twice as long.
+    effect = commands.ReadPumpModel.effectTime + commands.ReadHistoryData.effectTime
+    self.assertTrue(elapsed < effect * 1.5, elapsed)
+
+  def test_errors_reach_the_caller(self):
+    def fails( ):
+      yield aio.sleep(0)
+      raise ValueError('broken')
+    def calls( ):
+      try:
+        yield fails( )
+      except ValueError, e:
+        raise aio.Return(str(e))
+    self.assertEqual(aio.Loop( ).run(calls( )), [ 'broken' ])
+    self.assertRaises(ValueError, aio.Loop( ).run, fails( ))
+
+if __name__ == '__main__':
+  unittest.main( )
@@ -0,0 +1,58 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from decocare import link
+from decocare import capture
+from decocare import simulator
+
+class TestCapture(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp( )
+    self.path = os.path.join(self.tmp, 'wire.capture')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_records_a_download(self):
+    page = simulator.make_page(bytearray([ 0x33 ] * 1022))
+    pump = simulator.open_pump(simulator.SimulatedPump(history=[ page ]))
+    sink = capture.Capture(self.path)
+    pump.stick.link.capture_to(sink)
+    response = pump.query(pump.model.read_history_data.msg, page=0)
+    pump.stick.link.capture_to(None)
+    sink.close( )
+    frames = list(capture.frames(self.path))
+    self.assertEqual(set([ direction for when, direction, data in frames ]), set([ 'w', 'r' ]))
+    times = [ when for when, direction, data in frames ]
+    self.assertEqual(times, sorted(times))
+    # every radio frame read back carries 64 bytes of the page
+    radio = [ data[13:13 + 64] for when, direction, data in frames
+              if direction == 'r' and len(data) > 64 and data[0] == 0x02 ]
+    self.assertEqual(bytearray( ).join(radio), response.data)
+
+  def test_no_hexdump_unless_logged(self):
+    dumps = [ ]
+    hexdump = link.lib.hexdump
+    def counting(data, *args, **kwds):
+      dumps.append(data)
+      return hexdump(data, *args, **kwds)
+    link.lib.hexdump = counting
+    level = link.io.level
+    try:
+      link.io.setLevel(logging.WARNING)
+      simulator.open_pump( )
+      self.assertEqual(dumps, [ ])
+    finally:
+      link.lib.hexdump = hexdump
+      link.io.setLevel(level)
+
+  def test_rejects_other_files(self):
+    with open(self.path, 'wb') as f:
+      f.write('not a capture')
+    self.assertRaises(ValueError, list, capture.frames(self.path))
+
+if __name__ == '__main__':
+  unittest.main( )
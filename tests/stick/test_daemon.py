@@ -0,0 +1,152 @@
+import io
+import json
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from decocare import daemon
+from decocare import commands
+from decocare import rfsession
+from decocare import simulator
+from decocare.helpers import cli
+from decocare.sync import HistorySync
+
+POWER_CONTROL = 93
+READ_MODEL = 141
+
+class App(cli.CommandApp):
+  """
+  CommandApp using the daemon.
+  """
+
+class TestDaemon(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp( )
+    self.path = os.path.join(self.tmp, 'stick.sock')
+    page = simulator.make_history_page(seed=7, start=datetime(2015, 5, 30))
+    self.simulated = simulator.SimulatedPump(history=[ page ])
+    self.server = daemon.Daemon(simulator.open_pump(self.simulated), self.path)
+    self.worker = threading.Thread(target=self.server.serve_forever)
+    self.worker.start( )
+    del self.simulated.received[:]
+    self.clients = [ ]
+
+  def tearDown(self):
+    for client in self.clients:
+      client.close( )
+    self.server.shutdown( )
+    self.worker.join( )
+    self.server.server_close( )
+    shutil.rmtree(self.tmp)
+
+  def client(self):
+    client = daemon.Client(self.path)
+    self.clients.append(client)
+    return client
+
+  def test_socket_is_private(self):
+    self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+
+  def test_remote_pump_matches_local(self):
+    pump = daemon.RemotePump(self.client( ))
+    local = simulator.open_pump(self.simulated)
+    self.assertEqual(pump.model.__class__, local.model.__class__)
+    self.assertEqual(pump.model.read_status( ), local.model.read_status( ))
+    self.assertEqual(pump.model.read_reservoir( ), local.model.read_reservoir( ))
+    self.assertEqual(list(pump.model.iter_history_pages( )),
+                     list(local.model.iter_history_pages( )))
+
+  def test_read_model_is_not_sent(self):
+    pump = daemon.RemotePump(self.client( ))
+    self.assertEqual(pump.read_model( ).getData( ), '522')
+    self.assertNotIn(READ_MODEL, [ code for code, params in self.simulated.received ])
+
+  def test_sync_through_daemon(self):
+    pump = daemon.RemotePump(self.client( ))
+    syncer = HistorySync(pump.model, os.path.join(self.tmp, 'sync.json'))
+    records = syncer.sync( )
+    local = HistorySync(simulator.open_pump(self.simulated).model).sync( )
+    self.assertTrue(records)
+    self.assertEqual(records, local)
+    self.assertEqual(syncer.sync( ), [ ])
+
+  def test_call_task(self):
+    client = self.client( )
+    described = client.request('describe')
+    self.assertIn('read_status', described['tasks'])
+    self.assertIn('read_history_since', described['tasks'])
+    self.assertEqual(client.request('call', task='read_model'), '522')
+    since = client.request('call', task='read_history_since',
+                           params=dict(since=datetime(2015, 5, 1)))
+    self.assertTrue(since)
+
+  def test_wakes_pump_when_session_lapses(self):
+    sessions = rfsession.RFSessions(os.path.join(self.tmp, 'rf.json'))
+    self.server.sessions = sessions
+    effectTime, commands.PowerControl.effectTime = commands.PowerControl.effectTime, 0
+    try:
+      client = self.client( )
+      self.assertEqual(client.request('describe')['rf_session'], 0)
+      for n in xrange(2):
+        client.request('call', task='read_battery_status')
+      self.assertTrue(client.request('describe')['rf_session'] > 0)
+      sessions.record(self.simulated.serial, 10, now=1)
+      client.request('call', task='read_battery_status')
+    finally:
+      commands.PowerControl.effectTime = effectTime
+    codes = [ code for code, params in self.simulated.received ]
+    self.assertEqual(codes.count(POWER_CONTROL), 2)
+    self.assertEqual(codes[0], POWER_CONTROL)
+
+  def test_errors(self):
+    client = self.client( )
+    self.assertRaises(daemon.RemoteError, client.request, 'call', task='_bolus')
+    self.assertRaises(daemon.RemoteError, client.request, 'query', command='Daemon')
+    self.assertRaises(daemon.RemoteError, client.request, 'nothing')
+    self.assertEqual(client.request('ping'), 'pong')
+
+  def test_malformed_requests(self):
+    client = self.client( )
+    for line in [ 'not json', '[1]', '"x"', '{"id": 1, "method": "ping", "params": [1]}' ]:
+      client.stream.write(line + "\n")
+      client.stream.flush( )
+      reply = json.loads(client.stream.readline( ))
+      self.assertEqual(reply['result'], None)
+      self.assertTrue(reply['error'])
+    self.assertEqual(client.request('ping'), 'pong')
+
+  def test_clients_share_the_stick(self):
+    results = [ ]
+    def status ( ):
+      pump = daemon.RemotePump(daemon.Client(self.path))
+      try:
+        results.append(pump.model.read_status( ))
+      finally:
+        pump.client.close( )
+    workers = [ threading.Thread(target=status) for n in xrange(4) ]
+    for worker in workers:
+      worker.start( )
+    for worker in workers:
+      worker.join( )
+    self.assertEqual(len(results), 4)
+    self.assertEqual(len(set(map(repr, results))), 1)
+
+  def test_cli_skips_prelude(self):
+    app = App( )
+    args = app.parser.parse_args([ '--daemon', self.path, 'act' ])
+    stdout, sys.stdout = sys.stdout, io.BytesIO( )
+    try:
+      app.prelude(args)
+      app.postlude(args)
+    finally:
+      sys.stdout = stdout
+      app.pump.client.close( )
+    self.assertEqual(app.model.getData( ), '522')
+    self.assertEqual(self.simulated.received, [ ])
+
+if __name__ == '__main__':
+  unittest.main( )
@@ -0,0 +1,50 @@
+import json
+import unittest
+from decocare import stick
+from decocare import session
+from decocare import metrics
+from decocare import simulator
+
+class TestMetrics(unittest.TestCase):
+
+  def setUp(self):
+    metrics.REGISTRY.reset( )
+
+  def test_history_page_download(self):
+    page = simulator.make_page(bytearray([ 0x33 ] * 1022))
+    pump = simulator.open_pump(simulator.SimulatedPump(history=[ page ]))
+    # just the page, not reading the model
+    metrics.REGISTRY.reset( )
+    response = pump.query(pump.model.read_history_data.msg, page=0)
+    self.assertEqual(response.data, page)
+    self.assertEqual(session.ATTEMPTS.get(opcode=128), 1)
+    self.assertEqual(session.EXECUTE.get(opcode=128)['count'], 1)
+    frames = stick.FRAME_BYTES.get( )
+    self.assertEqual(frames['count'], 16)
+    self.assertEqual(frames['sum'], 1024)
+    self.assertEqual(stick.ROUND_TRIP.get(command='ReadRadio')['count'], 16)
+    self.assertTrue(stick.POLLS.get( )['count'] >= 16)
+    self.assertTrue(metrics.SLEEP.get(where='effect')['sum'] >= response.effectTime)
+
+  def test_bad_crc(self):
+    serial = simulator.SimulatedSerial(drop_rate=1.0, seed=1)
+    frame = serial.format_frame(bytearray([ 0x01 ] * 64), eod=True)
+    reader = stick.ReadRadio(len(frame))
+    ack, body = reader.respond(frame)
+    self.assertEqual(reader.parse(body), bytearray( ))
+    self.assertEqual(stick.BAD_CRCS.get( ), 1)
+    # the stick, not the frame, decides how long to wait
+    self.assertTrue(reader.bad_crc)
+
+  def test_exposition(self):
+    pump = simulator.open_pump( )
+    snapshot = json.loads(json.dumps(metrics.REGISTRY.snapshot( )))
+    execute = snapshot['decocare_session_execute_seconds']
+    self.assertEqual(execute['type'], 'histogram')
+    self.assertEqual(execute['values']['opcode="141"']['count'], 1)
+    text = metrics.REGISTRY.prometheus( )
+    self.assertTrue('# TYPE decocare_stick_naks_total counter' in text)
+    self.assertTrue('decocare_session_attempts_total{opcode="141"} 1' in text)
+
+if __name__ == '__main__':
+  unittest.main( )
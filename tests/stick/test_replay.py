@@ -0,0 +1,89 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from decocare import stick
+from decocare import session
+from decocare import capture
+from decocare import commands
+from decocare import simulator
+
+class TestReplay(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp( )
+    self.path = os.path.join(self.tmp, 'wire.capture')
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def write(self, *frames):
+    sink = capture.Capture(self.path)
+    for when, direction, data in frames:
+      sink.frame(direction, bytearray(data), when=when)
+    sink.close( )
+
+  def sync(self, device):
+    uart = stick.Stick(device, adaptive=True)
+    uart.open( )
+    pump = session.Pump(uart, '208850')
+    pump.read_model( )
+    return [ pump.query(commands.ReadHistoryData, page=n).data for n in xrange(2) ]
+
+  def test_replays_a_session(self):
+    pages = [ simulator.make_history_page(seed=n, start=datetime(2015, 6, 10 - n)) for n in xrange(2) ]
+    recorded = simulator.SimulatedLink(simulator.SimulatedPump(history=pages), latency=0)
+    recorded.capture_to(capture.Capture(self.path))
+    self.assertEqual(self.sync(recorded), pages)
+    recorded.capture.close( )
+    self.assertEqual(self.sync(capture.ReplayLink(self.path)), pages)
+
+  def test_captures_a_replay(self):
+    pages = [ simulator.make_history_page(seed=n, start=datetime(2015, 6, 10 - n)) for n in xrange(2) ]
+    recorded = simulator.SimulatedLink(simulator.SimulatedPump(history=pages), latency=0)
+    recorded.capture_to(capture.Capture(self.path))
+    self.sync(recorded)
+    recorded.capture.close( )
+    again = os.path.join(self.tmp, 'again.capture')
+    replay = capture.ReplayLink(self.path)
+    replay.capture_to(capture.Capture(again))
+    self.assertEqual(self.sync(replay), pages)
+    replay.capture.close( )
+    self.assertEqual([ d for w, d, data in capture.frames(again) ].count('r'),
+                     [ d for w, d, data in capture.frames(self.path) ].count('r'))
+    self.assertEqual(self.sync(capture.ReplayLink(again)), pages)
+
+  def test_polls_more_or_less(self):
+    self.write((1, 'w', 'A'), (2, 'r', 'a1'), (3, 'w', 'A'), (4, 'r', 'a2'),
+               (5, 'w', 'B'), (6, 'r', 'b'))
+    fewer = capture.ReplayLink(self.path)
+    fewer.write('A')
+    self.assertEqual(fewer.read(64), 'a1')
+    fewer.write('B')
+    self.assertEqual(fewer.read(64), 'b')
+    self.assertEqual(fewer.read(64), '')
+    more = capture.ReplayLink(self.path)
+    for reply in [ 'a1', 'a2', 'a2' ]:
+      more.write('A')
+      self.assertEqual(more.read(64), reply)
+    more.write('B')
+    self.assertEqual(more.read(1), 'b')
+    self.assertRaises(capture.ReplayError, more.write, 'C')
+
+  def test_recorded_timing(self):
+    self.write((100, 'w', 'A'), (100.5, 'r', 'a'))
+    replay = capture.ReplayLink(self.path, speed=10)
+    began = time.time( )
+    replay.write('A')
+    self.assertEqual(replay.read(64), 'a')
+    self.assertTrue(time.time( ) - began >= .05)
+    replay = capture.ReplayLink(self.path)
+    began = time.time( )
+    replay.write('A')
+    replay.read(64)
+    self.assertTrue(time.time( ) - began < .05)
+
+if __name__ == '__main__':
+  unittest.main( )
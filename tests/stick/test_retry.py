@@ -0,0 +1,124 @@
+import unittest
+from decocare import retry
+from decocare import stick
+from decocare import session
+from decocare import metrics
+from decocare import commands
+from decocare import simulator
+from decocare.errors import BadDeviceCommError
+
+class DozyLink(simulator.SimulatedLink):
+  """
+  A link whose first read after every write comes back empty.
+  """
+  dozing = False
+  def write(self, string):
+    self.dozing = True
+    return super(DozyLink, self).write(string)
+
+  def read(self, c):
+    if self.dozing:
+      self.dozing = False
+      return ''
+    return super(DozyLink, self).read(c)
+
+class BusyLink(simulator.SimulatedLink):
+  """
+  A link whose LinkStatus answers carry a non-zero ack while busy.
+  """
+  busy = False
+  def write(self, string):
+    r = super(BusyLink, self).write(string)
+    if self.busy and bytearray(string)[0] == 0x03:
+      self.serial.output[3] = 0x08
+    return r
+
+class TestRetry(unittest.TestCase):
+
+  def setUp(self):
+    metrics.REGISTRY.reset( )
+
+  def flaky(self, pump, error, times=1):
+    """
+    Make pump's next transfers fail with error.
+    """
+    transfer = pump.transfer
+    failures = [ error ] * times
+    def flaky ( ):
+      if failures:
+        raise failures.pop( )
+      return transfer( )
+    pump.transfer = flaky
+
+  def test_learns_effect_time(self):
+    pump = simulator.open_pump( )
+    status = commands.ReadPumpStatus( )
+    self.assertEqual(pump.policy.effect(status, adaptive=True), status.effectTime)
+    results = [ pump.model.read_status( ) for n in xrange(5) ]
+    self.assertEqual(results, [ results[0] ] * 5)
+    self.assertTrue(pump.policy.effect(status, adaptive=True) < status.effectTime)
+    self.assertEqual(pump.policy.effect(status, adaptive=False), status.effectTime)
+    self.assertTrue(metrics.SLEEP.get(where='effect')['sum'] < 5 * status.effectTime)
+
+  def test_nothing_to_download_is_not_learned(self):
+    pump = simulator.open_pump( )
+    # the real pump takes 12 seconds to wake
+    effectTime, commands.PowerControl.effectTime = commands.PowerControl.effectTime, 0
+    try:
+      for n in xrange(5):
+        pump.query(commands.PowerControl, minutes=1)
+    finally:
+      commands.PowerControl.effectTime = effectTime
+    power = commands.PowerControl( )
+    self.assertEqual(pump.policy.effect(power, adaptive=True), power.effectTime)
+
+  def test_retries_nak_with_backoff(self):
+    pump = simulator.open_pump( )
+    self.flaky(pump, BadDeviceCommError("nak"))
+    self.assertEqual(pump.read_model( ).getData( ), '522')
+    self.assertEqual(retry.FAILURES.get(kind=retry.NAK), 1)
+    pause = metrics.SLEEP.get(where='retry_nak')
+    self.assertEqual(pause['count'], 1)
+    self.assertTrue(pause['sum'] <= retry.BACKOFF[retry.NAK].first)
+
+  def test_other_errors_are_not_retried(self):
+    pump = simulator.open_pump( )
+    self.flaky(pump, stick.UnresponsiveError("gone"))
+    self.assertRaises(stick.UnresponsiveError, pump.read_model)
+    self.assertEqual(retry.FAILURES.get(kind=retry.NAK), 0)
+
+  def test_recovered_reads_dont_open_the_breaker(self):
+    pump = simulator.SimulatedPump( )
+    uart = stick.Stick(DozyLink(pump, latency=0), adaptive=True)
+    uart.open( )
+    for n in xrange(3):
+      uart.interface_stats( )
+    self.assertTrue(retry.FAILURES.get(kind=retry.ZERO_READ) > uart.policy.breaker.threshold)
+    self.assertEqual(uart.policy.breaker.failures, 0)
+    device = session.Pump(uart, pump.serial)
+    self.assertEqual(device.read_model( ).getData( ), '522')
+    self.assertEqual(retry.OPENED.get( ), 0)
+
+  def test_breaker_fails_fast(self):
+    pump = simulator.SimulatedPump( )
+    link = BusyLink(pump, latency=0)
+    uart = stick.Stick(link, adaptive=True)
+    uart.open( )
+    device = session.Pump(uart, pump.serial)
+    device.read_model( )
+    uart.policy.breaker.threshold = 4
+    link.busy = True
+    # each command tries twice; ack failures add up across commands
+    for n in xrange(2):
+      device.read_model( )
+    self.assertEqual(retry.OPENED.get( ), 1)
+    # and so does the backoff
+    self.assertTrue(metrics.SLEEP.get(where='retry_ack')['sum'] > 2 * retry.BACKOFF[retry.ACK].first)
+    self.assertRaises(retry.CircuitOpen, device.read_model)
+    link.busy = False
+    uart.policy.breaker.opened -= uart.policy.breaker.reset
+    self.assertEqual(device.read_model( ).getData( ), '522')
+    self.assertEqual(uart.policy.breaker.failures, 0)
+
+if __name__ == '__main__':
+  unittest.main( )
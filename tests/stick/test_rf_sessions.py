@@ -0,0 +1,83 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from decocare import commands
+from decocare import simulator
+from decocare import rfsession
+from decocare.helpers import cli
+
+POWER_CONTROL = 93
+READ_MODEL = 141
+
+class SimulatedApp(cli.CommandApp):
+  """
+  CommandApp talking to a SimulatedPump.
+  """
+  def __init__(self, pump):
+    self.simulated = pump
+    super(SimulatedApp, self).__init__( )
+
+  def open_link(self, args):
+    return simulator.SimulatedLink(self.simulated, latency=0, frame_time=0)
+
+class TestRFSessions(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp( )
+    self.path = os.path.join(self.tmp, 'sessions', 'rf.json')
+    # the real pump takes 12 seconds to wake
+    self.effectTime = commands.PowerControl.effectTime
+    commands.PowerControl.effectTime = 0
+
+  def tearDown(self):
+    commands.PowerControl.effectTime = self.effectTime
+    shutil.rmtree(self.tmp)
+
+  def prelude(self, pump, *argv):
+    app = SimulatedApp(pump)
+    argv = [ '--serial', pump.serial, '--port', 'simulated',
+             '--rf-sessions', self.path, '--adaptive-download' ] + list(argv) + [ 'act' ]
+    stdout, sys.stdout = sys.stdout, io.BytesIO( )
+    try:
+      app.prelude(app.parser.parse_args(argv))
+    finally:
+      sys.stdout = stdout
+    codes = [ code for code, params in pump.received ]
+    del pump.received[:]
+    return app, codes
+
+  def test_skips_power_control_while_awake(self):
+    pump = simulator.SimulatedPump( )
+    app, codes = self.prelude(pump, '--init')
+    self.assertEqual(codes, [ POWER_CONTROL, READ_MODEL ])
+    self.assertTrue(rfsession.RFSessions(self.path).is_open(pump.serial))
+    app, codes = self.prelude(pump, '--init')
+    self.assertEqual(codes, [ READ_MODEL ])
+    self.assertEqual(app.model.getData( ), '522')
+    app, codes = self.prelude(pump, '--auto-init')
+    self.assertEqual(codes, [ READ_MODEL ])
+
+  def test_falls_back_when_pump_is_asleep(self):
+    answers = [ bytearray([ 0x00 ]) ]
+    def read_model(params):
+      if answers:
+        return answers.pop( )
+      return bytearray([ 3 ]) + bytearray('522')
+    pump = simulator.SimulatedPump(responses={ READ_MODEL: read_model })
+    rfsession.RFSessions(self.path).record(pump.serial, 10)
+    app, codes = self.prelude(pump, '--init')
+    self.assertEqual(codes, [ READ_MODEL, POWER_CONTROL, READ_MODEL ])
+    self.assertEqual(app.model.getData( ), '522')
+    self.assertTrue(rfsession.RFSessions(self.path).is_open(pump.serial))
+
+  def test_no_rf_sessions(self):
+    pump = simulator.SimulatedPump( )
+    rfsession.RFSessions(self.path).record(pump.serial, 10)
+    app, codes = self.prelude(pump, '--init', '--no-rf-sessions')
+    self.assertEqual(codes, [ POWER_CONTROL, READ_MODEL ])
+
+if __name__ == '__main__':
+  unittest.main( )
@@ -0,0 +1,88 @@
+import threading
+import unittest
+from datetime import datetime
+from decocare import commands
+from decocare import shared
+from decocare import simulator
+from decocare.errors import StickError
+
+READ_HISTORY = 128
+READ_STATUS = 206
+
+class TestSharedStick(unittest.TestCase):
+
+  def setUp(self):
+    pages = [ simulator.make_history_page(seed=n, start=datetime(2015, 6, 10 - n)) for n in xrange(3) ]
+    self.simulated = simulator.SimulatedPump(history=pages)
+    self.shared = shared.SharedStick(simulator.open_pump(self.simulated))
+    del self.simulated.received[:]
+
+  def tearDown(self):
+    self.shared.close( )
+
+  def hold(self):
+    """
+    Keep the pump's thread busy until the returned event is set.
+    """
+    release = threading.Event( )
+    self.shared.call(release.wait)
+    return release
+
+  def test_status_jumps_ahead_of_pages(self):
+    release = self.hold( )
+    serial = self.simulated.serial
+    pages = [ self.shared.submit(commands.ReadHistoryData(serial=serial, page=n)) for n in xrange(3) ]
+    status = self.shared.submit(commands.ReadPumpStatus(serial=serial))
+    release.set( )
+    self.assertEqual(status.result( ).getData( )['status'], 'normal')
+    for page in pages:
+      page.result( )
+    codes = [ code for code, params in self.simulated.received ]
+    self.assertEqual(codes, [ READ_STATUS ] + [ READ_HISTORY ] * 3)
+
+  def test_same_priority_keeps_order(self):
+    release = self.hold( )
+    serial = self.simulated.serial
+    pages = [ self.shared.submit(commands.ReadHistoryData(serial=serial, page=n)) for n in (2, 0, 1) ]
+    release.set( )
+    for page in pages:
+      page.result( )
+    self.assertEqual([ params[0] for code, params in self.simulated.received ], [ 2, 0, 1 ])
+
+  def test_threads_share_one_session(self):
+    local = simulator.open_pump(self.simulated).model
+    history = list(local.iter_history_pages( ))
+    status = local.read_status( )
+    results = { }
+    def download ( ):
+      results['history'] = list(self.shared.session( ).model.iter_history_pages( ))
+    def poll ( ):
+      pump = self.shared.session( )
+      results['status'] = [ pump.model.read_status( ) for n in xrange(3) ]
+    workers = [ threading.Thread(target=download), threading.Thread(target=poll) ]
+    for worker in workers:
+      worker.start( )
+    for worker in workers:
+      worker.join( )
+    self.assertEqual(results['history'], history)
+    self.assertEqual(results['status'], [ status ] * 3)
+
+  def test_errors_and_cancel(self):
+    release = self.hold( )
+    def fail ( ):
+      raise ValueError("no")
+    failed = self.shared.call(fail)
+    cancelled = self.shared.submit(commands.ReadPumpModel(serial=self.simulated.serial))
+    self.assertTrue(cancelled.cancel( ))
+    self.assertRaises(shared.Timeout, failed.result, timeout=.01)
+    release.set( )
+    self.assertRaises(ValueError, failed.result)
+    self.assertRaises(shared.Cancelled, cancelled.result)
+    self.assertEqual(self.simulated.received, [ ])
+
+  def test_closed(self):
+    self.shared.close( )
+    self.assertRaises(StickError, self.shared.call, lambda: None)
+
+if __name__ == '__main__':
+  unittest.main( )
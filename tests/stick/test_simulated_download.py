@@ -0,0 +1,51 @@
+import unittest
+from decocare import stick
+from decocare import session
+from decocare import simulator
+
+class TestSimulatedDownload(unittest.TestCase):
+  SERIAL = '208850'
+
+  def make_page(self, fill):
+    return simulator.make_page(bytearray([ fill ] * 1022))
+
+  def open_pump(self, adaptive=True, **kwds):
+    pages = [ self.make_page(0x33), self.make_page(0x44) ]
+    pump = simulator.SimulatedPump(serial=self.SERIAL, history=pages)
+    link = simulator.SimulatedLink(pump, latency=.005, frame_time=.001, **kwds)
+    uart = stick.Stick(link, adaptive=adaptive)
+    uart.open( )
+    return session.Pump(uart, self.SERIAL)
+
+  def test_read_model_fixed_schedule(self):
+    pump = self.open_pump(adaptive=False)
+    model = pump.read_model( )
+    self.assertEqual(model.getData( ), '522')
+
+  def test_read_history_page_adaptive(self):
+    pump = self.open_pump( )
+    pump.read_model( )
+    self.assertEqual(pump.model.read_current_history_pages( ), 2)
+    response = pump.query(pump.model.read_history_data.msg, page=1)
+    self.assertEqual(response.data, self.make_page(0x44))
+    latencies = pump.stick.latencies
+    self.assertEqual(len(latencies), 16)
+    self.assertEqual(sum([ l['bytes'] for l in latencies ]), 1024)
+
+  def test_wrong_serial_gets_no_answer(self):
+    pump = simulator.SimulatedPump(serial='665455')
+    serial = simulator.SimulatedSerial(pump, latency=0)
+    serial.write(session.commands.ReadPumpModel(serial=self.SERIAL).format( ))
+    self.assertEqual(serial.frames, [ ])
+
+  def test_dropped_frame_fails_crc(self):
+    serial = simulator.SimulatedSerial(drop_rate=1.0, seed=1)
+    frame = serial.format_frame(bytearray([ 0x01 ] * 64), eod=True)
+    reader = stick.ReadRadio(len(frame))
+    ack, body = reader.respond(frame)
+    self.assertEqual(reader.parse(body), bytearray( ))
+    self.assertTrue(reader.eod)
+    self.assertEqual(serial.stats['radio'][0], 1)
+
+if __name__ == '__main__':
+  unittest.main( )
@@ -0,0 +1,96 @@
+import time
+import unittest
+from decocare import scan
+from decocare import commands
+from decocare import simulator
+from decocare import supervisor
+
+POWER_CONTROL = 93
+READ_MODEL = 141
+
+class TestSupervisor(unittest.TestCase):
+  SERIALS = [ '208850', '665455', '123456' ]
+
+  def setUp(self):
+    self.pumps = dict([ ('/dev/stick%s' % i, simulator.SimulatedPump(serial=serial))
+                        for i, serial in enumerate(self.SERIALS) ])
+    self.ports = sorted(self.pumps)
+
+  def open_link(self, port):
+    if self.pumps[port] is None:
+      raise IOError("no such stick %s" % port)
+    return simulator.SimulatedLink(self.pumps[port], latency=0, frame_time=0)
+
+  def make(self, **kwds):
+    bindings = supervisor.bind(self.SERIALS, ports=self.ports)
+    return supervisor.Supervisor(bindings, open_link=self.open_link, **kwds)
+
+  def test_every_pump_answers(self):
+    outcomes = self.make( ).run(lambda pump: pump.serial)
+    self.assertEqual(sorted([ o['result'] for o in outcomes ]), sorted(self.SERIALS))
+    self.assertEqual([ o['error'] for o in outcomes ], [ None ] * 3)
+
+  def test_bound_sticks_are_not_scanned(self):
+    bound = [ supervisor.Binding('/dev/stick1', self.SERIALS[1]) ]
+    scan_all, scan.scan_all = scan.scan_all, lambda: list(self.ports)
+    try:
+      bindings = bound + supervisor.bind([ self.SERIALS[0], self.SERIALS[2] ], taken=bound)
+    finally:
+      scan.scan_all = scan_all
+    self.assertEqual(sorted([ b.port for b in bindings ]), self.ports)
+    outcomes = supervisor.Supervisor(bindings, open_link=self.open_link).run(lambda pump: pump.serial)
+    self.assertEqual(dict([ (o['port'], o['result']) for o in outcomes ]),
+                     dict(zip(self.ports, self.SERIALS)))
+
+  def test_failing_device_is_isolated(self):
+    self.pumps['/dev/stick1'] = None
+    outcomes = dict([ (o['port'], o) for o in self.make( ).run(lambda pump: pump.modelNumber) ])
+    self.assertEqual(outcomes['/dev/stick1']['error'], 'IOError: no such stick /dev/stick1')
+    self.assertEqual(outcomes['/dev/stick0']['result'], '522')
+    self.assertEqual(outcomes['/dev/stick2']['result'], '522')
+
+  def test_full_sink_holds_workers(self):
+    supervise = self.make(maxsize=1)
+    supervise.start(lambda pump: pump.serial)
+    time.sleep(2.5)
+    self.assertEqual(supervise.sink.qsize( ), 1)
+    self.assertEqual(len([ w for w in supervise.workers if w.is_alive( ) ]), 2)
+    self.assertEqual(len(list(supervise.results( ))), 3)
+
+  def test_slow_consumer_holds_workers(self):
+    supervise = self.make( )
+    self.assertTrue(supervise.backlog < len(self.SERIALS))
+    done = [ ]
+    supervise.start(lambda pump: done.append(pump.serial) or pump.serial)
+    deadline = time.time( ) + 10
+    while len(done) < len(self.SERIALS) and time.time( ) < deadline:
+      time.sleep(.05)
+    # every job is done, but only backlog outcomes fit in the sink
+    time.sleep(.1)
+    self.assertEqual(supervise.sink.qsize( ), supervise.backlog)
+    held = [ w for w in supervise.workers if w.is_alive( ) ]
+    self.assertEqual(len(held), len(self.SERIALS) - supervise.backlog)
+    outcomes = [ ]
+    for outcome in supervise.results( ):
+      outcomes.append(outcome)
+      time.sleep(.1)
+    self.assertEqual(sorted([ o['result'] for o in outcomes ]), sorted(self.SERIALS))
+
+  def test_init_wakes_every_pump(self):
+    effectTime, commands.PowerControl.effectTime = commands.PowerControl.effectTime, 0
+    try:
+      outcomes = self.make(init=True, minutes=3).run(lambda pump: pump.modelNumber)
+    finally:
+      commands.PowerControl.effectTime = effectTime
+    self.assertEqual([ o['error'] for o in outcomes ], [ None ] * 3)
+    for pump in self.pumps.values( ):
+      self.assertEqual([ code for code, params in pump.received ][:2], [ POWER_CONTROL, READ_MODEL ])
+      self.assertEqual(pump.received[0][1][:2], [ 0x01, 3 ])
+
+  def test_bind_needs_a_stick_per_pump(self):
+    self.assertRaises(ValueError, supervisor.bind, self.SERIALS, ports=self.ports[:2])
+    bindings = supervisor.bind(self.SERIALS[:2], ports=self.ports)
+    self.assertEqual([ str(b) for b in bindings ], [ '/dev/stick0=208850', '/dev/stick1=665455' ])
+
+if __name__ == '__main__':
+  unittest.main( )